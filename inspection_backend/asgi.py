@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "inspection_backend.settings")
 
 application = get_asgi_application()
+
+from jobs.worker import start_with_requests  # noqa: E402
+
+start_with_requests()
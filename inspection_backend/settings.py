@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 from dotenv import load_dotenv
 import logging
 from datetime import timedelta
@@ -53,9 +54,11 @@ INSTALLED_APPS = [
     "projects",
     "inspections",
     "django_filters",
+    "jobs",
 ]
 
 MIDDLEWARE = [
+    "project_utils.middleware.QueryInstrumentationMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -104,9 +107,7 @@ DATABASES = {
 
 REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
-    "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
-    ),
+    "DEFAULT_AUTHENTICATION_CLASSES": ("users.authentication.CachedJWTAuthentication",),
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
     "PAGE_SIZE": 30,
 }
@@ -200,3 +201,81 @@ AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_DEFAULT_REGION = "ca-central-1"
 FRONTEND_URL = os.getenv("FRONTEND_URL")
+
+# Per-request query instrumentation, see project_utils/middleware.py
+# off unless enabled, the headers expose query counts and timings
+QUERY_INSTRUMENTATION_HEADERS = os.getenv(
+    "QUERY_INSTRUMENTATION_HEADERS", ""
+).lower() in ("1", "true", "yes")
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 5))
+
+# Rows per INSERT statement for bulk created logs and notifications
+BULK_CREATE_BATCH_SIZE = int(os.getenv("BULK_CREATE_BATCH_SIZE", 500))
+
+# Background jobs, see jobs/utils.py
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_POLL_INTERVAL = 5
+JOB_LOCK_TIMEOUT = timedelta(minutes=10)
+JOB_RUN_EAGERLY = False
+
+# Images of the PDF reports, see project_utils/assets.py
+# pixels of the longest side, twice the 100px the report shows them at
+REPORT_IMAGE_SIZE = int(os.getenv("REPORT_IMAGE_SIZE", 200))
+REPORT_ASSET_WORKERS = int(os.getenv("REPORT_ASSET_WORKERS", 16))
+REPORT_ASSET_TIMEOUT = 10
+REPORT_ASSET_CACHE_DIR = os.getenv(
+    "REPORT_ASSET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "report-assets")
+)
+REPORT_ASSET_CACHE_MAX_BYTES = int(
+    os.getenv("REPORT_ASSET_CACHE_MAX_BYTES", 512 * 1024 * 1024)
+)
+
+# PDF render processes, see project_utils/rendering.py, 0 renders in process
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", 2))
+PDF_RENDER_QUEUE_SIZE = int(os.getenv("PDF_RENDER_QUEUE_SIZE", 8))
+# seconds a render may take, and wait for a free process
+PDF_RENDER_TIMEOUT = int(os.getenv("PDF_RENDER_TIMEOUT", 120))
+PDF_RENDER_MAX_RENDERS = int(os.getenv("PDF_RENDER_MAX_RENDERS", 20))
+PDF_RENDER_MEMORY_LIMIT = int(os.getenv("PDF_RENDER_MEMORY_LIMIT", 1024**3))
+PDF_RENDER_START_METHOD = "spawn"
+
+# Transactional email outbox, see jobs/outbox.py
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", 50))
+# messages per second, the default SES sending rate, 0 for no limit
+EMAIL_OUTBOX_RATE_LIMIT = float(os.getenv("EMAIL_OUTBOX_RATE_LIMIT", 14))
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+# seconds before the first retry, doubled on every attempt
+EMAIL_OUTBOX_RETRY_DELAY = 60
+EMAIL_OUTBOX_RETENTION = timedelta(days=30)
+# seconds the sender lease outlives a sender that died without releasing it
+EMAIL_OUTBOX_LEASE_TIMEOUT = 60
+
+# Homes upserted per statement by projects.utils.HomeImporter
+HOME_IMPORT_CHUNK_SIZE = int(os.getenv("HOME_IMPORT_CHUNK_SIZE", 2000))
+
+# Shared by all processes. users/authentication.py and users/utils.py only
+# cache through Redis, as each read of DatabaseCache is a query. Its table is
+# created by the users migrations.
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+            "LOCATION": "django_cache",
+        }
+    }
+
+# Seconds a user snapshot is cached by users.authentication.CachedJWTAuthentication
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv("AUTH_USER_CACHE_TIMEOUT", 300))
+
+# In process filter of blacklisted tokens, see users/utils.py
+TOKEN_BLACKLIST_FILTER_MAX_AGE = int(os.getenv("TOKEN_BLACKLIST_FILTER_MAX_AGE", 300))
+TOKEN_BLACKLIST_FILTER_CAPACITY = int(
+    os.getenv("TOKEN_BLACKLIST_FILTER_CAPACITY", 100000)
+)
@@ -21,6 +21,7 @@ from drf_spectacular.views import (
     SpectacularRedocView,
     SpectacularSwaggerView,
 )
+from project_utils.views import QueryReportView
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -28,6 +29,11 @@ urlpatterns = [
     path("", include("users.urls")),
     path("", include("projects.urls")),
     path("", include("inspections.urls")),
+    path(
+        "instrumentation/queries/",
+        QueryReportView.as_view(),
+        name="query-report",
+    ),
     path(
         "api/schema/swagger/",
         SpectacularSwaggerView.as_view(url_name="schema"),
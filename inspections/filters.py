@@ -1,8 +1,6 @@
 import django_filters
 from inspections.models import Deficiency, HomeInspection
 from django.db.models import (
-    Count,
-    Q,
     IntegerField,
     Value,
     CharField,
@@ -10,11 +8,30 @@ from django.db.models import (
     When,
     F,
     ExpressionWrapper,
+    DurationField,
+)
+from django.db.models.functions import (
+    Cast,
+    Concat,
+    StrIndex,
+    Left,
+    Now,
+    Coalesce,
+    TruncDate,
 )
-from django.db.models.functions import Cast, Concat, StrIndex, Left, ExtractDay, Now
 from datetime import date
 
 
+def sort_keys(field, sort_order):
+    """
+    Orders by field then id, with NULLs last ascending and first descending,
+    the ordering inspections.utils.get_adjacent_ids navigates
+    """
+    if sort_order == "desc":
+        return [F(field).desc(nulls_first=True), "id"]
+    return [F(field).asc(nulls_last=True), "id"]
+
+
 class DeficiencyFilter(django_filters.FilterSet):
     inspection_id = django_filters.UUIDFilter(
         field_name="home_inspection__inspection__id"
@@ -33,9 +50,7 @@ class DeficiencyFilter(django_filters.FilterSet):
     project_id = django_filters.UUIDFilter(
         field_name="home_inspection__home__project__id"
     )
-    builder_id = django_filters.UUIDFilter(
-        field_name="home_inspection__inspection__builder__id"
-    )
+    builder_id = django_filters.UUIDFilter(field_name="builder__id")
     street_no = django_filters.CharFilter(field_name="home_inspection__home__street_no")
     sort_by = django_filters.ChoiceFilter(
         choices=[
@@ -98,13 +113,11 @@ class DeficiencyFilter(django_filters.FilterSet):
         elif sort_by == "home_address":
             # Concatenate address components similar to get_home_address in serializer
             queryset = queryset.order_by(
-                f"{'-' if sort_order == 'desc' else ''}home_inspection__home__address"
+                *sort_keys("home_inspection__home__address", sort_order)
             )
 
         elif sort_by == "location":
-            queryset = queryset.order_by(
-                f"{'-' if sort_order == 'desc' else ''}location"
-            )
+            queryset = queryset.order_by(*sort_keys("location", sort_order))
 
         elif sort_by == "status":
             # Custom ordering for status
@@ -126,7 +139,7 @@ class DeficiencyFilter(django_filters.FilterSet):
             }
             queryset = queryset.annotate(
                 status_order=status_order[sort_order]
-            ).order_by("status_order")
+            ).order_by("status_order", "id")
 
         elif sort_by == "trade":
             queryset = queryset.annotate(
@@ -136,35 +149,25 @@ class DeficiencyFilter(django_filters.FilterSet):
                     F("trade__last_name"),
                     output_field=CharField(),
                 )
-            ).order_by(f"{'-' if sort_order == 'desc' else ''}trade_name")
+            ).order_by(*sort_keys("trade_name", sort_order))
 
         elif sort_by == "created_at":
-            queryset = queryset.order_by(
-                f"{'-' if sort_order == 'desc' else ''}created_at"
-            )
+            queryset = queryset.order_by(*sort_keys("created_at", sort_order))
 
         elif sort_by == "due_date":
             queryset = queryset.order_by(
-                f"{'-' if sort_order == 'desc' else ''}home_inspection__due_date"
+                *sort_keys("home_inspection__due_date", sort_order)
             )
 
         elif sort_by == "outstanding_days":
             # Calculate outstanding days similar to get_outstanding_days in serializer
             queryset = queryset.annotate(
-                days_outstanding=Case(
-                    When(
-                        completion_date__isnull=False,
-                        then=ExtractDay(
-                            F("completion_date")
-                            - Cast(F("created_at"), output_field=CharField())
-                        ),
-                    ),
-                    default=ExtractDay(
-                        Now() - Cast(F("created_at"), output_field=CharField())
-                    ),
-                    output_field=IntegerField(),
+                days_outstanding=ExpressionWrapper(
+                    Coalesce(F("completion_date"), TruncDate(Now()))
+                    - TruncDate(F("created_at")),
+                    output_field=DurationField(),
                 )
-            ).order_by(f"{'-' if sort_order == 'desc' else ''}days_outstanding")
+            ).order_by(*sort_keys("days_outstanding", sort_order))
 
         return queryset
 
@@ -199,27 +202,10 @@ class HomeInspectionFilter(django_filters.FilterSet):
         sort_order = self.data.get("sort_order", "desc")
 
         if sort_by in ["total_items", "completed_items", "pending_items"]:
-            if sort_by == "total_items":
-                queryset = queryset.annotate(
-                    total_items_count=Count("deficiencies")
-                ).order_by(f"{'-' if sort_order == 'desc' else ''}total_items_count")
-            elif sort_by == "completed_items":
-                queryset = queryset.annotate(
-                    completed_items_count=Count(
-                        "deficiencies", filter=Q(deficiencies__status="complete")
-                    )
-                ).order_by(
-                    f"{'-' if sort_order == 'desc' else ''}completed_items_count"
-                )
-            elif sort_by == "pending_items":
-                queryset = queryset.annotate(
-                    pending_items_count=Count(
-                        "deficiencies",
-                        filter=Q(
-                            deficiencies__status__in=["incomplete", "pending_approval"]
-                        ),
-                    )
-                ).order_by(f"{'-' if sort_order == 'desc' else ''}pending_items_count")
+            # Deficiency counters are stored on the home inspection
+            queryset = queryset.order_by(
+                f"{'-' if sort_order == 'desc' else ''}{sort_by}"
+            )
         elif sort_by == "lot_no":
             # Sort by lot_no numerically, handling formats like "01-001", "02-003", "15", "32-19"
             # Extract the number before the dash (or the whole number if no dash)
@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from inspections.models import Deficiency, HomeInspection
+from inspections.utils import (
+    bulk_create_deficiency_creation_records,
+    bulk_create_deficiency_notifications,
+    bulk_create_deficiency_update_logs,
+    send_inspection_report_email,
+)
+from jobs.utils import job
+
+User = get_user_model()
+
+
+def get_user(user_id):
+    return User.objects.filter(pk=user_id).first() if user_id else None
+
+
+@job("inspections.create_deficiency_update_logs", concurrency=2)
+def create_deficiency_update_logs(changes, deficiency_id, actor_id):
+    deficiency = Deficiency.objects.get(pk=deficiency_id)
+    bulk_create_deficiency_update_logs(changes, deficiency, get_user(actor_id))
+
+
+@job("inspections.create_deficiency_notifications", concurrency=2)
+def create_deficiency_notifications(
+    changes, deficiency_id, actor_id, notification_user_ids, builder_user_id
+):
+    deficiency = Deficiency.objects.select_related("trade").get(pk=deficiency_id)
+    if actor_id == builder_user_id:
+        # Builder cannot be notified for their own actions
+        builder_user_id = None
+    bulk_create_deficiency_notifications(
+        changes,
+        deficiency,
+        get_user(actor_id),
+        User.objects.filter(id__in=notification_user_ids),
+        get_user(builder_user_id),
+    )
+
+
+@job("inspections.create_deficiency_creation_records", concurrency=2)
+def create_deficiency_creation_records(deficiency_ids, actor_id, builder_user_id):
+    deficiencies = Deficiency.objects.filter(id__in=deficiency_ids).order_by("id")
+    bulk_create_deficiency_creation_records(
+        deficiencies, get_user(actor_id), get_user(builder_user_id)
+    )
+
+
+# Rendering the report is memory hungry so only one runs at a time
+@job("inspections.send_inspection_report_email", max_attempts=3, retry_delay=60)
+def send_inspection_report(home_inspection_id, base_url):
+    home_inspection = HomeInspection.objects.select_related(
+        "home__project__builder", "inspection__builder"
+    ).get(pk=home_inspection_id)
+    send_inspection_report_email(home_inspection, base_url)
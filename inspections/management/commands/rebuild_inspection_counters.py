@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from inspections.utils import rebuild_home_inspection_counters
+
+
+class Command(BaseCommand):
+    help = "Recalculates the deficiency counters of home inspections that drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            corrected = rebuild_home_inspection_counters(options["batch_size"])
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Corrected counters of {corrected} home inspections")
+        )
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F
+from inspections.models import Inspection
+from projects.models import Project
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks Inspection.no_of_def and Project.no_of_homes against the actual "
+        "number of deficiencies and homes and optionally fixes them"
+    )
+
+    # counter field, related lookup that is counted
+    COUNTERS = [
+        (Inspection, "no_of_def", "homeinspection__deficiencies"),
+        (Project, "no_of_homes", "homes"),
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix", action="store_true", help="Correct the drifted counters"
+        )
+
+    def handle(self, *args, **options):
+        total_drifted = 0
+
+        for model, field, lookup in self.COUNTERS:
+            # one grouped query per counter returning only the drifted rows
+            drifted = (
+                model.objects.annotate(actual=Count(lookup))
+                .exclude(**{field: F("actual")})
+                .values_list("id", field, "actual")
+            )
+
+            for pk, stored, actual in drifted.iterator():
+                total_drifted += 1
+                self.stdout.write(
+                    f"{model.__name__} {pk}: {field} is {stored}, expected {actual}"
+                )
+                if options["fix"]:
+                    # apply the difference so concurrent increments are kept
+                    with transaction.atomic():
+                        model.objects.filter(pk=pk).update(
+                            **{field: F(field) + (actual - stored)}
+                        )
+
+        if not total_drifted:
+            self.stdout.write(self.style.SUCCESS("All counters are consistent"))
+        elif options["fix"]:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {total_drifted} counters"))
+        else:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"{total_drifted} counters drifted, run with --fix to correct them"
+                )
+            )
@@ -0,0 +1,52 @@
+# Generated by Django 5.0.6 on 2026-10-18 17:48
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_deficiency_counters(apps, schema_editor):
+    HomeInspection = apps.get_model("inspections", "HomeInspection")
+    Deficiency = apps.get_model("inspections", "Deficiency")
+
+    def count_deficiencies(**filters):
+        deficiencies = (
+            Deficiency.objects.filter(home_inspection=OuterRef("pk"), **filters)
+            .order_by()
+            .values("home_inspection")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        return Coalesce(Subquery(deficiencies), 0)
+
+    HomeInspection.objects.update(
+        total_items=count_deficiencies(),
+        completed_items=count_deficiencies(status="complete"),
+        pending_items=count_deficiencies(status__in=["incomplete", "pending_approval"]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inspections", "0020_deficiency_edit_description"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="homeinspection",
+            name="completed_items",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="homeinspection",
+            name="pending_items",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="homeinspection",
+            name="total_items",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_deficiency_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:12
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the indexes are built without locking writes to the tables, the single
+    # column indexes they replace are dropped by 0025_drop_foreign_key_indexes
+    atomic = False
+
+    dependencies = [
+        ("inspections", "0022_inspectionreport"),
+        ("projects", "0018_home_created_at_home_updated_at"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="deficiency",
+            index=models.Index(
+                fields=["trade", "status"], name="inspections_trade_i_f85f4b_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="deficiency",
+            index=models.Index(
+                fields=["home_inspection", "status"],
+                name="inspections_home_in_4737ea_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="deficiencynotification",
+            index=models.Index(
+                fields=["user", "-id"], name="inspections_user_id_010b10_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="deficiencynotification",
+            index=models.Index(
+                fields=["user", "read"], name="inspections_user_id_fb20bd_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="deficiencyupdatelog",
+            index=models.Index(
+                fields=["deficiency", "-created_at"],
+                name="inspections_deficie_4ebb28_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="homeinspection",
+            index=models.Index(
+                fields=["inspection", "due_date"], name="inspections_inspect_f3ba0c_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="homeinspection",
+            index=models.Index(
+                fields=["home", "-updated_at"], name="inspections_home_id_833125_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_builder(apps, schema_editor):
+    Inspection = apps.get_model("inspections", "Inspection")
+    HomeInspection = apps.get_model("inspections", "HomeInspection")
+    Deficiency = apps.get_model("inspections", "Deficiency")
+
+    HomeInspection.objects.update(
+        builder=Subquery(
+            Inspection.objects.filter(pk=OuterRef("inspection")).values("builder")
+        )
+    )
+    Deficiency.objects.update(
+        builder=Subquery(
+            HomeInspection.objects.filter(pk=OuterRef("home_inspection")).values(
+                "builder"
+            )
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inspections", "0023_composite_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deficiency",
+            name="builder",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="builder_deficiencies",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="homeinspection",
+            name="builder",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="builder_home_inspections",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="deficiency",
+            index=models.Index(
+                fields=["builder", "status"], name="inspections_builder_3cfc02_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_builder, migrations.RunPython.noop),
+    ]
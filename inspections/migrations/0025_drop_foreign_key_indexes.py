@@ -0,0 +1,103 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# single column indexes of foreign keys that lead the composite indexes of
+# 0023_composite_indexes, named as Django created them
+FOREIGN_KEY_INDEXES = [
+    ("inspections_deficiency", "home_inspection_id", "fee56093"),
+    ("inspections_deficiency", "trade_id", "40d2d880"),
+    ("inspections_deficiencynotification", "user_id", "43d72367"),
+    ("inspections_deficiencyupdatelog", "deficiency_id", "160cc9a4"),
+    ("inspections_homeinspection", "home_id", "d04ae2a2"),
+    ("inspections_homeinspection", "inspection_id", "44a85a16"),
+]
+
+
+class Migration(migrations.Migration):
+    # DROP INDEX CONCURRENTLY cannot run in a transaction
+    atomic = False
+
+    dependencies = [
+        ("inspections", "0024_builder_denormalization"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    f"DROP INDEX CONCURRENTLY IF EXISTS {table}_{column}_{suffix};",
+                    reverse_sql=(
+                        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS "
+                        f"{table}_{column}_{suffix} ON {table} ({column});"
+                    ),
+                )
+                for table, column, suffix in FOREIGN_KEY_INDEXES
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name="deficiency",
+                    name="home_inspection",
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="deficiencies",
+                        to="inspections.homeinspection",
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="deficiency",
+                    name="trade",
+                    field=models.ForeignKey(
+                        blank=True,
+                        db_index=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="deficiencies",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="deficiencynotification",
+                    name="user",
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="deficiency_notifications",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="deficiencyupdatelog",
+                    name="deficiency",
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="update_logs",
+                        to="inspections.deficiency",
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="homeinspection",
+                    name="home",
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="projects.home",
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="homeinspection",
+                    name="inspection",
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="inspections.inspection",
+                    ),
+                ),
+            ],
+        ),
+    ]
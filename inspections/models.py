@@ -1,5 +1,7 @@
-from typing import Iterable
-from django.db import models
+from collections import Counter, defaultdict
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F
 import uuid
 from django.utils import timezone
 
@@ -16,26 +18,105 @@ class Inspection(models.Model):
     def __str__(self) -> str:
         return f"{self.id} {self.name}"
 
+    def save(self, *args, **kwargs):
+        """no_of_def is only changed through F() updates, see Deficiency.update_counters"""
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "no_of_def"
+            ]
+        super().save(*args, **kwargs)
+
 
 class HomeInspection(models.Model):
-    inspection = models.ForeignKey("inspections.Inspection", on_delete=models.CASCADE)
-    home = models.ForeignKey("projects.Home", on_delete=models.CASCADE)
+    # indexed as the first column of Meta.indexes
+    inspection = models.ForeignKey(
+        "inspections.Inspection", on_delete=models.CASCADE, db_index=False
+    )
+    home = models.ForeignKey("projects.Home", on_delete=models.CASCADE, db_index=False)
+    # builder of the inspection and of the home's project, copied so tenant
+    # queries need no joins
+    builder = models.ForeignKey(
+        "users.User",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="builder_home_inspections",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     is_reviewed = models.BooleanField(default=False)
     owner_visibility = models.BooleanField(default=False)
     inspector = models.CharField(max_length=128, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
     due_date = models.DateField(null=True, blank=True)
+    # Deficiency counters maintained by Deficiency.save and the delete signals
+    total_items = models.IntegerField(default=0)
+    completed_items = models.IntegerField(default=0)
+    pending_items = models.IntegerField(default=0)
+
+    COUNTER_FIELDS = ["total_items", "completed_items", "pending_items"]
+
+    class Meta:
+        indexes = [
+            # home inspections of an inspection sorted by due date
+            models.Index(fields=["inspection", "due_date"]),
+            # inspections of a home, latest first
+            models.Index(fields=["home", "-updated_at"]),
+        ]
 
     def __str__(self) -> str:
         return f"{self.id} {self.inspection.name}"
 
-    def delete(self, *args, **kwargs):
-        """Subtract the count of deficiencies from Inspection model before deletion"""
-        deficiency_count = self.deficiencies.count()
-        self.inspection.no_of_def -= deficiency_count
-        self.inspection.save()
-        super().delete(*args, **kwargs)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the inspection and home the builder was checked against
+        instance._builder_of = (
+            instance.__dict__.get("inspection_id"),
+            instance.__dict__.get("home_id"),
+        )
+        return instance
+
+    def check_builder(self):
+        """The inspection and the home's project must have the same builder"""
+        if self.inspection.builder_id != self.home.project.builder_id:
+            raise ValidationError(
+                "The inspection and the home belong to different builders"
+            )
+
+    def save(self, *args, **kwargs):
+        """
+        Counters are only changed through F() updates, so a regular save
+        must not write back the possibly stale values held by this instance.
+        The builder, which is also the builder of the home's project, is
+        copied from the inspection, and to the deficiencies when the home
+        inspection is moved to another inspection or home.
+        """
+        is_new = self._state.adding
+        moved = (self.inspection_id, self.home_id) != getattr(self, "_builder_of", None)
+        if moved:
+            self.check_builder()
+            self.builder_id = self.inspection.builder_id
+
+        update_fields = kwargs.get("update_fields")
+        if not is_new and update_fields is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        elif moved and update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "builder"}
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if moved and not is_new:
+                Deficiency.objects.filter(home_inspection=self).update(
+                    builder_id=self.builder_id
+                )
+        self._builder_of = (self.inspection_id, self.home_id)
 
 
 class Deficiency(models.Model):
@@ -48,6 +129,7 @@ class Deficiency(models.Model):
         "inspections.HomeInspection",
         on_delete=models.CASCADE,
         related_name="deficiencies",
+        db_index=False,
     )
     location = models.CharField(max_length=128, null=True, blank=True)
     trade = models.ForeignKey(
@@ -56,6 +138,17 @@ class Deficiency(models.Model):
         null=True,
         blank=True,
         related_name="deficiencies",
+        db_index=False,
+    )
+    # builder of the home inspection, copied so tenant queries need no joins
+    builder = models.ForeignKey(
+        "users.User",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="builder_deficiencies",
+        db_index=False,
     )
     description = models.TextField()
     edit_description = models.TextField(null=True, blank=True)
@@ -65,23 +158,114 @@ class Deficiency(models.Model):
     is_reviewed = models.BooleanField(default=False)
     completion_date = models.DateField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # deficiencies of a trade or a home inspection, counted per status
+            models.Index(fields=["trade", "status"]),
+            models.Index(fields=["home_inspection", "status"]),
+            models.Index(fields=["builder", "status"]),
+        ]
+
     def __str__(self) -> str:
         return f"{self.id} {self.home_inspection}"
 
+    @staticmethod
+    def update_counters(home_inspection_id, status, count, no_of_def=True):
+        """
+        Add count to the total and status counters of a home inspection
+        and to no_of_def of its inspection, without reading them first
+        """
+        status_counter = "completed_items" if status == "complete" else "pending_items"
+        HomeInspection.objects.filter(pk=home_inspection_id).update(
+            total_items=F("total_items") + count,
+            **{status_counter: F(status_counter) + count},
+        )
+        if no_of_def:
+            Inspection.objects.filter(homeinspection=home_inspection_id).update(
+                no_of_def=F("no_of_def") + count
+            )
+
+    @staticmethod
+    def update_counters_in_bulk(counts):
+        """
+        Add {(home inspection id, status): count} to the counters with one
+        UPDATE per home inspection and one per inspection
+        """
+        home_inspection_counts = defaultdict(Counter)
+        for (home_inspection_id, status), count in counts.items():
+            status_counter = (
+                "completed_items" if status == "complete" else "pending_items"
+            )
+            home_inspection_counts[home_inspection_id]["total_items"] += count
+            home_inspection_counts[home_inspection_id][status_counter] += count
+
+        inspection_counts = Counter()
+        for home_inspection_id, inspection_id in HomeInspection.objects.filter(
+            pk__in=home_inspection_counts
+        ).values_list("pk", "inspection_id"):
+            inspection_counts[inspection_id] += home_inspection_counts[
+                home_inspection_id
+            ]["total_items"]
+
+        for home_inspection_id, counters in home_inspection_counts.items():
+            HomeInspection.objects.filter(pk=home_inspection_id).update(
+                **{name: F(name) + count for name, count in counters.items()}
+            )
+        for inspection_id, count in inspection_counts.items():
+            Inspection.objects.filter(pk=inspection_id).update(
+                no_of_def=F("no_of_def") + count
+            )
+
     def save(self, *args, **kwargs):
-        """Maintain no_of_def in Inspection model and set completion date if status is complete"""
+        """
+        Maintain no_of_def in Inspection model, the deficiency counters of the
+        home inspection, the builder copied from the home inspection and set
+        completion date if status is complete
+        """
 
-        is_new = self.pk is None
         # Check if the status is being updated to 'complete'
         if self.status == "complete" and self.completion_date is None:
             self.completion_date = timezone.now().date()
 
-        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        with transaction.atomic():
+            # what the counters include is read from the locked row, not from
+            # this instance, which a concurrent save may have made stale
+            counted_as = self.get_counted_as(lock=True)
+            is_new = counted_as is None
+            counts_as = (self.home_inspection_id, self.status)
+            if not is_new and update_fields is not None:
+                # fields left out of update_fields keep the stored value
+                counts_as = tuple(
+                    value if name in update_fields else stored
+                    for name, value, stored in zip(
+                        ("home_inspection", "status"), counts_as, counted_as
+                    )
+                )
+
+            if is_new or counted_as[0] != counts_as[0]:
+                self.builder_id = self.home_inspection.builder_id
+                if update_fields is not None:
+                    kwargs["update_fields"] = {*update_fields, "builder"}
+
+            super().save(*args, **kwargs)
+
+            if is_new:
+                self.update_counters(*counts_as, 1)
+            elif counted_as != counts_as:
+                # no_of_def only changes when moved to another home inspection
+                moved = counted_as[0] != counts_as[0]
+                self.update_counters(*counted_as, -1, no_of_def=moved)
+                self.update_counters(*counts_as, 1, no_of_def=moved)
 
-        # Only increase the deficiency count if the deficiency is created
-        if is_new:
-            self.home_inspection.inspection.no_of_def += 1
-            self.home_inspection.inspection.save()
+    def get_counted_as(self, lock=False):
+        """(home inspection id, status) of the stored row, None if not stored"""
+        if self.pk is None:
+            return None
+        rows = Deficiency.objects.filter(pk=self.pk)
+        if lock:
+            rows = rows.select_for_update()
+        return rows.values_list("home_inspection_id", "status").first()
 
 
 class DefImage(models.Model):
@@ -93,12 +277,15 @@ class DefImage(models.Model):
 
 class DeficiencyUpdateLog(models.Model):
     deficiency = models.ForeignKey(
-        Deficiency, on_delete=models.CASCADE, related_name="update_logs"
+        Deficiency, on_delete=models.CASCADE, related_name="update_logs", db_index=False
     )
     actor_name = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
     description = models.TextField()
 
+    class Meta:
+        indexes = [models.Index(fields=["deficiency", "-created_at"])]
+
     def __str__(self):
         return f"Update on Deficiency {self.deficiency.id} by {self.actor_name}"
 
@@ -111,10 +298,21 @@ class DeficiencyNotification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     description = models.TextField()
     user = models.ForeignKey(
-        "users.User", on_delete=models.CASCADE, related_name="deficiency_notifications"
+        "users.User",
+        on_delete=models.CASCADE,
+        related_name="deficiency_notifications",
+        db_index=False,
     )
     read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # notifications of a user, latest first
+            models.Index(fields=["user", "-id"]),
+            # unread notifications of a user
+            models.Index(fields=["user", "read"]),
+        ]
+
     def __str__(self):
         return f"Notification for Deficiency {self.deficiency.id} by {self.actor_name}"
 
@@ -133,3 +331,17 @@ class HomeInspectionReview(models.Model):
         super().save(*args, **kwargs)
         self.home_inspection.is_reviewed = True
         self.home_inspection.save()
+
+
+class InspectionReport(models.Model):
+    """
+    Last rendered PDF report of a home inspection, reused as long as the
+    hash of the data the report is rendered from stays the same
+    """
+
+    home_inspection = models.OneToOneField(
+        "inspections.HomeInspection", on_delete=models.CASCADE, related_name="report"
+    )
+    content_hash = models.CharField(max_length=64)
+    pdf = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
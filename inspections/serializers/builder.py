@@ -9,15 +9,21 @@ from inspections.models import (
 from rest_framework import serializers
 from datetime import date
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.db.models import F, prefetch_related_objects
+from django.utils import timezone
 from django.utils.text import Truncator
-from inspections.utils import send_inspection_report_email
-import threading
 from inspections.utils import get_notification_users
-from inspections.utils import DeficiencyUpdateLogsCreationThread
-from inspections.utils import DeficiencyNotificationsCreationThread
-from inspections.utils import create_due_date_change_logs
+from inspections.jobs import (
+    create_deficiency_creation_records,
+    create_deficiency_notifications,
+    create_deficiency_update_logs,
+    send_inspection_report,
+)
 from inspections.utils import create_due_date_change_logs
+from inspections.utils import get_adjacent_ids
+from inspections.utils import BULK_CREATE_BATCH_SIZE
 
 User = get_user_model()
 
@@ -41,8 +47,31 @@ class DefImageSerializer(serializers.ModelSerializer):
         read_only_fields = ["id"]
 
 
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolves primary keys from objects the parent serializer loaded into the
+    context in one query, instead of querying once per nested item
+    """
+
+    def __init__(self, context_key, **kwargs):
+        self.context_key = context_key
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get(self.context_key, {})
+        if str(data) in preloaded:
+            return preloaded[str(data)]
+        return super().to_internal_value(data)
+
+
 class DefCreateSerializer(serializers.ModelSerializer):
     images = DefImageSerializer(many=True, required=False)
+    trade = PreloadedPrimaryKeyRelatedField(
+        "trades",
+        queryset=User.objects.all(),
+        required=False,
+        allow_null=True,
+    )
 
     class Meta:
         model = Deficiency
@@ -82,34 +111,71 @@ class HomeInspectionCreateSerializer(serializers.ModelSerializer):
         ]
         write_only_fields = ["home", "inspection"]
 
+    def to_internal_value(self, data):
+        # Load the trades of all nested deficiencies at once
+        deficiencies_data = data.get("deficiencies")
+        if isinstance(deficiencies_data, list):
+            trade_ids = {
+                str(deficiency_data["trade"])
+                for deficiency_data in deficiencies_data
+                if isinstance(deficiency_data, dict) and deficiency_data.get("trade")
+            }
+            try:
+                trades = User.objects.filter(id__in=trade_ids)
+                self.context["trades"] = {str(trade.id): trade for trade in trades}
+            except ValidationError:
+                # invalid ids are reported by the trade field itself
+                pass
+        return super().to_internal_value(data)
+
+    @transaction.atomic
     def create(self, validated_data):
         deficiencies_data = validated_data.pop("deficiencies", [])
         user = self.context["request"].user
         builder_user = validated_data.get("inspection").builder
-        notification_users = get_notification_users(user, deficiencies_data.first())
 
-        # Create HomeInspection instance
-        home_inspection = HomeInspection.objects.create(**validated_data)
-
-        # Create associated Deficiencies
+        deficiencies = []
+        images = []
         for deficiency_data in deficiencies_data:
             images_data = deficiency_data.pop("images", [])
-            deficiency = Deficiency.objects.create(
-                home_inspection=home_inspection, **deficiency_data
+            deficiency = Deficiency(**deficiency_data)
+            # Deficiency.save is bypassed by bulk_create
+            if deficiency.status == "complete" and deficiency.completion_date is None:
+                deficiency.completion_date = timezone.now().date()
+            deficiencies.append(deficiency)
+            images.extend(
+                DefImage(deficiency=deficiency, **image_data)
+                for image_data in images_data
             )
-            changes = [
-                f"{user.get_full_name()} Created a new Deficiency: {deficiency.id}"
-            ]
-            # Create notifications
-            notifications_thread = DeficiencyNotificationsCreationThread(
-                changes, deficiency, user, notification_users, builder_user
-            )
-            notifications_thread.start()
 
-            # Create associated DefImages
-            for image_data in images_data:
-                DefImage.objects.create(deficiency=deficiency, **image_data)
+        # Create HomeInspection instance with its counters already set
+        completed_items = len([d for d in deficiencies if d.status == "complete"])
+        home_inspection = HomeInspection.objects.create(
+            **validated_data,
+            total_items=len(deficiencies),
+            completed_items=completed_items,
+            pending_items=len(deficiencies) - completed_items,
+        )
+
+        # Create associated Deficiencies and DefImages in bulk
+        for deficiency in deficiencies:
+            deficiency.home_inspection = home_inspection
+            deficiency.builder_id = home_inspection.builder_id
+        Deficiency.objects.bulk_create(deficiencies, batch_size=BULK_CREATE_BATCH_SIZE)
+        DefImage.objects.bulk_create(images, batch_size=BULK_CREATE_BATCH_SIZE)
 
+        if deficiencies:
+            Inspection.objects.filter(pk=home_inspection.inspection_id).update(
+                no_of_def=F("no_of_def") + len(deficiencies)
+            )
+            # Create logs and notifications once the deficiencies are committed
+            create_deficiency_creation_records.enqueue(
+                deficiency_ids=[deficiency.id for deficiency in deficiencies],
+                actor_id=user.id if user else None,
+                builder_user_id=builder_user.id,
+            )
+
+        prefetch_related_objects([home_inspection], "deficiencies__images")
         return home_inspection
 
     def validate(self, data):
@@ -120,6 +186,10 @@ class HomeInspectionCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Home is required")
         if not data.get("inspection"):
             raise serializers.ValidationError("Inspection is required")
+        if data["inspection"].builder_id != data["home"].project.builder_id:
+            raise serializers.ValidationError(
+                "The inspection and the home belong to different builders"
+            )
         return data
 
 
@@ -152,7 +222,6 @@ class DeficiencySerializer(serializers.ModelSerializer):
 
     def validate(self, attrs):
         validated_data = super().validate(attrs)
-        user = self.context["request"].user
         # trade validations
         trade = validated_data.get("trade")
         if trade:
@@ -161,9 +230,6 @@ class DeficiencySerializer(serializers.ModelSerializer):
                     {"detail": "Deficiency can only be assigned to a trade."}
                 )
 
-            if user.user_type == "employee":
-                user = user.employee.builder.user
-
         return validated_data
 
     def create(self, validated_data):
@@ -242,13 +308,22 @@ class DeficiencySerializer(serializers.ModelSerializer):
             DefImage.objects.create(deficiency=instance, **image_data)
 
         if changes:
-            # Create logs and notifications in a different thread for optimisation
-            logs_thread = DeficiencyUpdateLogsCreationThread(changes, instance, actor)
-            notifications_thread = DeficiencyNotificationsCreationThread(
-                changes, instance, actor, notification_users, builder_user
+            # Create logs and notifications in the background once committed
+            actor_id = actor.id if actor else None
+            create_deficiency_update_logs.enqueue(
+                changes=changes, deficiency_id=instance.id, actor_id=actor_id
+            )
+            create_deficiency_notifications.enqueue(
+                changes=changes,
+                deficiency_id=instance.id,
+                actor_id=actor_id,
+                notification_user_ids=(
+                    list(notification_users.values_list("id", flat=True))
+                    if notification_users is not None
+                    else []
+                ),
+                builder_user_id=builder_user.id,
             )
-            logs_thread.start()
-            notifications_thread.start()
 
         return instance
 
@@ -261,33 +336,21 @@ class DeficiencySerializer(serializers.ModelSerializer):
             return view.filter_queryset(queryset)
         return None
 
+    def get_adjacent_ids(self, obj):
+        """previous and next ids are computed together and cached per instance"""
+        if getattr(self, "_adjacent_ids", (None,))[0] != obj.pk:
+            qs = self.get_filtered_queryset()
+            adjacent_ids = (None, None)
+            if qs is not None:
+                adjacent_ids = get_adjacent_ids(qs, obj)
+            self._adjacent_ids = (obj.pk, adjacent_ids)
+        return self._adjacent_ids[1]
+
     def get_previous(self, obj):
-        qs = self.get_filtered_queryset()
-        if qs is None:
-            return None
-
-        # Find the index of the current object
-        try:
-            current_index = list(qs).index(obj)
-            # Get the next object if it exists
-            if current_index - 1 >= 0:
-                return qs[current_index - 1].id
-        except (ValueError, IndexError):
-            return None
+        return self.get_adjacent_ids(obj)[0]
 
     def get_next(self, obj):
-        qs = self.get_filtered_queryset()
-        if qs is None:
-            return None
-
-        # Find the index of the current object
-        try:
-            current_index = list(qs).index(obj)
-            # Get the previous object if it exists
-            if current_index + 1 < len(qs):
-                return qs[current_index + 1].id
-        except (ValueError, IndexError):
-            return None
+        return self.get_adjacent_ids(obj)[1]
 
     def get_city(self, obj):
         return obj.home_inspection.home.project.city
@@ -312,9 +375,16 @@ class DeficiencyListSerializer(serializers.ModelSerializer):
     city = serializers.SerializerMethodField()
     due_date = serializers.SerializerMethodField()
 
+    # related rows read by the method fields, see EagerLoadingMixin
+    select_related_fields = [
+        "home_inspection__home__project",
+        "home_inspection__inspection",
+        "trade",
+    ]
+
     class Meta:
         model = Deficiency
-        exclude = ["home_inspection"]
+        exclude = ["home_inspection", "builder"]
 
     def get_outstanding_days(self, obj):
         if obj.completion_date:
@@ -375,11 +445,10 @@ class InspectionReviewSerializer(serializers.ModelSerializer):
         home_inspection = review.home_inspection
 
         # send inspection report in background
-        thread = threading.Thread(
-            target=send_inspection_report_email,
-            kwargs={"request": request, "home_inspection": home_inspection},
+        send_inspection_report.enqueue(
+            home_inspection_id=home_inspection.id,
+            base_url=request.build_absolute_uri(),
         )
-        thread.start()
 
         return review
 
@@ -403,7 +472,7 @@ class HomeInspectionListSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = HomeInspection
-        fields = "__all__"
+        exclude = ["builder"]
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -472,11 +541,11 @@ class HomeInspectionSerializer(serializers.ModelSerializer):
     inspection_type = serializers.SerializerMethodField()
     lot_no = serializers.SerializerMethodField()
     address = serializers.SerializerMethodField()
-    total_items = serializers.SerializerMethodField()
-    completed_items = serializers.SerializerMethodField()
-    pending_items = serializers.SerializerMethodField()
     province = serializers.SerializerMethodField()
 
+    # related rows read by the method fields, see EagerLoadingMixin
+    select_related_fields = ["inspection", "home"]
+
     class Meta:
         model = HomeInspection
         fields = [
@@ -501,16 +570,5 @@ class HomeInspectionSerializer(serializers.ModelSerializer):
     def get_address(self, obj):
         return obj.home.street_no + " " + obj.home.address
 
-    def get_total_items(self, obj):
-        return Deficiency.objects.filter(home_inspection=obj).count()
-
-    def get_completed_items(self, obj):
-        return Deficiency.objects.filter(home_inspection=obj, status="complete").count()
-
-    def get_pending_items(self, obj):
-        return Deficiency.objects.filter(
-            home_inspection=obj, status__in=["incomplete", "pending_approval"]
-        ).count()
-
     def get_province(self, obj):
         return obj.home.province
@@ -0,0 +1,60 @@
+from collections import Counter
+from django.db.models import F, QuerySet
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+from inspections.models import Deficiency, HomeInspection, Inspection
+
+
+@receiver(pre_delete, sender=Deficiency)
+def lock_deleted_deficiency(sender, instance, origin=None, **kwargs):
+    """
+    A deficiency deleted on its own may have been loaded before a concurrent
+    save, so what the counters include is read from the locked row. Those of
+    a queryset delete were just loaded by the delete itself, they are counted
+    so the last post_delete knows when to update the counters.
+    """
+    if origin is instance:
+        instance._counted_as = instance.get_counted_as(lock=True)
+    elif isinstance(origin, QuerySet) and origin.model is Deficiency:
+        origin._deleted_deficiencies = getattr(origin, "_deleted_deficiencies", 0) + 1
+
+
+@receiver(post_delete, sender=Deficiency)
+def decrement_deficiency_counters(sender, instance, origin=None, **kwargs):
+    """
+    Runs for single and queryset deletes of deficiencies. The deficiencies of
+    a queryset delete are subtracted together once the last one is deleted,
+    with one UPDATE per home inspection and per inspection. When deficiencies
+    are deleted in cascade of their home inspection, the counters go away
+    with it and no_of_def is handled by subtract_home_inspection_deficiencies.
+    """
+    if origin is instance:
+        counted_as = getattr(instance, "_counted_as", None) or (
+            instance.home_inspection_id,
+            instance.status,
+        )
+        Deficiency.update_counters(*counted_as, -1)
+        return
+    if not isinstance(origin, QuerySet) or origin.model is not Deficiency:
+        return
+
+    if not hasattr(origin, "_deficiency_counts"):
+        origin._deficiency_counts = Counter()
+    origin._deficiency_counts[(instance.home_inspection_id, instance.status)] -= 1
+    origin._deleted_deficiencies -= 1
+    if not origin._deleted_deficiencies:
+        Deficiency.update_counters_in_bulk(origin._deficiency_counts)
+        del origin._deficiency_counts
+
+
+@receiver(pre_delete, sender=HomeInspection)
+def subtract_home_inspection_deficiencies(sender, instance, **kwargs):
+    """
+    Subtract the count of deficiencies from Inspection model before deletion.
+    Runs before any row of the cascade is deleted, so the count is still exact.
+    """
+    deficiency_count = Deficiency.objects.filter(home_inspection=instance).count()
+    if deficiency_count:
+        Inspection.objects.filter(pk=instance.inspection_id).update(
+            no_of_def=F("no_of_def") - deficiency_count
+        )
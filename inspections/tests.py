@@ -1,3 +1,1025 @@
-from django.test import TestCase
+import csv
+import json
+from datetime import date
+from io import BytesIO, StringIO
+from unittest import mock
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from users.models import User, Builder, BuilderEmployee, Trade
+from projects.models import Project, Home
+from inspections.models import (
+    Inspection,
+    HomeInspection,
+    Deficiency,
+    DefImage,
+    DeficiencyUpdateLog,
+    DeficiencyNotification,
+    HomeInspectionReview,
+    InspectionReport,
+)
+from inspections.utils import (
+    bulk_create_deficiency_notifications,
+    get_inspection_data,
+    get_notification_users,
+    send_inspection_report_email,
+)
 
-# Create your tests here.
+
+class InspectionTestData:
+    """Creates a builder with one project, home, inspection and trade"""
+
+    @classmethod
+    def create_builder(cls, email="builder@example.com"):
+        user = User.objects.create(email=email, user_type="builder")
+        Builder.objects.create(user=user)
+        return user
+
+    @classmethod
+    def create_trade(cls, builder_user, email="trade@example.com", first_name=""):
+        user = User.objects.create(
+            email=email, user_type="trade", first_name=first_name
+        )
+        trade = Trade.objects.create(user=user)
+        trade.builder.add(builder_user.builder)
+        return user
+
+    @classmethod
+    def create_home_inspection(cls, builder_user, enrollment_no="E-1", **home_kwargs):
+        project = Project.objects.create(name="Project", builder=builder_user)
+        home = Home.objects.create(
+            project=project, enrollment_no=enrollment_no, **home_kwargs
+        )
+        inspection = Inspection.objects.create(name="PDI", builder=builder_user)
+        return HomeInspection.objects.create(inspection=inspection, home=home)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.builder_user = cls.create_builder()
+        cls.trade_user = cls.create_trade(cls.builder_user, first_name="Alan")
+        cls.home_inspection = cls.create_home_inspection(
+            cls.builder_user, street_no="12", address="Main St"
+        )
+
+
+class DeficiencyNavigationTest(InspectionTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        other_trade = cls.create_trade(
+            cls.builder_user, email="other@example.com", first_name="Bea"
+        )
+        rows = [
+            ("kitchen", "complete", cls.trade_user),
+            (None, "incomplete", other_trade),
+            ("basement", "pending_approval", None),
+            ("kitchen", "incomplete", cls.trade_user),
+            (None, "complete", other_trade),
+            ("attic", "incomplete", cls.trade_user),
+        ]
+        for location, status, trade in rows:
+            Deficiency.objects.create(
+                home_inspection=cls.home_inspection,
+                location=location,
+                status=status,
+                trade=trade,
+                description="desc",
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.builder_user)
+
+    def assert_navigation_matches_list(self, params):
+        url = reverse("deficiency-list")
+        response = self.client.get(url, {**params, "limit": 100})
+        ids = [row["id"] for row in response.data["results"]]
+        self.assertEqual(len(ids), Deficiency.objects.count())
+
+        for index, deficiency_id in enumerate(ids):
+            url = reverse("deficiency-detail", args=[deficiency_id])
+            data = self.client.get(url, params).data
+            expected_previous = ids[index - 1] if index > 0 else None
+            expected_next = ids[index + 1] if index + 1 < len(ids) else None
+            self.assertEqual(data["previous"], expected_previous, params)
+            self.assertEqual(data["next"], expected_next, params)
+
+    def test_navigation_follows_id_sort(self):
+        for sort_order in ["asc", "desc"]:
+            self.assert_navigation_matches_list(
+                {"sort_by": "id", "sort_order": sort_order}
+            )
+
+    def test_navigation_follows_location_sort_with_nulls(self):
+        # locations repeat, so ties are broken by id ascending
+        for sort_order, reverse in [("asc", False), ("desc", True)]:
+            visited = self.assert_chain(
+                {"sort_by": "location", "sort_order": sort_order}
+            )
+            locations = list(
+                Deficiency.objects.filter(id__in=visited).values_list("id", "location")
+            )
+            locations = dict(locations)
+            keys = [locations[deficiency_id] for deficiency_id in visited]
+            non_null = [key for key in keys if key is not None]
+            self.assertEqual(non_null, sorted(non_null, reverse=reverse))
+            # NULLs sort last ascending and first descending
+            nulls = [key is None for key in keys]
+            self.assertEqual(nulls, sorted(nulls, reverse=reverse))
+
+    def test_navigation_follows_annotated_sorts(self):
+        for sort_by in ["status", "trade", "outstanding_days", "due_date"]:
+            for sort_order in ["asc", "desc"]:
+                self.assert_chain({"sort_by": sort_by, "sort_order": sort_order})
+
+    def test_list_is_ordered_as_navigation(self):
+        # ties and NULLs are placed the same way by the list and navigation
+        self.assert_navigation_matches_list({})
+        for sort_by in ["location", "status", "trade", "outstanding_days", "due_date"]:
+            for sort_order in ["asc", "desc"]:
+                self.assert_navigation_matches_list(
+                    {"sort_by": sort_by, "sort_order": sort_order}
+                )
+
+    def assert_chain(self, params):
+        """Walking next from the first row visits every row once and back again"""
+        response = self.client.get(reverse("deficiency-list"), params)
+        ids = {row["id"] for row in response.data["results"]}
+
+        first = None
+        for deficiency_id in ids:
+            url = reverse("deficiency-detail", args=[deficiency_id])
+            if self.client.get(url, params).data["previous"] is None:
+                first = deficiency_id
+        visited = []
+        current = first
+        while current is not None:
+            visited.append(current)
+            url = reverse("deficiency-detail", args=[current])
+            data = self.client.get(url, params).data
+            if len(visited) > 1:
+                self.assertEqual(data["previous"], visited[-2], params)
+            current = data["next"]
+
+        self.assertEqual(sorted(visited), sorted(ids), params)
+        return visited
+
+    def test_navigation_uses_constant_queries(self):
+        deficiency = Deficiency.objects.order_by("id")[2]
+        url = reverse("deficiency-detail", args=[deficiency.id])
+        params = {"sort_by": "id", "sort_order": "desc"}
+        self.client.get(url, params)
+
+        Deficiency.objects.bulk_create(
+            Deficiency(home_inspection=self.home_inspection, description="bulk")
+            for _ in range(50)
+        )
+        # filtered retrieve, images, previous and next
+        with self.assertNumQueries(4):
+            data = self.client.get(url, params).data
+        self.assertEqual(data["next"], Deficiency.objects.order_by("id")[1].id)
+        self.assertEqual(data["previous"], Deficiency.objects.order_by("id")[3].id)
+
+
+class DeficiencyInspectionFilterViewTest(InspectionTestData, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.builder_user)
+        self.url = reverse("deficiencies-inspection-filter")
+
+    def create_trades_with_deficiencies(self, count, offset=0):
+        for index in range(offset, offset + count):
+            trade = self.create_trade(
+                self.builder_user, email=f"trade{index}@example.com"
+            )
+            for status in ["complete", "incomplete", "incomplete", "pending_approval"]:
+                Deficiency.objects.create(
+                    home_inspection=self.home_inspection,
+                    trade=trade,
+                    status=status,
+                    description="desc",
+                )
+
+    def test_per_trade_stats(self):
+        self.create_trades_with_deficiencies(1)
+        response = self.client.get(self.url, {"inspection": "PDI"})
+
+        stats = {row["trade"]: row for row in response.data}
+        # the trade from setUpTestData has no deficiencies
+        self.assertEqual(stats["Alan"]["complete_deficiencies"], 0)
+        self.assertEqual(stats["Alan"]["complete_percentage"], 0)
+        self.assertEqual(
+            stats[""],
+            {
+                "trade": "",
+                "incomplete_percentage": 50,
+                "complete_percentage": 25,
+                "complete_deficiencies": 1,
+                "incomplete_deficiencies": 2,
+                "pending_deficiencies": 1,
+            },
+        )
+
+    def test_query_count_does_not_depend_on_trade_count(self):
+        self.create_trades_with_deficiencies(2)
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+
+        self.create_trades_with_deficiencies(20, offset=2)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 23)
+
+
+class ProjectTotalDeficienciesTest(InspectionTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # 500 projects with one home inspection and three deficiencies each
+        inspection = cls.home_inspection.inspection
+        projects = Project.objects.bulk_create(
+            Project(name=f"Project {index}", builder=cls.builder_user)
+            for index in range(500)
+        )
+        homes = Home.objects.bulk_create(
+            Home(project=project, enrollment_no=f"B-{index}")
+            for index, project in enumerate(projects)
+        )
+        home_inspections = HomeInspection.objects.bulk_create(
+            HomeInspection(inspection=inspection, home=home) for home in homes
+        )
+        Deficiency.objects.bulk_create(
+            Deficiency(home_inspection=home_inspection, status=status, description="")
+            for home_inspection in home_inspections
+            for status in ["complete", "incomplete", "pending_approval"]
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.builder_user)
+
+    def test_rollup_uses_a_single_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("deficiencies-overview"))
+
+        self.assertEqual(len(response.data), 501)
+        rows = [row for row in response.data if row["name"] != "Project"]
+        self.assertTrue(
+            all(
+                row["total_deficiencies"] == 3
+                and row["complete_deficiencies"] == 1
+                and row["incomplete_deficiencies"] == 2
+                for row in rows
+            )
+        )
+
+
+class HomeInspectionCountersTest(InspectionTestData, TestCase):
+    def assert_counters(self, home_inspection, total, completed, pending):
+        home_inspection.refresh_from_db()
+        self.assertEqual(
+            (
+                home_inspection.total_items,
+                home_inspection.completed_items,
+                home_inspection.pending_items,
+            ),
+            (total, completed, pending),
+        )
+
+    def test_counters_follow_deficiency_changes(self):
+        first = Deficiency.objects.create(
+            home_inspection=self.home_inspection, description="first"
+        )
+        second = Deficiency.objects.create(
+            home_inspection=self.home_inspection, status="complete", description=""
+        )
+        self.assert_counters(self.home_inspection, 2, 1, 1)
+
+        first = Deficiency.objects.get(pk=first.pk)
+        first.status = "complete"
+        first.save()
+        first.save()
+        self.assert_counters(self.home_inspection, 2, 2, 0)
+
+        other = self.create_home_inspection(self.builder_user, enrollment_no="E-2")
+        second.home_inspection = other
+        second.status = "pending_approval"
+        second.save()
+        self.assert_counters(self.home_inspection, 1, 1, 0)
+        self.assert_counters(other, 1, 0, 1)
+
+        first.delete()
+        Deficiency.objects.filter(pk=second.pk).delete()
+        self.assert_counters(self.home_inspection, 0, 0, 0)
+        self.assert_counters(other, 0, 0, 0)
+
+    def test_stale_deficiencies_do_not_count_twice(self):
+        deficiency = Deficiency.objects.create(
+            home_inspection=self.home_inspection, description="first"
+        )
+        first = Deficiency.objects.get(pk=deficiency.pk)
+        second = Deficiency.objects.get(pk=deficiency.pk)
+        first.status = "complete"
+        first.save()
+        # loaded before the first save, as a concurrent request would have
+        second.status = "complete"
+        second.save()
+        self.assert_counters(self.home_inspection, 1, 1, 0)
+
+        second.delete()
+        self.assert_counters(self.home_inspection, 0, 0, 0)
+
+    def test_deferred_status_keeps_counters(self):
+        deficiency = Deficiency.objects.create(
+            home_inspection=self.home_inspection, status="complete", description=""
+        )
+        deferred = Deficiency.objects.only("description").get(pk=deficiency.pk)
+        deferred.description = "Crack"
+        deferred.save()
+        deferred = Deficiency.objects.defer("status").get(pk=deficiency.pk)
+        deferred.save(update_fields=["description"])
+        self.assert_counters(self.home_inspection, 1, 1, 0)
+
+    def test_saving_a_stale_home_inspection_keeps_counters(self):
+        stale = HomeInspection.objects.get(pk=self.home_inspection.pk)
+        Deficiency.objects.create(
+            home_inspection=self.home_inspection, description="first"
+        )
+        stale.is_reviewed = True
+        stale.save()
+        self.assert_counters(self.home_inspection, 1, 0, 1)
+
+    def test_rebuild_command_fixes_drift(self):
+        Deficiency.objects.bulk_create(
+            Deficiency(home_inspection=self.home_inspection, status=status)
+            for status in ["complete", "incomplete", "pending_approval"]
+        )
+        out = StringIO()
+        call_command("rebuild_inspection_counters", stdout=out)
+        self.assertIn("Corrected counters of 1 home inspections", out.getvalue())
+        self.assert_counters(self.home_inspection, 3, 1, 2)
+
+    def test_home_inspection_list_reads_counters(self):
+        Deficiency.objects.create(
+            home_inspection=self.home_inspection, status="complete", description=""
+        )
+        client = APIClient()
+        client.force_authenticate(self.builder_user)
+        url = reverse(
+            "inspection-home-inspections-list",
+            args=[self.home_inspection.inspection_id],
+        )
+        response = client.get(url, {"sort_by": "completed_items"})
+        row = response.data["results"][0]
+        self.assertEqual(
+            (row["total_items"], row["completed_items"], row["pending_items"]),
+            (1, 1, 0),
+        )
+
+
+class InspectionNoOfDefTest(InspectionTestData, TestCase):
+    def assert_no_of_def(self, expected):
+        inspection = Inspection.objects.get(pk=self.home_inspection.inspection_id)
+        self.assertEqual(inspection.no_of_def, expected)
+
+    def create_deficiencies(self, count, home_inspection=None):
+        return [
+            Deficiency.objects.create(
+                home_inspection=home_inspection or self.home_inspection,
+                description="desc",
+            )
+            for _ in range(count)
+        ]
+
+    def test_no_of_def_follows_creates_and_deletes(self):
+        stale = Inspection.objects.get(pk=self.home_inspection.inspection_id)
+        deficiencies = self.create_deficiencies(4)
+        self.assert_no_of_def(4)
+
+        # saving an instance loaded before the creates keeps the counter
+        stale.name = "Renamed"
+        stale.save()
+        self.assert_no_of_def(4)
+
+        deficiencies[0].delete()
+        Deficiency.objects.filter(pk__in=[d.pk for d in deficiencies[1:3]]).delete()
+        self.assert_no_of_def(1)
+
+    def test_queryset_delete_updates_each_counter_once(self):
+        other = HomeInspection.objects.create(
+            inspection=self.home_inspection.inspection, home=self.home_inspection.home
+        )
+        self.create_deficiencies(3)
+        for _ in range(3):
+            Deficiency.objects.create(
+                home_inspection=other, status="complete", description="desc"
+            )
+
+        with CaptureQueriesContext(connection) as queries:
+            Deficiency.objects.all().delete()
+        updates = [
+            query["sql"] for query in queries if query["sql"].startswith("UPDATE")
+        ]
+        # one per home inspection and one for their inspection
+        self.assertEqual(len(updates), 3)
+        self.assert_no_of_def(0)
+        for home_inspection in HomeInspection.objects.all():
+            self.assertEqual(
+                (
+                    home_inspection.total_items,
+                    home_inspection.completed_items,
+                    home_inspection.pending_items,
+                ),
+                (0, 0, 0),
+            )
+
+    def test_no_of_def_follows_cascade_deletes(self):
+        other = HomeInspection.objects.create(
+            inspection=self.home_inspection.inspection, home=self.home_inspection.home
+        )
+        self.create_deficiencies(3)
+        self.create_deficiencies(2, home_inspection=other)
+        self.assert_no_of_def(5)
+
+        other.delete()
+        self.assert_no_of_def(3)
+
+        # deleting the home cascades to its home inspections
+        self.home_inspection.home.delete()
+        self.assert_no_of_def(0)
+
+    def test_reconcile_counters(self):
+        self.create_deficiencies(2)
+        Inspection.objects.update(no_of_def=7)
+        Project.objects.update(no_of_homes=3)
+
+        out = StringIO()
+        call_command("reconcile_counters", stdout=out)
+        self.assertIn("no_of_def is 7, expected 2", out.getvalue())
+        self.assertIn("no_of_homes is 3, expected 1", out.getvalue())
+        self.assert_no_of_def(7)
+
+        call_command("reconcile_counters", "--fix", stdout=out)
+        self.assert_no_of_def(2)
+        self.assertEqual(Project.objects.get().no_of_homes, 1)
+
+
+@override_settings(JOB_RUN_EAGERLY=True)
+class HomeInspectionCreateTest(InspectionTestData, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.builder_user)
+        self.employee_user = User.objects.create(
+            email="employee@example.com", user_type="employee"
+        )
+        BuilderEmployee.objects.create(
+            user=self.employee_user, builder=self.builder_user.builder
+        )
+
+    def post_walkthrough(self, count):
+        data = {
+            "home": str(self.home_inspection.home_id),
+            "inspection": str(self.home_inspection.inspection_id),
+            "deficiencies": [
+                {
+                    "description": f"deficiency {index}",
+                    "trade": str(self.trade_user.id),
+                    "status": "complete" if index % 3 == 0 else "incomplete",
+                    "images": [
+                        {"image": f"{index}-a.jpg"},
+                        {"image": f"{index}-b.jpg"},
+                    ],
+                }
+                for index in range(count)
+            ],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    reverse("deficiency-list"), data, format="json"
+                )
+        self.assertEqual(response.status_code, 201, response.data)
+        return response, len(queries)
+
+    def test_walkthrough_is_created_in_bulk(self):
+        response, _ = self.post_walkthrough(150)
+
+        home_inspection = HomeInspection.objects.get(pk=response.data["id"])
+        self.assertEqual(len(response.data["deficiencies"]), 150)
+        self.assertEqual(len(response.data["deficiencies"][0]["images"]), 2)
+        self.assertEqual(
+            (
+                home_inspection.total_items,
+                home_inspection.completed_items,
+                home_inspection.pending_items,
+            ),
+            (150, 50, 100),
+        )
+        self.assertEqual(home_inspection.inspection.no_of_def, 150)
+        self.assertEqual(DefImage.objects.count(), 300)
+        self.assertEqual(
+            Deficiency.objects.filter(builder=self.builder_user).count(), 150
+        )
+        self.assertFalse(
+            Deficiency.objects.filter(
+                status="complete", completion_date__isnull=True
+            ).exists()
+        )
+
+        # trade and employee are notified, the acting builder is not
+        self.assertEqual(DeficiencyUpdateLog.objects.count(), 150)
+        self.assertEqual(
+            DeficiencyNotification.objects.filter(user=self.trade_user).count(), 150
+        )
+        self.assertEqual(
+            DeficiencyNotification.objects.filter(user=self.employee_user).count(),
+            150,
+        )
+        self.assertFalse(
+            DeficiencyNotification.objects.filter(user=self.builder_user).exists()
+        )
+
+    def test_query_count_does_not_depend_on_deficiency_count(self):
+        # kept below the bind parameter limit that makes SQLite split inserts
+        _, small_query_count = self.post_walkthrough(5)
+        _, query_count = self.post_walkthrough(40)
+        self.assertEqual(query_count, small_query_count)
+
+
+@override_settings(JOB_RUN_EAGERLY=True)
+class DeficiencyUpdateJobsTest(InspectionTestData, TestCase):
+    def test_logs_and_notifications_are_created_after_commit(self):
+        deficiency = Deficiency.objects.create(
+            home_inspection=self.home_inspection,
+            description="Crack",
+            trade=self.trade_user,
+        )
+        client = APIClient()
+        client.force_authenticate(self.trade_user)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = client.patch(
+                reverse("deficiency-detail", args=[deficiency.id]),
+                {"status": "pending_approval"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertFalse(DeficiencyUpdateLog.objects.exists())
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(
+            list(DeficiencyUpdateLog.objects.values_list("description", flat=True)),
+            ["Status Changed: incomplete to pending_approval"],
+        )
+        self.assertTrue(
+            DeficiencyNotification.objects.filter(user=self.builder_user).exists()
+        )
+
+
+class DeficiencyNotificationFanOutTest(InspectionTestData, TestCase):
+    def setUp(self):
+        self.deficiency = Deficiency.objects.create(
+            home_inspection=self.home_inspection,
+            description="Crack",
+            trade=self.trade_user,
+        )
+        self.employee_user = User.objects.create(
+            email="employee@example.com", user_type="employee"
+        )
+        BuilderEmployee.objects.create(
+            user=self.employee_user, builder=self.builder_user.builder
+        )
+
+    def notify(self, changes, actor, builder_user):
+        # the builder is also given explicitly and the trade added for builders
+        notification_users = User.objects.filter(
+            id__in=[self.employee_user.id, self.trade_user.id, self.builder_user.id]
+        )
+        with CaptureQueriesContext(connection) as queries:
+            bulk_create_deficiency_notifications(
+                changes, self.deficiency, actor, notification_users, builder_user
+            )
+        return [query for query in queries if query["sql"].startswith("INSERT")]
+
+    def test_every_change_reaches_every_recipient_once(self):
+        changes = ["Status Changed", "Location Changed", "Images Changed"]
+        inserts = self.notify(changes, self.builder_user, self.builder_user)
+
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(DeficiencyNotification.objects.count(), 9)
+        for user in (self.builder_user, self.employee_user, self.trade_user):
+            self.assertEqual(
+                sorted(
+                    DeficiencyNotification.objects.filter(user=user).values_list(
+                        "description", flat=True
+                    )
+                ),
+                sorted(changes),
+            )
+
+    def test_recipients_follow_the_project_builder(self):
+        other_builder = self.create_builder("other@example.com")
+        recipients = {
+            user.user_type: set(
+                get_notification_users(user, self.deficiency).values_list(
+                    "email", flat=True
+                )
+            )
+            for user in (self.trade_user, self.employee_user)
+        }
+        self.assertEqual(
+            recipients["trade"],
+            {self.home_inspection.home.project.builder.email, "employee@example.com"},
+        )
+        self.assertEqual(
+            recipients["employee"], {"employee@example.com", "trade@example.com"}
+        )
+        self.assertNotIn(other_builder.email, set().union(*recipients.values()))
+
+    def test_batch_size_limits_rows_per_insert(self):
+        changes = ["Status Changed", "Location Changed"]
+        with CaptureQueriesContext(connection) as queries:
+            bulk_create_deficiency_notifications(
+                changes,
+                self.deficiency,
+                None,
+                User.objects.filter(id=self.employee_user.id),
+                self.builder_user,
+                batch_size=2,
+            )
+        self.assertEqual(
+            len([query for query in queries if query["sql"].startswith("INSERT")]),
+            2,
+        )
+        self.assertEqual(DeficiencyNotification.objects.count(), 4)
+
+
+@mock.patch("inspections.utils.generate_inspection_report_pdf")
+class InspectionReportCacheTest(InspectionTestData, TestCase):
+    def setUp(self):
+        HomeInspectionReview.objects.create(
+            home_inspection=self.home_inspection, owner_signature_image="owner.png"
+        )
+        self.deficiency = Deficiency.objects.create(
+            home_inspection=self.home_inspection, description="Crack"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.builder_user)
+        self.url = reverse("home-inspection-report", args=[self.home_inspection.id])
+
+    def download(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_unchanged_report_is_rendered_once(self, render):
+        render.return_value = BytesIO(b"%PDF-first")
+        self.assertEqual(self.download(), b"%PDF-first")
+        self.assertEqual(self.download(), b"%PDF-first")
+        self.assertEqual(render.call_count, 1)
+
+    def test_report_is_rendered_again_when_its_content_changes(self, render):
+        render.side_effect = lambda *args: BytesIO(f"%PDF-{render.call_count}".encode())
+        self.assertEqual(self.download(), b"%PDF-1")
+
+        DefImage.objects.create(deficiency=self.deficiency, image="crack.jpg")
+        self.assertEqual(self.download(), b"%PDF-2")
+
+        self.deficiency.description = "Large crack"
+        self.deficiency.save()
+        self.assertEqual(self.download(), b"%PDF-3")
+
+        HomeInspectionReview.objects.update(inspector_signature_image="inspector.png")
+        self.assertEqual(self.download(), b"%PDF-4")
+        self.assertEqual(self.download(), b"%PDF-4")
+        self.assertEqual(InspectionReport.objects.count(), 1)
+
+    def test_report_email_is_sent_again_to_new_recipients(self, render):
+        render.return_value = BytesIO(b"%PDF")
+        self.home_inspection.home.owner_email = "owner@example.com"
+        self.home_inspection.home.save()
+
+        self.assertIsNotNone(send_inspection_report_email(self.home_inspection, ""))
+        self.assertIsNone(send_inspection_report_email(self.home_inspection, ""))
+
+        self.home_inspection.owner_visibility = True
+        email = send_inspection_report_email(self.home_inspection, "")
+        self.assertIsNotNone(email)
+        self.assertIn("owner@example.com", email.to)
+
+    def test_report_is_rendered_again_on_the_next_day(self, render):
+        render.side_effect = lambda *args: BytesIO(f"%PDF-{render.call_count}".encode())
+        with mock.patch("inspections.utils.timezone.localdate") as localdate:
+            localdate.return_value = date(2024, 5, 1)
+            self.assertEqual(self.download(), b"%PDF-1")
+            self.assertEqual(self.download(), b"%PDF-1")
+            localdate.return_value = date(2024, 5, 2)
+            self.assertEqual(self.download(), b"%PDF-2")
+
+    def test_signatures_show_the_review_date(self, render):
+        HomeInspectionReview.objects.update(created_at=date(2024, 5, 1))
+        context = get_inspection_data(HomeInspection.objects.get())
+        self.assertEqual(context["creation_date"], "May 01, 2024")
+
+    def test_other_builders_cannot_download(self, render):
+        self.client.force_authenticate(self.create_builder("other@example.com"))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        render.assert_not_called()
+
+
+class DeficiencyListQueryCountTest(InspectionTestData, TestCase):
+    """A page costs the same number of queries whatever its size"""
+
+    def add_deficiencies(self, count):
+        for index in range(count):
+            home_inspection = self.create_home_inspection(
+                self.builder_user, enrollment_no=f"L-{Home.objects.count()}"
+            )
+            Deficiency.objects.create(
+                home_inspection=home_inspection,
+                description=f"deficiency {index}",
+                trade=self.trade_user,
+            )
+
+    def count_queries(self, user, url):
+        client = APIClient()
+        client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(response.data["results"]), len(queries)
+
+    def assert_constant_queries(self, user, url):
+        self.add_deficiencies(2)
+        rows, small_page_queries = self.count_queries(user, url)
+        self.assertEqual(rows, 2)
+
+        self.add_deficiencies(10)
+        rows, page_queries = self.count_queries(user, url)
+        self.assertEqual(rows, 12)
+        self.assertEqual(page_queries, small_page_queries)
+
+    def test_deficiency_list(self):
+        self.assert_constant_queries(self.builder_user, reverse("deficiency-list"))
+
+    def test_trade_deficiency_list(self):
+        self.assert_constant_queries(
+            self.trade_user, reverse("trade-deficiencies-list")
+        )
+
+    def test_builder_trade_deficiency_list(self):
+        self.assert_constant_queries(
+            self.builder_user,
+            reverse("builder-trade-deficiency-list", args=[self.trade_user.id]),
+        )
+
+    def test_home_inspection_list(self):
+        inspection = self.home_inspection.inspection
+        url = reverse("inspection-home-inspections-list", args=[inspection.id])
+        rows, small_page_queries = self.count_queries(self.builder_user, url)
+        self.assertEqual(rows, 1)
+
+        for index in range(10):
+            home = Home.objects.create(
+                project=self.home_inspection.home.project,
+                enrollment_no=f"H-{index}",
+                street_no=str(index),
+                address="Main St",
+            )
+            HomeInspection.objects.create(inspection=inspection, home=home)
+        rows, page_queries = self.count_queries(self.builder_user, url)
+        self.assertEqual(rows, 11)
+        self.assertEqual(page_queries, small_page_queries)
+
+
+class DeficiencyBuilderTest(InspectionTestData, TestCase):
+    """The builder copied on home inspections and deficiencies follows moves"""
+
+    def test_builder_is_copied_on_create(self):
+        deficiency = Deficiency.objects.create(
+            home_inspection=self.home_inspection, description="Crack"
+        )
+        self.assertEqual(self.home_inspection.builder, self.builder_user)
+        self.assertEqual(deficiency.builder, self.builder_user)
+
+    def test_deficiency_moved_to_another_builder(self):
+        other_builder = self.create_builder("other@example.com")
+        other_home_inspection = self.create_home_inspection(other_builder, "E-2")
+        deficiency = Deficiency.objects.create(
+            home_inspection=self.home_inspection, description="Crack"
+        )
+
+        deficiency = Deficiency.objects.get(pk=deficiency.pk)
+        deficiency.home_inspection = other_home_inspection
+        deficiency.save(update_fields=["home_inspection"])
+
+        deficiency.refresh_from_db()
+        self.assertEqual(deficiency.builder, other_builder)
+
+    def test_home_inspection_moved_to_another_builder(self):
+        other_builder = self.create_builder("other@example.com")
+        other_inspection = Inspection.objects.create(name="PDI", builder=other_builder)
+        Deficiency.objects.create(
+            home_inspection=self.home_inspection, description="Crack"
+        )
+
+        home_inspection = HomeInspection.objects.get(pk=self.home_inspection.pk)
+        with CaptureQueriesContext(connection) as queries:
+            home_inspection.save()
+        # an unchanged inspection does not load the builder again
+        self.assertFalse(
+            any(Inspection._meta.db_table in query["sql"] for query in queries)
+        )
+
+        # the home must move to the other builder as well
+        home_inspection.inspection = other_inspection
+        with self.assertRaises(ValidationError):
+            home_inspection.save()
+
+        other_project = Project.objects.create(name="Other", builder=other_builder)
+        home_inspection.home = Home.objects.create(
+            project=other_project, enrollment_no="E-2"
+        )
+        home_inspection.save()
+
+        home_inspection.refresh_from_db()
+        self.assertEqual(home_inspection.builder, other_builder)
+        self.assertEqual(Deficiency.objects.filter(builder=other_builder).count(), 1)
+
+    def test_home_of_another_builder_is_rejected(self):
+        other_builder = self.create_builder("other@example.com")
+        other_inspection = Inspection.objects.create(name="PDI", builder=other_builder)
+        client = APIClient()
+        client.force_authenticate(self.builder_user)
+        response = client.post(
+            reverse("deficiency-list"),
+            {
+                "home": str(self.home_inspection.home_id),
+                "inspection": str(other_inspection.id),
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(HomeInspection.objects.count(), 1)
+
+    def test_builder_is_not_serialized(self):
+        client = APIClient()
+        client.force_authenticate(self.builder_user)
+        Deficiency.objects.create(
+            home_inspection=self.home_inspection, description="Crack"
+        )
+        response = client.get(reverse("deficiency-list"))
+        self.assertNotIn("builder", response.data["results"][0])
+        response = client.get(
+            reverse("home-inspections-list", args=[self.home_inspection.home_id])
+        )
+        self.assertNotIn("builder", response.data["results"][0])
+
+
+class IndexUsageTest(InspectionTestData, TestCase):
+    """The hot queries of the views are answered from the composite indexes"""
+
+    def assert_uses_index(self, queryset, model, fields):
+        index = next(index for index in model._meta.indexes if index.fields == fields)
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                # a sequential scan is cheaper than any index on a tiny table
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+            plan = queryset.explain()
+        self.assertIn(index.name, plan)
+
+    def test_deficiency_indexes(self):
+        self.assert_uses_index(
+            Deficiency.objects.filter(trade=self.trade_user, status="complete"),
+            Deficiency,
+            ["trade", "status"],
+        )
+        self.assert_uses_index(
+            Deficiency.objects.filter(
+                home_inspection=self.home_inspection, status="complete"
+            ),
+            Deficiency,
+            ["home_inspection", "status"],
+        )
+
+    def test_builder_index(self):
+        self.assert_uses_index(
+            Deficiency.objects.filter(builder=self.builder_user, status="complete"),
+            Deficiency,
+            ["builder", "status"],
+        )
+
+    def test_home_inspection_indexes(self):
+        self.assert_uses_index(
+            HomeInspection.objects.filter(
+                inspection=self.home_inspection.inspection
+            ).order_by("due_date"),
+            HomeInspection,
+            ["inspection", "due_date"],
+        )
+        self.assert_uses_index(
+            HomeInspection.objects.filter(home=self.home_inspection.home).order_by(
+                "-updated_at"
+            ),
+            HomeInspection,
+            ["home", "-updated_at"],
+        )
+
+    def test_notification_indexes(self):
+        self.assert_uses_index(
+            DeficiencyNotification.objects.filter(user=self.builder_user).order_by(
+                "-id"
+            ),
+            DeficiencyNotification,
+            ["user", "-id"],
+        )
+        self.assert_uses_index(
+            DeficiencyNotification.objects.filter(user=self.builder_user, read=False),
+            DeficiencyNotification,
+            ["user", "read"],
+        )
+
+    def test_update_log_index(self):
+        self.assert_uses_index(
+            DeficiencyUpdateLog.objects.filter(deficiency_id=1).order_by("-created_at"),
+            DeficiencyUpdateLog,
+            ["deficiency", "-created_at"],
+        )
+
+
+class DeficiencyExportTest(InspectionTestData, TestCase):
+    """The export streams the filtered deficiencies with the list fields"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.builder_user)
+        self.url = reverse("deficiency-export")
+
+    def add_deficiencies(self, count, **kwargs):
+        for index in range(count):
+            Deficiency.objects.create(
+                home_inspection=self.home_inspection,
+                description=f"deficiency {index}",
+                trade=self.trade_user,
+                **kwargs,
+            )
+
+    def export(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params)
+            content = b"".join(response.streaming_content).decode()
+        self.assertEqual(response.status_code, 200)
+        return content, len(queries)
+
+    def test_csv_export(self):
+        self.add_deficiencies(2)
+        self.add_deficiencies(1, status="complete")
+
+        content, _ = self.export({"status": "incomplete"})
+
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]["description"], "deficiency 0")
+        self.assertEqual(rows[0]["home_address"], "12 Main St")
+        self.assertEqual(rows[0]["inspection_type"], "PDI")
+        self.assertEqual(rows[0]["trade_name"], "Alan")
+        self.assertEqual(rows[0]["outstanding_days"], "0")
+
+    def test_ndjson_export(self):
+        self.add_deficiencies(2)
+
+        content, _ = self.export({"export_format": "ndjson"})
+
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1]["description"], "deficiency 1")
+        self.assertEqual(rows[1]["due_date"], None)
+        self.assertEqual(rows[1]["trade_id"], str(self.trade_user.id))
+
+    def test_trade_only_exports_own_deficiencies(self):
+        other_trade = self.create_trade(self.builder_user, email="other@example.com")
+        self.add_deficiencies(1)
+        Deficiency.objects.create(
+            home_inspection=self.home_inspection, description="x", trade=other_trade
+        )
+        self.client.force_authenticate(self.trade_user)
+
+        content, _ = self.export({"export_format": "ndjson"})
+
+        self.assertEqual(len(content.splitlines()), 1)
+
+    def test_constant_queries(self):
+        self.add_deficiencies(2)
+        _, small_export_queries = self.export()
+
+        self.add_deficiencies(20)
+        content, export_queries = self.export()
+
+        self.assertEqual(len(content.splitlines()), 23)
+        self.assertEqual(export_queries, small_export_queries)
@@ -108,4 +108,9 @@ urlpatterns = [
         builder.HomeInspectionDeleteView.as_view(),
         name="home-inspection-delete",
     ),
+    path(
+        "home-inspection/<int:pk>/report/",
+        builder.HomeInspectionReportView.as_view(),
+        name="home-inspection-report",
+    ),
 ]
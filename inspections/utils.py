@@ -1,18 +1,23 @@
-from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
-from weasyprint import HTML
+from jobs.outbox import queue_email
+from django.template.loader import get_template, render_to_string
 from io import BytesIO
 from inspections.models import HomeInspectionReview
-from inspection_backend.settings import EMAIL_HOST_USER
+from inspection_backend.settings import EMAIL_HOST_USER, BULK_CREATE_BATCH_SIZE
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
 from inspections.models import DeficiencyUpdateLog
 from inspections.models import DeficiencyNotification
-import threading
-from datetime import date, datetime
-from inspections.models import HomeInspection
-import pytz
-from django.db.models import Q
+from datetime import date
+from inspections.models import HomeInspection, InspectionReport, DefImage
+import hashlib
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, F, Count
+from django.db.models.expressions import OrderBy
+from django.utils import timezone
+from project_utils.streaming import ITERATOR_CHUNK_SIZE
+from project_utils.assets import AssetPrefetcher
+from project_utils.rendering import render_pdf, render_pool
 
 User = get_user_model()
 
@@ -23,7 +28,9 @@ def get_inspection_data(home_inspection: HomeInspection):
     home_owner_email = home.owner_email
     home_owner_name = home.owner_name
     enrollment_no = home.enrollment_no
-    deficiencies = home_inspection.deficiencies.all()
+    deficiencies = home_inspection.deficiencies.prefetch_related("images").order_by(
+        "id"
+    )
     inspection_review_object = get_object_or_404(
         HomeInspectionReview, home_inspection=home_inspection
     )
@@ -33,12 +40,9 @@ def get_inspection_data(home_inspection: HomeInspection):
     address_list = [home.street_no, home.address, home.city]
     home_address = " ".join([a for a in address_list if a])
 
-    # Get Ontario timezone
-    ontario_tz = pytz.timezone("America/Toronto")
-    # Get current UTC time and convert to Ontario timezone
-    creation_date = (
-        datetime.now(pytz.UTC).astimezone(ontario_tz).strftime("%B %d, %Y at %I:%M %p")
-    )
+    # the day the review was signed, not the day of the render, so a cached
+    # report still shows the right date
+    creation_date = inspection_review_object.created_at.strftime("%B %d, %Y")
 
     context = {
         "inspection_name": inspection_name,
@@ -56,41 +60,249 @@ def get_inspection_data(home_inspection: HomeInspection):
     return context
 
 
-def generate_inspection_report_pdf(request, home_inspection):
+def generate_inspection_report_pdf(home_inspection, base_url):
     context = get_inspection_data(home_inspection)
 
     html_string = render_to_string("inspection_pdf.html", context)
 
-    html = HTML(string=html_string, base_url=request.build_absolute_uri())
-    pdf_file = BytesIO()
-    html.write_pdf(pdf_file)
-    return pdf_file
+    # the images are fetched together and downscaled in this process, so
+    # slow image hosts do not count against the render timeout
+    image_urls = [
+        context["builder"].profile_picture,
+        context["inspector_signature"],
+        context["owner_signature"],
+    ] + [
+        image.image
+        for deficiency in context["deficiencies"]
+        for image in deficiency.images.all()
+    ]
+    assets = AssetPrefetcher(image_urls, base_url=base_url).assets
+    return BytesIO(render_pool.run(render_pdf, html_string, base_url, assets))
+
+
+def get_inspection_report_hash(home_inspection):
+    """Hash of everything the report template shows, including the template"""
+    home = home_inspection.home
+    builder = home.project.builder
+    content = {
+        "template": get_template("inspection_pdf.html").template.source,
+        # the header shows the day of the render
+        "date": timezone.localdate(),
+        "inspection": home_inspection.inspection.name,
+        "inspector": home_inspection.inspector,
+        "builder": [
+            builder.get_full_name(),
+            builder.email,
+            builder.profile_picture,
+        ],
+        "home": [
+            home.owner_name,
+            home.owner_email,
+            home.street_no,
+            home.address,
+            home.city,
+            home.enrollment_no,
+        ],
+        "review": list(
+            HomeInspectionReview.objects.filter(
+                home_inspection=home_inspection
+            ).values_list(
+                "owner_signature_image", "inspector_signature_image", "created_at"
+            )
+        ),
+        "deficiencies": list(
+            home_inspection.deficiencies.order_by("id").values_list(
+                "id", "location", "description"
+            )
+        ),
+        "images": list(
+            DefImage.objects.filter(deficiency__home_inspection=home_inspection)
+            .order_by("id")
+            .values_list("deficiency_id", "image")
+        ),
+    }
+    return hashlib.sha256(
+        json.dumps(content, cls=DjangoJSONEncoder).encode()
+    ).hexdigest()
+
+
+def get_inspection_report_pdf(home_inspection, base_url):
+    """Returns the report PDF bytes, rendered again only when its content changed"""
 
+    content_hash = get_inspection_report_hash(home_inspection)
+    report = InspectionReport.objects.filter(
+        home_inspection=home_inspection, content_hash=content_hash
+    ).first()
+    if report:
+        return bytes(report.pdf)
+
+    pdf = generate_inspection_report_pdf(home_inspection, base_url).getvalue()
+    InspectionReport.objects.update_or_create(
+        home_inspection=home_inspection,
+        defaults={"content_hash": content_hash, "pdf": pdf},
+    )
+    return pdf
 
-def send_inspection_report_email(request, home_inspection):
+
+def send_inspection_report_email(home_inspection, base_url):
     """Send email to builder and owner"""
 
     send_email_to = [home_inspection.home.project.builder.email]
-    pdf_file = generate_inspection_report_pdf(request, home_inspection)
+    pdf = get_inspection_report_pdf(home_inspection, base_url)
     if home_inspection.owner_visibility:
         send_email_to.append(home_inspection.home.owner_email)
     subject = f"{home_inspection.inspection.name} Report - {home_inspection.home.street_no} {home_inspection.home.address} - {home_inspection.inspection.builder.get_full_name()} - {date.today().strftime('%m/%d/%Y')}"
-    email = EmailMessage(
+    # a retried job does not send the same report to the same recipients
+    # twice on the same day
+    digest = hashlib.sha256(pdf)
+    digest.update(",".join(sorted(map(str, send_email_to))).encode())
+    dedupe_key = (
+        f"inspection-report:{home_inspection.id}:{digest.hexdigest()}:{date.today()}"
+    )
+    return queue_email(
         subject,
-        "Please find the inspection report attached.",
-        EMAIL_HOST_USER,
         send_email_to,
+        body="Please find the inspection report attached.",
+        from_email=EMAIL_HOST_USER,
+        attachments=[("inspection_report.pdf", pdf, "application/pdf")],
+        dedupe_key=dedupe_key,
     )
 
-    email.attach("inspection_report.pdf", pdf_file.getvalue(), "application/pdf")
 
-    return email.send()
+def _get_ordering_keys(queryset):
+    """
+    Returns the ordering of a queryset as a list of (field, descending) pairs,
+    always ending with the primary key so the ordering is total.
+    """
+    keys = []
+    for term in queryset.query.order_by:
+        if isinstance(term, str):
+            descending = term.startswith("-")
+            keys.append((term.lstrip("-"), descending))
+        elif isinstance(term, OrderBy) and isinstance(term.expression, F):
+            keys.append((term.expression.name, term.descending))
+
+    keys = [("pk" if name == "id" else name, descending) for name, descending in keys]
+    if not keys or keys[-1][0] != "pk":
+        keys.append(("pk", False))
+    return keys
+
+
+def _get_pivot_values(queryset, instance, keys):
+    """
+    Read the sort key values of instance from its loaded attributes
+    (annotations and select_related relations), querying only if one is missing.
+    """
+    values = {}
+    for name, _ in keys:
+        value = instance
+        for attr in name.split("__"):
+            if attr not in value.__dict__ and not (
+                attr == "pk" or attr in value._state.fields_cache
+            ):
+                return queryset.filter(pk=instance.pk).values(*[k for k, _ in keys])[0]
+            value = getattr(value, attr)
+            if value is None:
+                break
+        values[name] = value
+    return values
+
+
+def _get_adjacent_id(queryset, keys, pivot, reverse):
+    """
+    Keyset lookup of the row right after the pivot in the given ordering.
+    NULLs sort last ascending and first descending, as DeficiencyFilter orders
+    them explicitly, so navigation matches the list on every database.
+    """
+    condition = None
+    equal = Q()
+    ordering = []
+    for name, descending in keys:
+        descending = descending != reverse
+        value = pivot[name]
+        if value is None:
+            after = Q(**{f"{name}__isnull": False}) if descending else None
+            same = Q(**{f"{name}__isnull": True})
+        elif descending:
+            after = Q(**{f"{name}__lt": value})
+            same = Q(**{name: value})
+        else:
+            after = Q(**{f"{name}__gt": value}) | Q(**{f"{name}__isnull": True})
+            same = Q(**{name: value})
+
+        if after is not None:
+            condition = (
+                equal & after if condition is None else condition | (equal & after)
+            )
+        equal &= same
+        ordering.append(
+            F(name).desc(nulls_first=True)
+            if descending
+            else F(name).asc(nulls_last=True)
+        )
+
+    if condition is None:
+        return None
+    return (
+        queryset.filter(condition)
+        .order_by(*ordering)
+        .values_list("pk", flat=True)
+        .first()
+    )
+
+
+def get_adjacent_ids(queryset, instance):
+    """
+    Returns (previous_id, next_id) of instance within the ordered queryset
+    using one indexed keyset query per direction instead of scanning the queryset.
+    """
+    keys = _get_ordering_keys(queryset)
+    pivot = _get_pivot_values(queryset, instance, keys)
+    previous_id = _get_adjacent_id(queryset, keys, pivot, reverse=True)
+    next_id = _get_adjacent_id(queryset, keys, pivot, reverse=False)
+    return previous_id, next_id
+
+
+def rebuild_home_inspection_counters(batch_size=1000):
+    """
+    Recount deficiencies of every home inspection whose counters drifted
+    and return the number of home inspections that were corrected
+    """
+    drifted = (
+        HomeInspection.objects.annotate(
+            actual_total=Count("deficiencies"),
+            actual_completed=Count(
+                "deficiencies", filter=Q(deficiencies__status="complete")
+            ),
+        )
+        .exclude(
+            total_items=F("actual_total"),
+            completed_items=F("actual_completed"),
+            pending_items=F("actual_total") - F("actual_completed"),
+        )
+        .values_list("id", "actual_total", "actual_completed")
+    )
+
+    corrected = []
+    for home_inspection_id, total, completed in drifted.iterator(chunk_size=batch_size):
+        corrected.append(
+            HomeInspection(
+                id=home_inspection_id,
+                total_items=total,
+                completed_items=completed,
+                pending_items=total - completed,
+            )
+        )
+
+    HomeInspection.objects.bulk_update(
+        corrected, HomeInspection.COUNTER_FIELDS, batch_size=batch_size
+    )
+    return len(corrected)
 
 
 def get_notification_users(user, deficiency):
     """populate users to which the notification will be sent"""
 
-    builder_user = None
     notification_users = None
     trade = deficiency.trade
     if user.user_type == "builder":
@@ -98,16 +310,15 @@ def get_notification_users(user, deficiency):
             Q(employee__builder__user=user) | Q(id=trade.id)
         )
     elif user.user_type == "trade":
-        # Get all builders associated with the trade
-        builder = deficiency.home_inspection.home.project.builder
-        # Get all employees for all builder
+        # Get the builder of the deficiency and all of its employees. It is
+        # the builder of the home's project too, see HomeInspection.save.
         notification_users = User.objects.filter(
-            Q(employee__builder__user=builder) | Q(id=builder.id)
+            Q(employee__builder__user=deficiency.builder_id)
+            | Q(id=deficiency.builder_id)
         )
     elif user.user_type == "employee":
-        builder_user = user.employee.builder.user
         notification_users = User.objects.filter(
-            Q(employee__builder__user=builder_user) | Q(id=trade.id)
+            Q(employee__builder__user=deficiency.builder_id) | Q(id=trade.id)
         )
 
     return notification_users
@@ -127,6 +338,50 @@ def bulk_create_deficiency_update_logs(changes, instance, actor):
     DeficiencyUpdateLog.objects.bulk_create(logs_to_create)
 
 
+def bulk_create_deficiency_creation_records(deficiencies, actor, builder_user):
+    """
+    used upon home inspection creation. Creates the log and the notifications
+    of every new deficiency with one insert each
+    """
+
+    actor_name = actor.get_full_name() if actor else "System"
+    employee_ids = set(
+        User.objects.filter(employee__builder__user=builder_user).values_list(
+            "id", flat=True
+        )
+    )
+
+    logs_to_create = []
+    notifications_to_create = []
+    for deficiency in deficiencies:
+        change = f"{actor_name} Created a new Deficiency: {deficiency.id}"
+        logs_to_create.append(
+            DeficiencyUpdateLog(
+                deficiency=deficiency, actor_name=actor_name, description=change
+            )
+        )
+
+        # builder, its employees and the assigned trade, except the actor
+        recipient_ids = employee_ids | {builder_user.id, deficiency.trade_id}
+        recipient_ids -= {None, actor.id if actor else None}
+        notifications_to_create.extend(
+            DeficiencyNotification(
+                deficiency=deficiency,
+                user_id=recipient_id,
+                actor_name=actor_name,
+                description=change,
+            )
+            for recipient_id in recipient_ids
+        )
+
+    DeficiencyUpdateLog.objects.bulk_create(
+        logs_to_create, batch_size=BULK_CREATE_BATCH_SIZE
+    )
+    DeficiencyNotification.objects.bulk_create(
+        notifications_to_create, batch_size=BULK_CREATE_BATCH_SIZE
+    )
+
+
 def create_due_date_change_logs(home_inspection, actor, old_due_date, new_due_date):
     """Create logs for all deficiencies when home inspection due date changes"""
 
@@ -152,70 +407,108 @@ def create_due_date_change_logs(home_inspection, actor, old_due_date, new_due_da
 
 
 def bulk_create_deficiency_notifications(
-    changes, instance, actor, notification_users, builder_user
+    changes,
+    instance,
+    actor,
+    notification_users,
+    builder_user,
+    batch_size=BULK_CREATE_BATCH_SIZE,
 ):
-    """used upon deficiency update"""
-
-    for change in changes:
-        notifications = [
-            DeficiencyNotification(
-                deficiency=instance,
-                user=user,
-                actor_name=actor.get_full_name() if actor else "System",
-                description=change,
-            )
-            for user in notification_users
-        ]
-
-    DeficiencyNotification.objects.bulk_create(notifications)
+    """
+    used upon deficiency update. Every recipient gets one notification per
+    change, all of them created with a single insert per batch
+    """
+
+    recipient_ids = set()
+    if notification_users is not None:
+        recipient_ids.update(notification_users.values_list("id", flat=True))
     if builder_user:
-        for change in changes:
-            DeficiencyNotification.objects.create(
-                deficiency=instance,
-                user=builder_user,
-                actor_name=actor.get_full_name() if actor else "System",
-                description=change,
-            )
-    if actor.user_type == "builder":
-        for change in changes:
-            DeficiencyNotification.objects.create(
-                deficiency=instance,
-                user=instance.trade,
-                actor_name=actor.get_full_name() if actor else "System",
-                description=change,
-            )
-
-
-class DeficiencyUpdateLogsCreationThread(threading.Thread):
-
-    def __init__(self, changes, instance, actor):
-        threading.Thread.__init__(self)
-        self.changes = changes
-        self.instance = instance
-        self.actor = actor
-
-    def run(self):
-        bulk_create_deficiency_update_logs(self.changes, self.instance, self.actor)
-
-
-class DeficiencyNotificationsCreationThread(threading.Thread):
-
-    def __init__(self, changes, instance, actor, notification_users, builder_user):
-        threading.Thread.__init__(self)
-        self.changes = changes
-        self.instance = instance
-        self.actor = actor
-        self.notification_users = notification_users
-        self.builder_user = builder_user
-
-    def run(self):
-        if self.actor == self.builder_user:
-            """Builder cannot be notified for their own actions"""
-            self.builder_user = None
-        bulk_create_deficiency_notifications(
-            self.changes,
-            self.instance,
-            self.actor,
-            self.notification_users,
-            self.builder_user,
+        recipient_ids.add(builder_user.id)
+    if actor and actor.user_type == "builder":
+        recipient_ids.add(instance.trade_id)
+    recipient_ids.discard(None)
+
+    actor_name = actor.get_full_name() if actor else "System"
+    notifications = [
+        DeficiencyNotification(
+            deficiency=instance,
+            user_id=recipient_id,
+            actor_name=actor_name,
+            description=change,
+        )
+        for change in changes
+        for recipient_id in recipient_ids
+    ]
+    DeficiencyNotification.objects.bulk_create(notifications, batch_size=batch_size)
+
+
+# export column, values() lookup it is read from
+DEFICIENCY_EXPORT_FIELDS = [
+    ("id", "id"),
+    ("description", "description"),
+    ("edit_description", "edit_description"),
+    ("location", "location"),
+    ("status", "status"),
+    ("is_reviewed", "is_reviewed"),
+    ("trade_id", "trade_id"),
+    ("trade_first_name", "trade__first_name"),
+    ("trade_last_name", "trade__last_name"),
+    ("street_no", "home_inspection__home__street_no"),
+    ("address", "home_inspection__home__address"),
+    ("home_city", "home_inspection__home__city"),
+    ("province", "home_inspection__home__project__province"),
+    ("city", "home_inspection__home__project__city"),
+    ("inspection_type", "home_inspection__inspection__name"),
+    ("due_date", "home_inspection__due_date"),
+    ("created_at", "created_at"),
+    ("updated_at", "updated_at"),
+    ("completion_date", "completion_date"),
+]
+DEFICIENCY_EXPORT_COLUMNS = [
+    "id",
+    "description",
+    "edit_description",
+    "location",
+    "status",
+    "is_reviewed",
+    "trade_id",
+    "trade_name",
+    "home_address",
+    "province",
+    "city",
+    "inspection_type",
+    "due_date",
+    "outstanding_days",
+    "created_at",
+    "updated_at",
+    "completion_date",
+]
+
+
+def iter_deficiency_exports(deficiencies):
+    """
+    Rows with the fields of DeficiencyListSerializer, computed from a flat
+    values() projection read through a server side cursor
+    """
+    today = date.today()
+    rows = deficiencies.values_list(
+        *[lookup for _, lookup in DEFICIENCY_EXPORT_FIELDS]
+    ).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+    names = [name for name, _ in DEFICIENCY_EXPORT_FIELDS]
+    for values in rows:
+        row = dict(zip(names, values))
+        created_at = row.pop("created_at")
+        first_name = row.pop("trade_first_name")
+        last_name = row.pop("trade_last_name")
+        address_list = [row.pop("street_no"), row.pop("address"), row.pop("home_city")]
+        row["trade_name"] = (
+            f"{first_name} {last_name}".strip() if row["trade_id"] else None
+        )
+        row["home_address"] = " ".join([a for a in address_list if a])
+        row["outstanding_days"] = (
+            ((row["completion_date"] or today) - created_at.date()).days
+            if created_at
+            else None
         )
+        row["created_at"] = created_at
+        yield {column: row[column] for column in DEFICIENCY_EXPORT_COLUMNS}
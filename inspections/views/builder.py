@@ -17,8 +17,7 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from datetime import date, datetime
 from django.template.loader import render_to_string
-from django.core.mail import EmailMultiAlternatives
-from inspection_backend.settings import EMAIL_HOST_USER
+from jobs.outbox import queue_email
 from rest_framework import status
 from django_filters.rest_framework import DjangoFilterBackend
 from inspections.filters import DeficiencyFilter
@@ -30,9 +29,21 @@ from users.permissions import IsTrade
 from users.permissions import IsEmployee
 from django.http import Http404
 from django.db import transaction
+from django.db.models import Count, Q
 from rest_framework.serializers import ModelSerializer
 from inspections.filters import HomeInspectionFilter
 from inspections.utils import bulk_create_deficiency_update_logs
+from inspections.utils import get_inspection_report_pdf
+from project_utils.rendering import RenderQueueFull
+from project_utils.mixins import EagerLoadingMixin
+from django.http import FileResponse
+from io import BytesIO
+from users.utils import get_tenant
+from inspections.utils import DEFICIENCY_EXPORT_COLUMNS, iter_deficiency_exports
+from project_utils.streaming import csv_lines, streaming_export_response
+from rest_framework.decorators import action
+from django.core.serializers.json import DjangoJSONEncoder
+import json
 
 
 class InspectionViewSet(viewsets.ModelViewSet):
@@ -44,12 +55,7 @@ class InspectionViewSet(viewsets.ModelViewSet):
         if self.request.user.user_type == "admin":
             return self.queryset
 
-        user = None
-        if self.request.user.user_type == "builder":
-            user = self.request.user
-        elif self.request.user.user_type == "employee":
-            user = self.request.user.employee.builder.user
-
+        user = get_tenant(self.request).builder_user
         return super().get_queryset().filter(builder=user)
 
     def perform_create(self, serializer):
@@ -65,7 +71,7 @@ class InspectionViewSet(viewsets.ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class DeficiencyViewSet(viewsets.ModelViewSet):
+class DeficiencyViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     serializer_class = builder.DeficiencySerializer
     permission_classes = [IsAuthenticated, IsBuilder | IsTrade | IsEmployee]
     filter_backends = [DjangoFilterBackend]
@@ -75,6 +81,10 @@ class DeficiencyViewSet(viewsets.ModelViewSet):
     # TODO: add permission for admin to list deficiencies.
     def filter_queryset(self, queryset):
         queryset = super(DeficiencyViewSet, self).filter_queryset(queryset)
+        if not queryset.ordered and self.action != "export":
+            # the default of DeficiencyFilter.filter_sort, which the previous
+            # and next ids of the detail follow too
+            queryset = queryset.order_by("-id")
         return queryset
 
     def get_serializer_context(self):
@@ -85,11 +95,9 @@ class DeficiencyViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         user = self.request.user
         if user.user_type == "builder" or user.user_type == "employee":
-
-            if user.user_type == "employee":
-                user = user.employee.builder.user
-
-            return Deficiency.objects.filter(home_inspection__inspection__builder=user)
+            return Deficiency.objects.filter(
+                builder=get_tenant(self.request).builder_user
+            )
         elif user.user_type == "trade":
             return Deficiency.objects.filter(trade=user)
         else:
@@ -126,6 +134,11 @@ class DeficiencyViewSet(viewsets.ModelViewSet):
     def retrieve(self, request, *args, **kwargs):
         # Apply filters even in retrieve to get the next and previous properly
         queryset = self.filter_queryset(self.get_queryset())
+        # Related rows are loaded upfront because the sort keys used for
+        # next and previous are read from them
+        queryset = queryset.select_related(
+            "home_inspection__home__project", "home_inspection__inspection", "trade"
+        )
         lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
         filter_kwargs = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
 
@@ -137,6 +150,28 @@ class DeficiencyViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
+    @action(detail=False, methods=["get"])
+    def export(self, request, *args, **kwargs):
+        """
+        Streams every deficiency matching the filters, as CSV or as
+        NDJSON with ?export_format=ndjson
+        """
+        deficiencies = self.filter_queryset(self.get_queryset())
+        if not deficiencies.ordered:
+            deficiencies = deficiencies.order_by("id")
+        rows = iter_deficiency_exports(deficiencies)
+
+        if request.query_params.get("export_format") == "ndjson":
+            lines = (json.dumps(row, cls=DjangoJSONEncoder) + "\n" for row in rows)
+            return streaming_export_response(
+                request, lines, "deficiencies.ndjson", "application/x-ndjson"
+            )
+        lines = csv_lines(
+            DEFICIENCY_EXPORT_COLUMNS,
+            ([row[column] for column in DEFICIENCY_EXPORT_COLUMNS] for row in rows),
+        )
+        return streaming_export_response(request, lines, "deficiencies.csv", "text/csv")
+
     def destroy(self, request, *args, **kwargs):
         """Trade and Employee type users are not allowed to delete deficiencies"""
         if request.user.user_type in ["trade", "employee"]:
@@ -146,13 +181,8 @@ class DeficiencyViewSet(viewsets.ModelViewSet):
                 },
                 status=status.HTTP_403_FORBIDDEN,
             )
-        instance = self.get_object()
-        inspection = instance.home_inspection.inspection
-        response = super().destroy(request, *args, **kwargs)
-        if response.status_code == status.HTTP_204_NO_CONTENT:
-            inspection.no_of_def -= 1
-            inspection.save()
-        return response
+        # no_of_def of the inspection is decremented by the post_delete signal
+        return super().destroy(request, *args, **kwargs)
 
 
 class DefImageDeleteView(generics.DestroyAPIView):
@@ -161,17 +191,8 @@ class DefImageDeleteView(generics.DestroyAPIView):
     queryset = DefImage.objects.all()
 
     def get_queryset(self):
-        user = None
-        if self.request.user.user_type == "builder":
-            user = self.request.user
-        elif self.request.user.user_type == "employee":
-            user = self.request.user.employee.builder.user
-
-        return (
-            super()
-            .get_queryset()
-            .filter(deficiency__home_inspection__inspection__builder=user)
-        )
+        user = get_tenant(self.request).builder_user
+        return super().get_queryset().filter(deficiency__builder=user)
 
     def destroy(self, request, *args, **kwargs):
         """Override destroy to create logs when deficiency images are deleted"""
@@ -187,7 +208,7 @@ class DefImageDeleteView(generics.DestroyAPIView):
         return super().destroy(request, *args, **kwargs)
 
 
-class BuilderTradeDeficiencyListView(generics.ListAPIView):
+class BuilderTradeDeficiencyListView(EagerLoadingMixin, generics.ListAPIView):
     serializer_class = builder.DeficiencyListSerializer
     permission_classes = (IsAuthenticated, IsBuilder | IsEmployee)
     filter_backends = [DjangoFilterBackend]
@@ -200,21 +221,12 @@ class BuilderTradeDeficiencyListView(generics.ListAPIView):
         trade_user = get_object_or_404(User, id=trade_id)
 
         # Check if the builder is retrieving it's own trade's deficiencies
-        user = None
-
-        if self.request.user.user_type == "builder":
-            user = self.request.user
-        elif self.request.user.user_type == "employee":
-            user = self.request.user.employee.builder.user
+        user = get_tenant(self.request).builder_user
 
         if trade_user.user_type == "trade":
             # Check if the trade is associated with the builder
-            if user.builder in trade_user.trade.builder.all():
-                return (
-                    super()
-                    .get_queryset()
-                    .filter(trade=trade_user, home_inspection__inspection__builder=user)
-                )
+            if Trade.objects.filter(user=trade_user, builder__user=user).exists():
+                return super().get_queryset().filter(trade=trade_user, builder=user)
 
         return Deficiency.objects.none()
 
@@ -252,14 +264,11 @@ class SendDeficiencyEmailView(APIView):
                 },
             )
 
-            msg = EmailMultiAlternatives(
+            queue_email(
                 str(datetime.now()) + " - " + inspection_name,
-                "",
-                f"Builder Eye <{EMAIL_HOST_USER}>",
                 [email],
+                html_body=email_content,
             )
-            msg.attach_alternative(email_content, "text/html")
-            msg.send()
 
             return Response({"status": "success"}, status=status.HTTP_200_OK)
 
@@ -284,15 +293,8 @@ class TotalDeficiencies(APIView):
     permission_classes = [IsAuthenticated, IsBuilder | IsEmployee]
 
     def get(self, request, *args, **kwargs):
-        builder = None
-        if request.user.user_type == "builder":
-            builder = request.user
-        elif request.user.user_type == "employee":
-            builder = request.user.employee.builder.user
-
-        deficiencies = Deficiency.objects.select_related("home_inspection").filter(
-            home_inspection__inspection__builder=builder
-        )
+        builder = get_tenant(request).builder_user
+        deficiencies = Deficiency.objects.filter(builder=builder)
         total_deficiencies = deficiencies.count()
         complete_deficiencies = deficiencies.filter(status="complete").count()
         incomplete_deficiencies = total_deficiencies - complete_deficiencies
@@ -310,37 +312,31 @@ class ProjectTotalDeficiencies(APIView):
     permission_classes = [IsAuthenticated, IsBuilder | IsEmployee]
 
     def get(self, request, *args, **kwargs):
-        user = None
-
-        if request.user.user_type == "builder":
-            user = request.user
-        elif request.user.user_type == "employee":
-            user = request.user.employee.builder.user
-
-        # Get all projects where the builder is the current user
-        projects = Project.objects.filter(builder=user)
+        user = get_tenant(request).builder_user
+
+        # Get all projects of the builder with their deficiency counts in one query
+        projects = (
+            Project.objects.filter(builder=user)
+            .annotate(
+                total_deficiencies=Count("homes__homeinspection__deficiencies"),
+                complete_deficiencies=Count(
+                    "homes__homeinspection__deficiencies",
+                    filter=Q(homes__homeinspection__deficiencies__status="complete"),
+                ),
+            )
+            .values("id", "name", "total_deficiencies", "complete_deficiencies")
+        )
         project_data = []
 
         for project in projects:
-            # Get all homes in the current project
-            homes = project.homes.all()
-            home_ids = homes.values_list("id", flat=True)
-
-            # Get all deficiencies for these homes
-            deficiencies = Deficiency.objects.select_related("home_inspection").filter(
-                home_inspection__home__in=home_ids
-            )
-            total_deficiencies = deficiencies.count()
-            complete_deficiencies = deficiencies.filter(status="complete").count()
-            incomplete_deficiencies = total_deficiencies - complete_deficiencies
-
             project_data.append(
                 {
-                    "id": project.id,
-                    "name": project.name,
-                    "total_deficiencies": total_deficiencies,
-                    "complete_deficiencies": complete_deficiencies,
-                    "incomplete_deficiencies": incomplete_deficiencies,
+                    "id": project["id"],
+                    "name": project["name"],
+                    "total_deficiencies": project["total_deficiencies"],
+                    "complete_deficiencies": project["complete_deficiencies"],
+                    "incomplete_deficiencies": project["total_deficiencies"]
+                    - project["complete_deficiencies"],
                 }
             )
 
@@ -351,15 +347,10 @@ class DeficiencyFilterView(APIView):
     permission_classes = [IsAuthenticated, IsBuilder | IsEmployee]
 
     def get(self, request, *args, **kwargs):
-        builder = request.user
-        if request.user.user_type == "employee":
-            builder = request.user.employee.builder.user
-
+        builder = get_tenant(request).builder_user
         inspection = request.query_params.get("inspection")
 
-        builder_deficiencies = Deficiency.objects.select_related(
-            "home_inspection"
-        ).filter(home_inspection__inspection__builder=builder)
+        builder_deficiencies = Deficiency.objects.filter(builder=builder)
         deficiencies = None
 
         if inspection:
@@ -387,38 +378,38 @@ class DeficiencyInspectionFilterView(APIView):
     permission_classes = [IsAuthenticated, IsBuilder | IsEmployee]
 
     def get(self, request, *args, **kwargs):
-        builder = None
-
-        if self.request.user.user_type == "builder":
-            builder = self.request.user
-        elif self.request.user.user_type == "employee":
-            builder = self.request.user.employee.builder.user
-
+        builder = get_tenant(request).builder_user
         inspection = request.query_params.get("inspection")
         deficiencies = None
         if inspection:
             deficiencies = Deficiency.objects.select_related("home_inspection").filter(
                 home_inspection__inspection__name=inspection,
-                home_inspection__inspection__builder=builder,
+                builder=builder,
             )
         else:
-            deficiencies = Deficiency.objects.select_related("home_inspection").filter(
-                home_inspection__inspection__builder=builder
+            deficiencies = Deficiency.objects.filter(builder=builder)
+        trades = Trade.objects.filter(builder__user=builder).select_related("user")
+
+        # Count every trade's deficiencies by status in a single grouped query
+        trade_stats = {
+            stats["trade"]: stats
+            for stats in deficiencies.values("trade")
+            .annotate(
+                total=Count("id"),
+                complete=Count("id", filter=Q(status="complete")),
+                incomplete=Count("id", filter=Q(status="incomplete")),
+                pending=Count("id", filter=Q(status="pending_approval")),
             )
-        trades = Trade.objects.filter(builder=builder.builder)
+            .order_by()
+        }
         response_data = []
 
         for trade in trades:
-            total_deficiencies = deficiencies.filter(trade=trade.user).count()
-            complete_deficiencies = deficiencies.filter(
-                trade=trade.user, status="complete"
-            ).count()
-            incomplete_deficiencies = deficiencies.filter(
-                trade=trade.user, status="incomplete"
-            ).count()
-            pending_deficiencies = deficiencies.filter(
-                trade=trade.user, status="pending_approval"
-            ).count()
+            stats = trade_stats.get(trade.user_id, {})
+            total_deficiencies = stats.get("total", 0)
+            complete_deficiencies = stats.get("complete", 0)
+            incomplete_deficiencies = stats.get("incomplete", 0)
+            pending_deficiencies = stats.get("pending", 0)
             incomplete_deficiencies_pct = 0
             if total_deficiencies > 0:
                 incomplete_deficiencies_pct = (
@@ -464,10 +455,7 @@ class DeficienciesFilterOptionsView(APIView):
         project_values = None
         inspections = None
         if self.request.user.user_type != "trade":
-            if self.request.user.user_type == "builder":
-                builder = self.request.user
-            elif self.request.user.user_type == "employee":
-                builder = self.request.user.employee.builder.user
+            builder = get_tenant(self.request).builder_user
 
             # Get inspections for builder/employee
             inspections = (
@@ -476,7 +464,7 @@ class DeficienciesFilterOptionsView(APIView):
                 .distinct()
             )
 
-            trades = User.objects.filter(trade__builder=builder.builder)
+            trades = User.objects.filter(trade__builder__user=builder)
             trade_values = trades.distinct().values("id", "first_name", "last_name")
             trade_values = list(trade_values) if trade_values else []
 
@@ -595,7 +583,7 @@ class DeficiencyNotificationAllReadView(APIView):
 
     def post(self, request, *args, **kwargs):
         user = self.request.user
-        notifications = DeficiencyNotification.objects.filter(user=user)
+        notifications = DeficiencyNotification.objects.filter(user=user, read=False)
         notifications.update(read=True)
         return Response(status=status.HTTP_200_OK)
 
@@ -606,7 +594,7 @@ class HomeInspectionDueDateUpdateView(generics.UpdateAPIView):
     lookup_field = "pk"
 
 
-class HomeInspectionView(generics.ListAPIView):
+class HomeInspectionView(EagerLoadingMixin, generics.ListAPIView):
     serializer_class = builder.HomeInspectionSerializer
     permission_classes = [IsAuthenticated, IsBuilder | IsEmployee]
     queryset = HomeInspection.objects.all()
@@ -614,14 +602,9 @@ class HomeInspectionView(generics.ListAPIView):
     filterset_class = HomeInspectionFilter
 
     def get_queryset(self):
-        builder = None
-        if self.request.user.user_type == "builder":
-            builder = self.request.user
-        elif self.request.user.user_type == "employee":
-            builder = self.request.user.employee.builder.user
-
+        builder = get_tenant(self.request).builder_user
         inspection_id = self.kwargs.get("inspection_id")
-        queryset = super().get_queryset().filter(home__project__builder=builder)
+        queryset = super().get_queryset().filter(builder=builder)
 
         if inspection_id:
             queryset = queryset.filter(inspection_id=inspection_id)
@@ -641,7 +624,7 @@ class HomeInspectionDeleteView(generics.DestroyAPIView):
         queryset = super().get_queryset()
         if self.request.user.user_type == "admin":
             return queryset
-        return queryset.filter(inspection__builder=self.request.user)
+        return queryset.filter(builder=self.request.user)
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -650,3 +633,36 @@ class HomeInspectionDeleteView(generics.DestroyAPIView):
             {"detail": "Home inspection deleted successfully."},
             status=status.HTTP_200_OK,
         )
+
+
+class HomeInspectionReportView(generics.RetrieveAPIView):
+    """Downloads the report PDF of a reviewed home inspection"""
+
+    permission_classes = [IsAuthenticated, IsBuilder | IsEmployee]
+    queryset = HomeInspection.objects.select_related(
+        "inspection", "home__project__builder"
+    )
+    lookup_field = "pk"
+
+    def get_queryset(self):
+        builder = get_tenant(self.request).builder_user
+        return super().get_queryset().filter(builder=builder)
+
+    def retrieve(self, request, *args, **kwargs):
+        home_inspection = self.get_object()
+        try:
+            pdf = get_inspection_report_pdf(
+                home_inspection, request.build_absolute_uri()
+            )
+        except RenderQueueFull:
+            return Response(
+                {"detail": "Too many reports are being generated, try again shortly."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": "30"},
+            )
+        return FileResponse(
+            BytesIO(pdf),
+            as_attachment=True,
+            filename="inspection_report.pdf",
+            content_type="application/pdf",
+        )
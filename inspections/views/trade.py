@@ -5,9 +5,10 @@ from inspections.models import Deficiency, DeficiencyUpdateLog
 from inspections.serializers import trade
 from django_filters.rest_framework import DjangoFilterBackend
 from inspections.filters import DeficiencyFilter
+from project_utils.mixins import EagerLoadingMixin
 
 
-class TradeDeficiencyListView(generics.ListAPIView):
+class TradeDeficiencyListView(EagerLoadingMixin, generics.ListAPIView):
     serializer_class = DeficiencyListSerializer
     permission_classes = [IsTrade]
     filter_backends = [DjangoFilterBackend]
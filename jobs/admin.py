@@ -0,0 +1,19 @@
+from django.contrib import admin
+from jobs.models import Job, OutboxEmail
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "status", "attempts", "run_after", "created_at")
+    list_filter = ("status", "name")
+
+
+admin.site.register(Job, JobAdmin)
+
+
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ("id", "subject", "status", "attempts", "next_attempt_at", "sent_at")
+    list_filter = ("status",)
+    search_fields = ("subject", "dedupe_key")
+
+
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
@@ -0,0 +1,8 @@
+from jobs.outbox import SEND_JOB, send_outbox_emails
+from jobs.utils import job
+
+
+# one sender per process, send_outbox_emails keeps it to one for all of them
+@job(SEND_JOB, concurrency=1, max_attempts=3)
+def send_emails():
+    send_outbox_emails()
@@ -0,0 +1,24 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from jobs.utils import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Runs pending background jobs outside of the web process"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once there are no due jobs left",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending_jobs()
+            if count:
+                self.stdout.write(f"Ran {count} jobs")
+            if options["once"]:
+                break
+            time.sleep(settings.JOB_POLL_INTERVAL)
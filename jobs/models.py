@@ -0,0 +1,80 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """
+    A side-effect to run in the background once the transaction that
+    enqueued it commits. Rows are deleted when the job succeeds.
+    """
+
+    STATUS_TYPES = (
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("failed", "Failed"),
+    )
+    name = models.CharField(max_length=128)
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=16, choices=STATUS_TYPES, default="pending")
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "run_after"])]
+
+    def __str__(self):
+        return f"{self.id} {self.name} {self.status}"
+
+
+class OutboxEmail(models.Model):
+    """
+    A transactional email waiting to be sent by jobs.outbox. Sent rows are
+    kept for EMAIL_OUTBOX_RETENTION so their dedupe key stays taken.
+    """
+
+    STATUS_TYPES = (
+        ("pending", "Pending"),
+        ("sending", "Sending"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+    )
+    subject = models.TextField()
+    body = models.TextField(blank=True, default="")
+    html_body = models.TextField(null=True, blank=True)
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    dedupe_key = models.CharField(max_length=255, null=True, blank=True, unique=True)
+    status = models.CharField(max_length=16, choices=STATUS_TYPES, default="pending")
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    def __str__(self):
+        return f"{self.id} {self.subject} {self.status}"
+
+
+class OutboxAttachment(models.Model):
+    """File attached to an outbox email, deleted once the email is sent"""
+
+    email = models.ForeignKey(
+        OutboxEmail, on_delete=models.CASCADE, related_name="attachments"
+    )
+    filename = models.CharField(max_length=255)
+    content = models.BinaryField()
+    mimetype = models.CharField(max_length=128)
+
+    def __str__(self):
+        return f"{self.email_id} {self.filename}"
@@ -0,0 +1,219 @@
+"""
+Outbox of transactional emails. Requests only save the message with
+queue_email, the send_outbox_emails job then sends the due messages in
+batches over a single backend connection, at most EMAIL_OUTBOX_RATE_LIMIT
+messages per second, and retries failures with an exponential backoff.
+A lease in the shared cache keeps the senders of all processes to one at a
+time, so the rate limit holds for all of them together.
+"""
+
+import logging
+import time
+import traceback
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from inspection_backend.settings import EMAIL_HOST_USER
+from jobs.models import Job, OutboxAttachment, OutboxEmail
+from jobs.utils import schedule
+
+logger = logging.getLogger(__name__)
+
+SEND_JOB = "jobs.send_outbox_emails"
+SENDER_LEASE_KEY = "outbox-sender"
+DEFAULT_FROM_EMAIL = f"Builder Eye <{EMAIL_HOST_USER}>"
+
+
+def queue_email(
+    subject,
+    to,
+    body="",
+    html_body=None,
+    from_email=None,
+    attachments=(),
+    dedupe_key=None,
+):
+    """
+    Saves an email in the current transaction, it is sent once that
+    transaction commits. attachments are (filename, content, mimetype)
+    tuples. An email whose dedupe_key was already queued is dropped and
+    None is returned.
+    """
+    if dedupe_key and OutboxEmail.objects.filter(dedupe_key=dedupe_key).exists():
+        return None
+    try:
+        with transaction.atomic():
+            email = OutboxEmail.objects.create(
+                subject=subject,
+                body=body,
+                html_body=html_body,
+                from_email=from_email or DEFAULT_FROM_EMAIL,
+                to=list(to),
+                dedupe_key=dedupe_key,
+                max_attempts=settings.EMAIL_OUTBOX_MAX_ATTEMPTS,
+            )
+    except IntegrityError:
+        # queued by a concurrent request in between
+        return None
+    OutboxAttachment.objects.bulk_create(
+        OutboxAttachment(
+            email=email, filename=filename, content=content, mimetype=mimetype
+        )
+        for filename, content, mimetype in attachments
+    )
+    wake_sender(email.next_attempt_at)
+    return email
+
+
+def wake_sender(run_after):
+    """Schedules the send job unless one is already due by run_after"""
+    if not Job.objects.filter(
+        name=SEND_JOB, status="pending", run_after__lte=run_after
+    ).exists():
+        schedule(SEND_JOB, run_after)
+
+
+def claim_emails(limit):
+    """
+    Marks up to limit due emails as sending and returns them. Emails left
+    sending by a dead process are claimed again after JOB_LOCK_TIMEOUT.
+    """
+    now = timezone.now()
+    emails = OutboxEmail.objects.filter(
+        Q(status="pending", next_attempt_at__lte=now)
+        | Q(status="sending", locked_at__lt=now - settings.JOB_LOCK_TIMEOUT)
+    ).order_by("next_attempt_at", "id")
+
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            emails = emails.select_for_update(skip_locked=True)
+        email_ids = list(emails.values_list("id", flat=True)[:limit])
+        OutboxEmail.objects.filter(pk__in=email_ids).update(
+            status="sending", locked_at=now, attempts=F("attempts") + 1
+        )
+
+    return list(
+        OutboxEmail.objects.filter(pk__in=email_ids)
+        .prefetch_related("attachments")
+        .order_by("next_attempt_at", "id")
+    )
+
+
+def build_message(email, backend):
+    message = EmailMultiAlternatives(
+        email.subject,
+        email.body,
+        email.from_email,
+        email.to,
+        connection=backend,
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, "text/html")
+    for attachment in email.attachments.all():
+        message.attach(
+            attachment.filename, bytes(attachment.content), attachment.mimetype
+        )
+    return message
+
+
+def schedule_retry(email):
+    """Sends the email again later, or gives up after max_attempts"""
+    error = traceback.format_exc()
+    if email.attempts >= email.max_attempts:
+        OutboxEmail.objects.filter(pk=email.pk).update(
+            status="failed", locked_at=None, last_error=error
+        )
+        return
+    OutboxEmail.objects.filter(pk=email.pk).update(
+        status="pending",
+        locked_at=None,
+        last_error=error,
+        next_attempt_at=timezone.now()
+        + timedelta(
+            seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1)
+        ),
+    )
+
+
+def send_outbox_emails():
+    """
+    Sends every due email over one connection, returns the sent count. While
+    the sender of another process holds the lease nothing is sent here, the
+    send job is scheduled again for when that lease would have expired.
+    """
+    lease = uuid.uuid4().hex
+    if not cache.add(SENDER_LEASE_KEY, lease, settings.EMAIL_OUTBOX_LEASE_TIMEOUT):
+        wake_sender(
+            timezone.now() + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE_TIMEOUT)
+        )
+        return 0
+    try:
+        sent_count = send_due_emails()
+    finally:
+        if cache.get(SENDER_LEASE_KEY) == lease:
+            cache.delete(SENDER_LEASE_KEY)
+
+    OutboxEmail.objects.filter(
+        status="sent", sent_at__lt=timezone.now() - settings.EMAIL_OUTBOX_RETENTION
+    ).delete()
+    # retries, and emails queued while the lease was released, are sent by a
+    # job scheduled for the earliest of them
+    next_attempt_at = (
+        OutboxEmail.objects.filter(status="pending")
+        .order_by("next_attempt_at")
+        .values_list("next_attempt_at", flat=True)
+        .first()
+    )
+    if next_attempt_at:
+        wake_sender(next_attempt_at)
+    return sent_count
+
+
+def send_due_emails():
+    interval = (
+        1 / settings.EMAIL_OUTBOX_RATE_LIMIT if settings.EMAIL_OUTBOX_RATE_LIMIT else 0
+    )
+    last_sent = None
+    sent_count = 0
+    backend = get_connection(fail_silently=False)
+    try:
+        while True:
+            # the lease expires unless it is renewed for every batch
+            cache.touch(SENDER_LEASE_KEY, settings.EMAIL_OUTBOX_LEASE_TIMEOUT)
+            emails = claim_emails(settings.EMAIL_OUTBOX_BATCH_SIZE)
+            if not emails:
+                break
+            try:
+                backend.open()
+            except Exception:
+                logger.exception("Could not connect to the email backend")
+                for email in emails:
+                    schedule_retry(email)
+                break
+
+            sent_ids = []
+            for email in emails:
+                if last_sent is not None:
+                    time.sleep(max(0, last_sent + interval - time.monotonic()))
+                last_sent = time.monotonic()
+                try:
+                    backend.send_messages([build_message(email, backend)])
+                except Exception:
+                    logger.exception(f"Outbox email {email.id} failed")
+                    schedule_retry(email)
+                else:
+                    sent_ids.append(email.id)
+
+            OutboxEmail.objects.filter(pk__in=sent_ids).update(
+                status="sent", sent_at=timezone.now(), locked_at=None
+            )
+            OutboxAttachment.objects.filter(email_id__in=sent_ids).delete()
+            sent_count += len(sent_ids)
+    finally:
+        backend.close()
+    return sent_count
@@ -0,0 +1,223 @@
+from datetime import timedelta
+from unittest import mock
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.signals import request_started
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from jobs.models import Job, OutboxAttachment, OutboxEmail
+from jobs.outbox import SEND_JOB, SENDER_LEASE_KEY, queue_email, send_outbox_emails
+from jobs.utils import JOB_TYPES, claim_job, job, run_pending_jobs
+from jobs.worker import start_with_requests, worker_pool
+
+calls = []
+
+
+@job("tests.record", concurrency=1, max_attempts=2, retry_delay=30)
+def record(value):
+    if value == "fail":
+        raise ValueError("failed")
+    calls.append(value)
+
+
+@job("tests.other")
+def other():
+    calls.append("other")
+
+
+class JobTest(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_job_is_deleted_after_running(self):
+        record.enqueue(value="a")
+        self.assertEqual(run_pending_jobs(), 1)
+        self.assertEqual(calls, ["a"])
+        self.assertFalse(Job.objects.exists())
+
+    def test_failed_job_is_retried_with_backoff(self):
+        job = record.enqueue(value="fail")
+
+        run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("pending", 1))
+        self.assertIn("ValueError", job.last_error)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=25))
+
+        # not due yet
+        self.assertEqual(run_pending_jobs(), 0)
+
+        Job.objects.update(run_after=timezone.now())
+        run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("failed", 2))
+        self.assertEqual(run_pending_jobs(), 0)
+
+    def test_stale_running_job_is_claimed_again(self):
+        job = record.enqueue(value="a")
+        Job.objects.update(
+            status="running", locked_at=timezone.now() - timedelta(hours=1)
+        )
+        self.assertEqual(claim_job(list(JOB_TYPES)).pk, job.pk)
+
+        Job.objects.update(status="running", locked_at=timezone.now())
+        self.assertIsNone(claim_job(list(JOB_TYPES)))
+
+    def test_only_given_types_are_claimed(self):
+        record.enqueue(value="a")
+        other.enqueue()
+        self.assertEqual(run_pending_jobs(names=["tests.other"]), 1)
+        self.assertEqual(calls, ["other"])
+
+    @override_settings(JOB_RUN_EAGERLY=True)
+    def test_eager_job_runs_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record.enqueue(value="a")
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, ["a"])
+        self.assertFalse(Job.objects.exists())
+
+
+class JobTransactionTest(TransactionTestCase):
+    def test_job_is_discarded_with_its_transaction(self):
+        try:
+            with transaction.atomic():
+                record.enqueue(value="a")
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(Job.objects.exists())
+
+
+class WorkerPoolTest(TestCase):
+    def test_pool_is_started_by_the_first_request(self):
+        start_with_requests()
+        self.addCleanup(
+            request_started.disconnect, dispatch_uid="jobs.start_worker_pool"
+        )
+        with mock.patch.object(worker_pool, "ensure_started") as ensure_started:
+            self.client.get("/")
+        ensure_started.assert_called_once()
+
+
+@override_settings(EMAIL_OUTBOX_RATE_LIMIT=0)
+class OutboxTest(TestCase):
+    def test_emails_are_sent_over_one_connection(self):
+        for number in range(3):
+            queue_email(f"Email {number}", ["a@example.com"], html_body="<p>Hi</p>")
+        # one send job for all the queued emails
+        self.assertEqual(Job.objects.filter(name=SEND_JOB).count(), 1)
+        self.assertEqual(mail.outbox, [])
+
+        with mock.patch(
+            "jobs.outbox.get_connection", wraps=get_connection
+        ) as connect, override_settings(EMAIL_OUTBOX_BATCH_SIZE=2):
+            run_pending_jobs()
+
+        connect.assert_called_once()
+        self.assertEqual(
+            [message.subject for message in mail.outbox],
+            ["Email 0", "Email 1", "Email 2"],
+        )
+        self.assertEqual(mail.outbox[0].alternatives[0][1], "text/html")
+        self.assertEqual(OutboxEmail.objects.filter(status="sent").count(), 3)
+
+    def test_attachments_are_sent_and_deleted(self):
+        queue_email(
+            "Report",
+            ["a@example.com"],
+            attachments=[("report.pdf", b"%PDF", "application/pdf")],
+        )
+
+        send_outbox_emails()
+
+        self.assertEqual(
+            mail.outbox[0].attachments, [("report.pdf", b"%PDF", "application/pdf")]
+        )
+        self.assertFalse(OutboxAttachment.objects.exists())
+
+    def test_dedupe_key(self):
+        self.assertIsNotNone(queue_email("Report", ["a@example.com"], dedupe_key="r-1"))
+        self.assertIsNone(queue_email("Report", ["a@example.com"], dedupe_key="r-1"))
+        send_outbox_emails()
+        self.assertIsNone(queue_email("Report", ["a@example.com"], dedupe_key="r-1"))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failed_email_is_retried_with_backoff(self):
+        send_messages = EmailBackend.send_messages
+
+        def fail_first(backend, messages):
+            if messages[0].subject == "First":
+                raise ConnectionError("rejected")
+            return send_messages(backend, messages)
+
+        queue_email("First", ["a@example.com"])
+        queue_email("Second", ["b@example.com"])
+        with mock.patch.object(EmailBackend, "send_messages", fail_first):
+            run_pending_jobs()
+        self.assertEqual(len(mail.outbox), 1)
+
+        email = OutboxEmail.objects.get(subject="First")
+        self.assertEqual((email.status, email.attempts), ("pending", 1))
+        self.assertIn("ConnectionError", email.last_error)
+        self.assertGreater(
+            email.next_attempt_at, timezone.now() + timedelta(seconds=50)
+        )
+        # a send job is waiting for the retry
+        self.assertTrue(
+            Job.objects.filter(
+                name=SEND_JOB, run_after__gte=email.next_attempt_at
+            ).exists()
+        )
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(send_outbox_emails(), 1)
+        self.assertEqual(
+            [message.subject for message in mail.outbox], ["Second", "First"]
+        )
+
+    def test_email_fails_after_max_attempts(self):
+        queue_email("Email", ["a@example.com"])
+        OutboxEmail.objects.update(attempts=4)
+        with mock.patch.object(
+            EmailBackend, "send_messages", side_effect=ConnectionError
+        ):
+            send_outbox_emails()
+        self.assertEqual(OutboxEmail.objects.get().status, "failed")
+
+    @override_settings(EMAIL_OUTBOX_RATE_LIMIT=4)
+    def test_rate_limit(self):
+        for number in range(3):
+            queue_email(f"Email {number}", ["a@example.com"])
+
+        with mock.patch("jobs.outbox.time.sleep") as sleep:
+            send_outbox_emails()
+
+        self.assertEqual(sleep.call_count, 2)
+        for call in sleep.call_args_list:
+            self.assertAlmostEqual(call.args[0], 0.25, delta=0.05)
+
+    def test_one_sender_at_a_time(self):
+        queue_email("Email", ["a@example.com"])
+        Job.objects.all().delete()
+        # the sender of another process holds the lease
+        cache.add(SENDER_LEASE_KEY, "other", 60)
+
+        self.assertEqual(send_outbox_emails(), 0)
+        self.assertEqual(mail.outbox, [])
+        job = Job.objects.get(name=SEND_JOB)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=50))
+
+        cache.delete(SENDER_LEASE_KEY)
+        self.assertEqual(send_outbox_emails(), 1)
+        self.assertIsNone(cache.get(SENDER_LEASE_KEY))
+
+    @override_settings(JOB_RUN_EAGERLY=True)
+    def test_email_is_sent_once_committed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_email("Email", ["a@example.com"])
+            self.assertEqual(mail.outbox, [])
+        self.assertEqual(len(mail.outbox), 1)
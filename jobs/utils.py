@@ -0,0 +1,154 @@
+import logging
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+JOB_TYPES = {}
+
+
+class JobType:
+    def __init__(self, name, func, concurrency, max_attempts, retry_delay):
+        self.name = name
+        self.func = func
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def enqueue(self, **payload):
+        return enqueue(self.name, **payload)
+
+    def schedule(self, run_after, **payload):
+        return schedule(self.name, run_after, **payload)
+
+
+def job(name, concurrency=1, max_attempts=5, retry_delay=10):
+    """
+    Registers a function as a background job. The function is called with the
+    JSON payload given to enqueue, so it should take ids rather than instances.
+
+    concurrency: max number of jobs of this type running at once per process
+    retry_delay: seconds before the first retry, doubled on every attempt
+    """
+
+    def decorator(func):
+        job_type = JobType(name, func, concurrency, max_attempts, retry_delay)
+        JOB_TYPES[name] = job_type
+        func.enqueue = job_type.enqueue
+        func.schedule = job_type.schedule
+        return func
+
+    return decorator
+
+
+def enqueue(name, **payload):
+    """
+    Saves the job in the current transaction so it is only run, and only
+    survives, if that transaction commits
+    """
+    return schedule(name, timezone.now(), **payload)
+
+
+def schedule(name, run_after, **payload):
+    """Like enqueue, but the job is not run before run_after"""
+    job_type = JOB_TYPES[name]
+    job = Job.objects.create(
+        name=name,
+        payload=payload,
+        max_attempts=job_type.max_attempts,
+        run_after=run_after,
+    )
+    transaction.on_commit(lambda: wake_workers(job.pk))
+    return job
+
+
+def wake_workers(job_id):
+    if settings.JOB_RUN_EAGERLY:
+        job = claim_job(list(JOB_TYPES), job_id=job_id)
+        if job:
+            run_job(job)
+        return
+
+    from jobs.worker import worker_pool
+
+    worker_pool.notify()
+
+
+def claim_job(names, job_id=None):
+    """
+    Marks the next due job of one of the given types as running and returns it.
+    Jobs left running by a dead process are claimed again after JOB_LOCK_TIMEOUT.
+    """
+    now = timezone.now()
+    jobs = Job.objects.filter(
+        Q(status="pending", run_after__lte=now)
+        | Q(status="running", locked_at__lt=now - settings.JOB_LOCK_TIMEOUT),
+        name__in=names,
+    ).order_by("run_after", "id")
+    if job_id is not None:
+        jobs = jobs.filter(pk=job_id)
+
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            jobs = jobs.select_for_update(skip_locked=True)
+        job = jobs.first()
+        if job is None:
+            return None
+
+        # Only one worker wins the job even without row locks
+        claimed = Job.objects.filter(
+            pk=job.pk, status=job.status, locked_at=job.locked_at
+        ).update(status="running", locked_at=now, attempts=F("attempts") + 1)
+        if not claimed:
+            return None
+
+    job.status = "running"
+    job.locked_at = now
+    job.attempts += 1
+    return job
+
+
+def run_job(job):
+    """Runs a claimed job, deleting it on success or scheduling a retry on failure"""
+    job_type = JOB_TYPES.get(job.name)
+    try:
+        if job_type is None:
+            raise LookupError(f"No job registered with the name {job.name}")
+        job_type.func(**job.payload)
+    except Exception:
+        logger.exception(f"Job {job.id} {job.name} failed on attempt {job.attempts}")
+        retry_delay = job_type.retry_delay if job_type else 0
+        if job.attempts >= job.max_attempts:
+            Job.objects.filter(pk=job.pk).update(
+                status="failed", locked_at=None, last_error=traceback.format_exc()
+            )
+        else:
+            Job.objects.filter(pk=job.pk).update(
+                status="pending",
+                locked_at=None,
+                last_error=traceback.format_exc(),
+                run_after=timezone.now()
+                + timedelta(seconds=retry_delay * 2 ** (job.attempts - 1)),
+            )
+        return False
+
+    Job.objects.filter(pk=job.pk).delete()
+    return True
+
+
+def run_pending_jobs(names=None, limit=None):
+    """Runs due jobs in the current thread until none is left, returns the count"""
+    names = list(JOB_TYPES) if names is None else names
+    count = 0
+    while limit is None or count < limit:
+        job = claim_job(names)
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
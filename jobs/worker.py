@@ -0,0 +1,95 @@
+import logging
+import os
+import threading
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connection
+from jobs.utils import JOB_TYPES, claim_job, run_job
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """
+    A fixed number of daemon threads running jobs in the web process. Each
+    job type gets as many slots as its concurrency, shared by the threads.
+    The web process starts it on its first request, see start_with_requests.
+    Jobs are picked up when enqueued and every JOB_POLL_INTERVAL seconds, so
+    retries and jobs left over by a previous process are run as well.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._slots = {}
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            # threads do not survive a fork, so start again in a new worker process
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._slots = {
+                name: threading.BoundedSemaphore(job_type.concurrency)
+                for name, job_type in JOB_TYPES.items()
+            }
+            for index in range(settings.JOB_WORKERS):
+                thread = threading.Thread(
+                    target=self._work, name=f"job-worker-{index}", daemon=True
+                )
+                thread.start()
+
+    def notify(self):
+        self.ensure_started()
+        self._wakeup.set()
+
+    def _acquire_slots(self):
+        return [
+            name for name, slot in self._slots.items() if slot.acquire(blocking=False)
+        ]
+
+    def _work(self):
+        while True:
+            job = None
+            names = self._acquire_slots()
+            try:
+                if names:
+                    job = claim_job(names)
+                for name in names:
+                    if job is None or name != job.name:
+                        self._slots[name].release()
+
+                if job is not None:
+                    try:
+                        run_job(job)
+                    finally:
+                        self._slots[job.name].release()
+                    continue
+            except Exception:
+                logger.exception("Job worker failed to claim or run a job")
+            finally:
+                # do not hold a database connection between jobs
+                connection.close()
+
+            self._wakeup.wait(settings.JOB_POLL_INTERVAL)
+            self._wakeup.clear()
+
+
+worker_pool = WorkerPool()
+
+
+def start_worker_pool(**kwargs):
+    worker_pool.ensure_started()
+
+
+def start_with_requests():
+    """
+    Starts the pool of each web process, which may be forked after the
+    application is loaded, on its first request. Called by the WSGI and ASGI
+    applications only, so management commands and tests run no threads. With
+    JOB_WORKERS = 0 the run_jobs command has to run the jobs.
+    """
+    request_started.connect(start_worker_pool, dispatch_uid="jobs.start_worker_pool")
@@ -0,0 +1,175 @@
+"""
+Remote images of the PDF reports, fetched concurrently before WeasyPrint
+renders and downscaled to the size they are shown at. WeasyPrint fetches
+every URL one at a time while it lays out the document, and embeds the full
+resolution photos.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+import requests
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png"}
+
+
+def downscale_image(data, size):
+    """
+    The image resized so its longest side is at most size pixels, as JPEG
+    or as PNG when it is transparent. Returns None if data is not an image.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (UnidentifiedImageError, OSError):
+        return None
+
+    # phone photos are stored sideways with the rotation in the EXIF data
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((size, size))
+    output = io.BytesIO()
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        image.save(output, "PNG", optimize=True)
+        return output.getvalue(), MIME_TYPES["PNG"]
+    image.convert("RGB").save(output, "JPEG", quality=85, optimize=True)
+    return output.getvalue(), MIME_TYPES["JPEG"]
+
+
+class AssetCache:
+    """
+    Downscaled images on disk by URL, the least recently used are removed
+    once the files take more than max_bytes
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, url, size):
+        key = hashlib.sha256(f"{size}:{url}".encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, url, size):
+        path = self.path(url, size)
+        for extension, mime_type in (("jpg", "image/jpeg"), ("png", "image/png")):
+            try:
+                with open(f"{path}.{extension}", "rb") as cached:
+                    data = cached.read()
+            except FileNotFoundError:
+                continue
+            # the access time is not updated on every mount, so touch the file
+            os.utime(f"{path}.{extension}")
+            return data, mime_type
+        return None
+
+    def set(self, url, size, data, mime_type):
+        path = self.path(url, size)
+        extension = "png" if mime_type == "image/png" else "jpg"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # renamed into place so other processes never read a partial file
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(descriptor, "wb") as temporary:
+            temporary.write(data)
+        os.replace(temporary_path, f"{path}.{extension}")
+
+    def evict(self):
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def get_asset_cache():
+    return AssetCache(
+        settings.REPORT_ASSET_CACHE_DIR, settings.REPORT_ASSET_CACHE_MAX_BYTES
+    )
+
+
+class AssetPrefetcher:
+    """
+    Fetches the given image URLs with a thread pool and serves them to
+    WeasyPrint as its url_fetcher. Other URLs go to the fallback fetcher.
+    The assets can be fetched in one process and served in another, see
+    from_assets.
+    """
+
+    def __init__(self, urls, base_url=None, fallback=None, cache=None):
+        self.base_url = base_url
+        self.fallback = fallback
+        self.cache = cache or get_asset_cache()
+        self.size = settings.REPORT_IMAGE_SIZE
+        self.assets = {}
+        self.fetched = []
+        urls = {self.resolve(url) for url in urls if url}
+        urls = [url for url in urls if urlsplit(url).scheme in ("http", "https")]
+        if urls:
+            with ThreadPoolExecutor(settings.REPORT_ASSET_WORKERS) as executor:
+                self.assets = dict(zip(urls, executor.map(self.load, urls)))
+            # the cache only grows when something was fetched
+            if self.fetched:
+                self.cache.evict()
+
+    @classmethod
+    def from_assets(cls, assets, fallback=None):
+        """Serves the assets attribute of a prefetcher, fetching nothing"""
+        prefetcher = cls([], fallback=fallback)
+        prefetcher.assets = assets
+        return prefetcher
+
+    def resolve(self, url):
+        return urljoin(self.base_url, url) if self.base_url else url
+
+    def load(self, url):
+        """(data, mime type) of the asset, or an error to raise when it is used"""
+        try:
+            cached = self.cache.get(url, self.size)
+            if cached:
+                return cached
+
+            response = requests.get(url, timeout=settings.REPORT_ASSET_TIMEOUT)
+            response.raise_for_status()
+            self.fetched.append(url)
+            image = downscale_image(response.content, self.size)
+            if image is None:
+                return response.content, response.headers.get("Content-Type")
+            self.cache.set(url, self.size, *image)
+            return image
+        except Exception as error:
+            logger.warning(f"Could not fetch report asset {url}: {error}")
+            # kept simple so the assets can be pickled to a render process
+            return OSError(f"Could not fetch report asset {url}: {error}")
+
+    def __call__(self, url, *args, **kwargs):
+        asset = self.assets.get(url)
+        if asset is None:
+            if self.fallback is None:
+                raise ValueError(f"{url} was not prefetched")
+            return self.fallback(url, *args, **kwargs)
+        if isinstance(asset, Exception):
+            # WeasyPrint leaves the image out and carries on
+            raise asset
+        data, mime_type = asset
+        return {"string": data, "mime_type": mime_type, "redirected_url": url}
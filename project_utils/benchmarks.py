@@ -0,0 +1,261 @@
+"""
+Latency and query count benchmarks of the hot endpoints against a seeded
+dataset. Not collected by the regular test run, run them with
+
+    python manage.py test project_utils.benchmarks
+
+The query counts are compared with BENCHMARK_BASELINE, which is kept in the
+repository, and the run fails when an endpoint needs more queries than
+BENCHMARK_QUERY_THRESHOLD above its baseline. Latencies depend on the
+machine, so they are only compared when BENCHMARK_LATENCY_BASELINE names a
+file recorded on the machine the benchmarks run on. The run then fails when
+a p50 or p95 latency grows by more than BENCHMARK_LATENCY_THRESHOLD (a ratio)
+and BENCHMARK_LATENCY_SLACK_MS. Set BENCHMARK_UPDATE_BASELINE=1 to write the
+new results to both baselines instead.
+
+ReportRenderBenchmark compares the latency of an unrelated endpoint while
+BENCHMARK_RENDERS reports render in the web process and in the render pool.
+"""
+
+import json
+import os
+import statistics
+import threading
+import time
+from io import StringIO
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from users.models import User
+from inspections.models import Deficiency, Inspection
+from project_utils.rendering import RenderPool, render_pdf
+
+BASELINE_PATH = os.getenv(
+    "BENCHMARK_BASELINE",
+    os.path.join(settings.BASE_DIR, "project_utils", "benchmark_baseline.json"),
+)
+LATENCY_BASELINE_PATH = os.getenv("BENCHMARK_LATENCY_BASELINE")
+ITERATIONS = int(os.getenv("BENCHMARK_ITERATIONS", 20))
+LATENCY_THRESHOLD = float(os.getenv("BENCHMARK_LATENCY_THRESHOLD", 0.5))
+LATENCY_SLACK_MS = float(os.getenv("BENCHMARK_LATENCY_SLACK_MS", 5))
+QUERY_THRESHOLD = int(os.getenv("BENCHMARK_QUERY_THRESHOLD", 0))
+UPDATE_BASELINE = os.getenv("BENCHMARK_UPDATE_BASELINE") == "1"
+RENDERS = int(os.getenv("BENCHMARK_RENDERS", 2))
+REPORT_ROWS = int(os.getenv("BENCHMARK_REPORT_ROWS", 2000))
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+class EndpointBenchmark(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "seed_load_data",
+            prefix="bench",
+            builders=3,
+            trades=30,
+            projects_per_builder=4,
+            homes_per_project=50,
+            deficiencies_per_inspection=8,
+            stdout=StringIO(),
+        )
+        cls.builder_user = User.objects.get(email="bench-builder-0@example.com")
+
+    def get_endpoints(self):
+        deficiency = (
+            Deficiency.objects.filter(builder=self.builder_user).order_by("id").first()
+        )
+        inspection = Inspection.objects.filter(builder=self.builder_user).first()
+        return {
+            "deficiency-list": reverse("deficiency-list"),
+            "deficiency-retrieve": reverse("deficiency-detail", args=[deficiency.id]),
+            "deficiency-filter-options": reverse("deficiency-filter-options"),
+            "project-deficiencies-overview": reverse("deficiencies-overview"),
+            "inspection-deficiencies-filter": reverse("deficiencies-inspection-filter"),
+            "home-dashboard": reverse("home-dashboard"),
+            "inspection-home-inspections": reverse(
+                "inspection-home-inspections-list", args=[inspection.id]
+            ),
+            "builder-trade-list": reverse("builder-trade-list"),
+        }
+
+    def measure(self, client, url):
+        # the first request warms up caches and lazy imports
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+
+        with CaptureQueriesContext(connection) as queries:
+            client.get(url)
+        # read now, the query log is reset when the next request starts
+        query_count = len(queries)
+
+        timings = []
+        for _ in range(ITERATIONS):
+            started = time.perf_counter()
+            client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        return {
+            "queries": query_count,
+            "p50_ms": round(statistics.median(timings), 2),
+            "p95_ms": round(percentile(timings, 95), 2),
+        }
+
+    def check_queries(self, name, result, baseline):
+        self.assertLessEqual(
+            result["queries"],
+            baseline["queries"] + QUERY_THRESHOLD,
+            f"{name} needs {result['queries']} queries, "
+            f"baseline is {baseline['queries']}",
+        )
+
+    def check_latency(self, name, result, baseline):
+        for key in ("p50_ms", "p95_ms"):
+            allowed = max(
+                baseline[key] * (1 + LATENCY_THRESHOLD),
+                baseline[key] + LATENCY_SLACK_MS,
+            )
+            self.assertLessEqual(
+                result[key],
+                allowed,
+                f"{name} {key} is {result[key]}, baseline is {baseline[key]}",
+            )
+
+    def read_baseline(self, path):
+        if path and os.path.exists(path):
+            with open(path) as baseline_file:
+                return json.load(baseline_file)
+        return {}
+
+    def write_baseline(self, path, baseline):
+        with open(path, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=4, sort_keys=True)
+            baseline_file.write("\n")
+
+    def test_endpoints(self):
+        client = APIClient()
+        client.force_authenticate(self.builder_user)
+
+        query_baselines = self.read_baseline(BASELINE_PATH)
+        latency_baselines = self.read_baseline(LATENCY_BASELINE_PATH)
+
+        results = {}
+        for name, url in self.get_endpoints().items():
+            results[name] = self.measure(client, url)
+            print(f"{name}: {results[name]}")
+            if UPDATE_BASELINE:
+                continue
+            with self.subTest(endpoint=name):
+                if name in query_baselines:
+                    self.check_queries(name, results[name], query_baselines[name])
+                if name in latency_baselines:
+                    self.check_latency(name, results[name], latency_baselines[name])
+
+        if UPDATE_BASELINE:
+            self.write_baseline(
+                BASELINE_PATH,
+                {
+                    name: {"queries": result["queries"]}
+                    for name, result in results.items()
+                },
+            )
+            if LATENCY_BASELINE_PATH:
+                self.write_baseline(
+                    LATENCY_BASELINE_PATH,
+                    {
+                        name: {key: result[key] for key in ("p50_ms", "p95_ms")}
+                        for name, result in results.items()
+                    },
+                )
+
+
+class ReportRenderBenchmark(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "seed_load_data",
+            prefix="render",
+            builders=1,
+            trades=5,
+            projects_per_builder=2,
+            homes_per_project=20,
+            deficiencies_per_inspection=8,
+            stdout=StringIO(),
+        )
+        cls.builder_user = User.objects.get(email="render-builder-0@example.com")
+        # long enough that laying it out takes a while, no images to fetch
+        cls.report_html = "<table>{}</table>".format(
+            "".join(
+                f"<tr><td>{row}</td><td>Crack in the kitchen wall</td></tr>"
+                for row in range(REPORT_ROWS)
+            )
+        )
+
+    def measure_latency(self, client, url):
+        timings = []
+        for _ in range(ITERATIONS):
+            started = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+            self.assertEqual(response.status_code, 200)
+        return {
+            "p50_ms": round(statistics.median(timings), 2),
+            "p95_ms": round(percentile(timings, 95), 2),
+        }
+
+    def measure_while_rendering(self, client, url, pool):
+        stop = threading.Event()
+        renders = []
+
+        def render():
+            while not stop.is_set():
+                pool.run(render_pdf, self.report_html, None, {})
+                renders.append(1)
+
+        threads = [threading.Thread(target=render) for _ in range(RENDERS)]
+        for thread in threads:
+            thread.start()
+        try:
+            result = self.measure_latency(client, url)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        result["renders"] = len(renders)
+        return result
+
+    def test_unrelated_endpoint_latency(self):
+        client = APIClient()
+        client.force_authenticate(self.builder_user)
+        url = reverse("deficiency-list")
+        client.get(url)
+
+        results = {"idle": self.measure_latency(client, url)}
+        with override_settings(PDF_RENDER_WORKERS=0):
+            results["in-process"] = self.measure_while_rendering(
+                client, url, RenderPool()
+            )
+        with override_settings(PDF_RENDER_WORKERS=RENDERS):
+            pool = RenderPool()
+            try:
+                # start the processes before measuring
+                for _ in range(RENDERS):
+                    pool.run(render_pdf, "<p></p>", None, {})
+                results["pool"] = self.measure_while_rendering(client, url, pool)
+            finally:
+                pool.stop()
+
+        for name, result in results.items():
+            print(f"deficiency-list while rendering, {name}: {result}")
+        self.assertLessEqual(
+            results["pool"]["p95_ms"],
+            results["in-process"]["p95_ms"] + LATENCY_SLACK_MS,
+        )
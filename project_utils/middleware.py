@@ -0,0 +1,162 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.db import connection
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger(__name__)
+
+# IN lists of different lengths are the same query shape
+IN_LIST_RE = re.compile(r"(%s, )+%s")
+
+
+class QueryRecorder:
+    """execute_wrapper counting and timing every query of one request"""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.count = 0
+        self.db_time = 0.0
+        self.shapes = Counter()
+        self.callers = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.count += 1
+            shape = IN_LIST_RE.sub("%s", sql)
+            self.shapes[shape] += 1
+            # the stack is only inspected once a shape looks like an N+1
+            if self.shapes[shape] == self.threshold:
+                self.callers[shape] = find_caller()
+
+    def repeated_queries(self):
+        return [
+            (self.callers[shape], count, shape)
+            for shape, count in self.shapes.most_common()
+            if count >= self.threshold
+        ]
+
+
+def find_caller():
+    """Serializer method, or else project code, that ran the current query"""
+    fallback = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        instance = frame.f_locals.get("self")
+        if isinstance(instance, BaseSerializer):
+            return f"{type(instance).__name__}.{frame.f_code.co_name}"
+        filename = frame.f_code.co_filename
+        if (
+            fallback is None
+            and filename.startswith(settings.BASE_DIR)
+            and filename != __file__
+            and f"{os.sep}site-packages{os.sep}" not in filename
+        ):
+            path = os.path.relpath(filename, settings.BASE_DIR)
+            fallback = f"{path}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    return fallback or "unknown"
+
+
+class QueryReport:
+    """Query and latency totals per view since the process started"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def add(self, view_name, recorder, wall_time):
+        with self._lock:
+            stats = self._views.setdefault(
+                view_name,
+                {
+                    "requests": 0,
+                    "queries": 0,
+                    "max_queries": 0,
+                    "db_time": 0.0,
+                    "wall_time": 0.0,
+                    "n_plus_one": Counter(),
+                },
+            )
+            stats["requests"] += 1
+            stats["queries"] += recorder.count
+            stats["max_queries"] = max(stats["max_queries"], recorder.count)
+            stats["db_time"] += recorder.db_time
+            stats["wall_time"] += wall_time
+            for caller, _, _ in recorder.repeated_queries():
+                stats["n_plus_one"][caller] += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                view_name: {
+                    "requests": stats["requests"],
+                    "avg_queries": round(stats["queries"] / stats["requests"], 2),
+                    "max_queries": stats["max_queries"],
+                    "avg_db_ms": round(stats["db_time"] * 1000 / stats["requests"], 2),
+                    "avg_wall_ms": round(
+                        stats["wall_time"] * 1000 / stats["requests"], 2
+                    ),
+                    # requests in which each caller repeated a query
+                    "n_plus_one": dict(stats["n_plus_one"]),
+                }
+                for view_name, stats in self._views.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+query_report = QueryReport()
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Records the query count, database time and wall time of every request
+    and flags queries repeated N_PLUS_ONE_THRESHOLD times or more. Totals are
+    kept per view in query_report, and also returned as X-DB-* response
+    headers when QUERY_INSTRUMENTATION_HEADERS is set.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder(settings.N_PLUS_ONE_THRESHOLD)
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        wall_time = time.perf_counter() - started
+
+        view_name = getattr(request, "instrumented_view", None)
+        if view_name is None:
+            return response
+
+        query_report.add(view_name, recorder, wall_time)
+        repeated_queries = recorder.repeated_queries()
+        for caller, count, shape in repeated_queries:
+            logger.warning(f"N+1 in {view_name}: {caller} ran {count} times: {shape}")
+
+        if settings.QUERY_INSTRUMENTATION_HEADERS:
+            response["X-DB-Query-Count"] = recorder.count
+            response["X-DB-Time-Ms"] = round(recorder.db_time * 1000, 2)
+            response["X-Wall-Time-Ms"] = round(wall_time * 1000, 2)
+            if repeated_queries:
+                response["X-DB-N-Plus-One"] = ", ".join(
+                    f"{caller} x{count}" for caller, count, _ in repeated_queries
+                )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, "cls", view_func)
+        request.instrumented_view = f"{view.__module__}.{view.__name__}"
@@ -0,0 +1,21 @@
+class EagerLoadingMixin:
+    """
+    Generic view mixin loading the related rows the serializer reads.
+    Serializers declare them with select_related_fields and
+    prefetch_related_fields, so every view using them gets the same plan.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+
+        select_related_fields = getattr(serializer_class, "select_related_fields", [])
+        if select_related_fields:
+            queryset = queryset.select_related(*select_related_fields)
+
+        prefetch_related_fields = getattr(
+            serializer_class, "prefetch_related_fields", []
+        )
+        if prefetch_related_fields:
+            queryset = queryset.prefetch_related(*prefetch_related_fields)
+        return queryset
@@ -0,0 +1,168 @@
+"""
+Renders PDFs in separate processes so WeasyPrint, which is CPU bound and
+holds the GIL for seconds, does not stall the other requests of a web
+worker. Requests wait on a pipe, which releases the GIL.
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import traceback
+from io import BytesIO
+from django.conf import settings
+from weasyprint import HTML, default_url_fetcher
+from project_utils.assets import AssetPrefetcher
+
+
+class RenderError(Exception):
+    """The render failed, timed out or its process died"""
+
+
+class RenderQueueFull(RenderError):
+    """More renders are waiting than PDF_RENDER_QUEUE_SIZE"""
+
+
+def render_pdf(html_string, base_url, assets):
+    """PDF bytes of the HTML, assets are those of an AssetPrefetcher"""
+    url_fetcher = AssetPrefetcher.from_assets(assets, fallback=default_url_fetcher)
+    html = HTML(string=html_string, base_url=base_url, url_fetcher=url_fetcher)
+    pdf_file = BytesIO()
+    html.write_pdf(pdf_file)
+    return pdf_file.getvalue()
+
+
+def serve_renders(connection, memory_limit):
+    """Main loop of a render process, runs the functions sent by the pool"""
+    import django
+
+    django.setup()
+    if memory_limit:
+        import resource
+
+        # allocations past the limit raise MemoryError in the render
+        resource.setrlimit(resource.RLIMIT_DATA, (memory_limit, memory_limit))
+
+    while True:
+        try:
+            func, args = connection.recv()
+        except EOFError:
+            return
+        try:
+            connection.send((True, func(*args)))
+        except Exception:
+            connection.send((False, traceback.format_exc()))
+
+
+class RenderProcess:
+    def __init__(self, context, memory_limit):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=serve_renders,
+            args=(child_connection, memory_limit),
+            name="pdf-render",
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+        self.renders = 0
+
+    def run(self, func, args, timeout):
+        self.renders += 1
+        try:
+            self.connection.send((func, args))
+        except OSError:
+            raise RenderError(
+                f"Render process exited with code {self.process.exitcode}"
+            )
+        if not self.connection.poll(timeout):
+            raise RenderError(f"Render did not finish in {timeout} seconds")
+        try:
+            succeeded, result = self.connection.recv()
+        except EOFError:
+            raise RenderError(
+                f"Render process exited with code {self.process.exitcode}"
+            )
+        if not succeeded:
+            raise RenderError(result)
+        return result
+
+    def stop(self):
+        self.connection.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+
+
+class RenderPool:
+    """
+    PDF_RENDER_WORKERS processes, each replaced after PDF_RENDER_MAX_RENDERS
+    renders to cap the memory WeasyPrint keeps, or as soon as a render fails
+    or runs longer than PDF_RENDER_TIMEOUT. Up to PDF_RENDER_QUEUE_SIZE more
+    renders wait for a process, beyond that RenderQueueFull is raised.
+    Without workers the functions run in the calling thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._idle = None
+        self._slots = None
+
+    def ensure_started(self):
+        with self._lock:
+            # processes and pipes are not shared with a forked web worker
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._context = multiprocessing.get_context(
+                settings.PDF_RENDER_START_METHOD
+            )
+            self._idle = queue.Queue()
+            self._slots = threading.BoundedSemaphore(
+                settings.PDF_RENDER_WORKERS + settings.PDF_RENDER_QUEUE_SIZE
+            )
+            for _ in range(settings.PDF_RENDER_WORKERS):
+                self._idle.put(self._start_process())
+
+    def _start_process(self):
+        return RenderProcess(self._context, settings.PDF_RENDER_MEMORY_LIMIT)
+
+    def run(self, func, *args):
+        """Result of func(*args), func must be importable by the render process"""
+        if not settings.PDF_RENDER_WORKERS:
+            return func(*args)
+
+        self.ensure_started()
+        if not self._slots.acquire(blocking=False):
+            raise RenderQueueFull("Too many PDFs are being rendered")
+        try:
+            try:
+                process = self._idle.get(timeout=settings.PDF_RENDER_TIMEOUT)
+            except queue.Empty:
+                raise RenderError("No render process was free in time")
+
+            try:
+                return process.run(func, args, settings.PDF_RENDER_TIMEOUT)
+            except RenderError:
+                # a timed out or failed process may hold any amount of memory
+                process.stop()
+                process = None
+                raise
+            finally:
+                if process and process.renders >= settings.PDF_RENDER_MAX_RENDERS:
+                    process.stop()
+                    process = None
+                self._idle.put(process or self._start_process())
+        finally:
+            self._slots.release()
+
+    def stop(self):
+        """Stops the idle processes, busy ones are left to finish"""
+        with self._lock:
+            while self._idle is not None and not self._idle.empty():
+                self._idle.get().stop()
+            self._pid = None
+
+
+render_pool = RenderPool()
@@ -0,0 +1,64 @@
+"""
+Helpers to stream large exports row by row, so memory stays constant and
+the first bytes are sent before the last rows are read
+"""
+
+import csv
+import zlib
+from django.http import StreamingHttpResponse
+
+# rows read per round trip of the server side cursor
+ITERATOR_CHUNK_SIZE = 2000
+# rows joined into one chunk of the response
+ROWS_PER_CHUNK = 500
+
+
+class Echo:
+    """File-like object for csv.writer that returns the line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def join_lines(lines, size=ROWS_PER_CHUNK):
+    """Groups lines so the response is not sent a few bytes at a time"""
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def streaming_export_response(request, lines, filename, content_type):
+    """
+    Streams the lines as an attachment, gzip compressed when the request
+    asks for it with ?compression=gzip
+    """
+    chunks = join_lines(lines)
+    if request.query_params.get("compression") == "gzip":
+        chunks = gzip_chunks(chunks)
+        filename = f"{filename}.gz"
+        content_type = "application/gzip"
+
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
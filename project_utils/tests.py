@@ -0,0 +1,253 @@
+import functools
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from unittest import mock
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.test import APIClient
+from project_utils.assets import AssetCache, AssetPrefetcher, downscale_image
+from project_utils.middleware import QueryInstrumentationMiddleware, query_report
+from project_utils.rendering import RenderError, RenderPool, RenderQueueFull
+from users.models import User
+
+
+class EmailSerializer(serializers.Serializer):
+    email = serializers.CharField()
+    is_taken = serializers.SerializerMethodField()
+
+    def get_is_taken(self, obj):
+        return User.objects.filter(email=obj["email"]).exists()
+
+
+def list_emails(request):
+    emails = [{"email": f"{index}@example.com"} for index in range(6)]
+    EmailSerializer(emails, many=True).data
+    return HttpResponse()
+
+
+@override_settings(QUERY_INSTRUMENTATION_HEADERS=True, N_PLUS_ONE_THRESHOLD=5)
+class QueryInstrumentationMiddlewareTest(TestCase):
+    def setUp(self):
+        query_report.reset()
+
+    def get(self, view):
+        middleware = QueryInstrumentationMiddleware(view)
+        request = RequestFactory().get("/emails/")
+        middleware.process_view(request, view, (), {})
+        return middleware(request)
+
+    def test_repeated_queries_are_reported_with_the_serializer_method(self):
+        with self.assertLogs("project_utils.middleware", "WARNING"):
+            response = self.get(list_emails)
+
+        self.assertEqual(response["X-DB-Query-Count"], "6")
+        self.assertEqual(response["X-DB-N-Plus-One"], "EmailSerializer.get_is_taken x6")
+        self.assertIn("X-DB-Time-Ms", response)
+        self.assertIn("X-Wall-Time-Ms", response)
+
+        report = query_report.as_dict()["project_utils.tests.list_emails"]
+        self.assertEqual(report["requests"], 1)
+        self.assertEqual(report["max_queries"], 6)
+        self.assertEqual(report["n_plus_one"], {"EmailSerializer.get_is_taken": 1})
+
+    @override_settings(QUERY_INSTRUMENTATION_HEADERS=False)
+    def test_only_the_report_is_kept_in_production(self):
+        with self.assertLogs("project_utils.middleware", "WARNING"):
+            response = self.get(list_emails)
+        self.assertNotIn("X-DB-Query-Count", response)
+        self.assertIn("project_utils.tests.list_emails", query_report.as_dict())
+
+    def test_drf_views_are_covered(self):
+        admin = User.objects.create(
+            email="admin@example.com", user_type="admin", is_staff=True
+        )
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        client.get("/instrumentation/queries/")
+        response = client.get("/instrumentation/queries/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["project_utils.views.QueryReportView"]["requests"], 1
+        )
+        self.assertEqual(response["X-DB-Query-Count"], "0")
+
+
+class AssetRequestHandler(SimpleHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class AssetPrefetcherTest(SimpleTestCase):
+    """Assets are served by a local HTTP server standing in for S3"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.mkdtemp()
+        Image.new("RGB", (1600, 1200), "red").save(os.path.join(cls.root, "photo.jpg"))
+        Image.new("RGBA", (800, 400)).save(os.path.join(cls.root, "signature.png"))
+        cls.requests = AssetRequestHandler.requests
+        cls.server = ThreadingHTTPServer(
+            ("127.0.0.1", 0),
+            functools.partial(AssetRequestHandler, directory=cls.root),
+        )
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.server_url = f"http://127.0.0.1:{cls.server.server_port}"
+        cls.base_url = f"{cls.server_url}/report/"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.root)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.requests.clear()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.cache = AssetCache(self.cache_dir, 10 * 1024 * 1024)
+
+    def prefetch(self, urls, **kwargs):
+        with override_settings(REPORT_IMAGE_SIZE=200, REPORT_ASSET_WORKERS=4):
+            return AssetPrefetcher(
+                urls, base_url=self.base_url, cache=self.cache, **kwargs
+            )
+
+    def test_images_are_prefetched_and_downscaled(self):
+        fetcher = self.prefetch(["/photo.jpg", "/signature.png", "", None])
+
+        with mock.patch("project_utils.assets.requests.get") as get:
+            photo = fetcher(f"{self.server_url}/photo.jpg")
+            signature = fetcher(f"{self.server_url}/signature.png")
+        get.assert_not_called()
+
+        self.assertEqual(photo["mime_type"], "image/jpeg")
+        self.assertEqual(Image.open(BytesIO(photo["string"])).size, (200, 150))
+        # transparency is kept
+        self.assertEqual(signature["mime_type"], "image/png")
+        self.assertEqual(Image.open(BytesIO(signature["string"])).mode, "RGBA")
+
+    def test_cached_images_are_not_fetched_again(self):
+        self.prefetch(["/photo.jpg"])
+        self.assertEqual(len(self.requests), 1)
+
+        fetcher = self.prefetch(["/photo.jpg"])
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(
+            fetcher(f"{self.server_url}/photo.jpg")["mime_type"], "image/jpeg"
+        )
+
+    def test_missing_image_raises_when_rendered(self):
+        fetcher = self.prefetch(["missing.jpg"])
+        with self.assertRaises(Exception):
+            fetcher(f"{self.base_url}missing.jpg")
+
+    def test_assets_can_be_served_by_another_process(self):
+        assets = self.prefetch(["/photo.jpg", "missing.jpg"]).assets
+        fetcher = AssetPrefetcher.from_assets(pickle.loads(pickle.dumps(assets)))
+
+        self.assertEqual(sorted(self.requests), ["/photo.jpg", "/report/missing.jpg"])
+        photo = fetcher(f"{self.server_url}/photo.jpg")
+        self.assertEqual(photo["mime_type"], "image/jpeg")
+        with self.assertRaises(OSError):
+            fetcher(f"{self.base_url}missing.jpg")
+
+    def test_other_urls_use_the_fallback(self):
+        fallback = mock.Mock(return_value={"string": b"body {}"})
+        fetcher = self.prefetch([], fallback=fallback)
+        self.assertEqual(fetcher("data:text/css,body{}"), {"string": b"body {}"})
+        fallback.assert_called_once_with("data:text/css,body{}")
+
+    def test_cache_is_bounded(self):
+        self.cache.max_bytes = 0
+        self.prefetch(["/photo.jpg"])
+        self.assertIsNone(self.cache.get(f"{self.server_url}/photo.jpg", 200))
+
+
+class DownscaleImageTest(SimpleTestCase):
+    def test_not_an_image(self):
+        self.assertIsNone(downscale_image(b"<svg></svg>", 200))
+
+    def test_small_images_are_not_enlarged(self):
+        output = BytesIO()
+        Image.new("RGB", (50, 40)).save(output, "PNG")
+        data, mime_type = downscale_image(output.getvalue(), 200)
+        self.assertEqual(Image.open(BytesIO(data)).size, (50, 40))
+        self.assertEqual(mime_type, "image/jpeg")
+
+
+def render_pid():
+    return os.getpid()
+
+
+def sleep_for(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def allocate(megabytes):
+    return len(bytearray(megabytes * 1024 * 1024))
+
+
+@override_settings(
+    PDF_RENDER_WORKERS=1,
+    PDF_RENDER_QUEUE_SIZE=0,
+    PDF_RENDER_TIMEOUT=10,
+    PDF_RENDER_MAX_RENDERS=2,
+    PDF_RENDER_MEMORY_LIMIT=512 * 1024 * 1024,
+)
+class RenderPoolTest(SimpleTestCase):
+    def setUp(self):
+        self.pool = RenderPool()
+        self.addCleanup(self.pool.stop)
+
+    def test_processes_are_recycled(self):
+        pids = [self.pool.run(render_pid) for _ in range(3)]
+
+        self.assertNotIn(os.getpid(), pids)
+        self.assertEqual(pids[0], pids[1])
+        self.assertNotEqual(pids[1], pids[2])
+
+    @override_settings(PDF_RENDER_TIMEOUT=1)
+    def test_timed_out_render_is_killed(self):
+        pid = self.pool.run(render_pid)
+        with self.assertRaisesMessage(RenderError, "did not finish"):
+            self.pool.run(sleep_for, 5)
+        self.assertNotEqual(self.pool.run(render_pid), pid)
+
+    def test_memory_ceiling(self):
+        with self.assertRaisesMessage(RenderError, "MemoryError"):
+            self.pool.run(allocate, 1024)
+        self.assertEqual(self.pool.run(allocate, 10), 10 * 1024 * 1024)
+
+    def test_queue_is_bounded(self):
+        self.pool.run(render_pid)
+        busy = threading.Thread(target=self.pool.run, args=(sleep_for, 1))
+        busy.start()
+        self.addCleanup(busy.join)
+        # wait for the render to take the only slot
+        while self.pool._slots._value:
+            time.sleep(0.01)
+
+        with self.assertRaises(RenderQueueFull):
+            self.pool.run(render_pid)
+
+    @override_settings(PDF_RENDER_WORKERS=0)
+    def test_renders_in_process_without_workers(self):
+        self.assertEqual(self.pool.run(render_pid), os.getpid())
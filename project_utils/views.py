@@ -0,0 +1,18 @@
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from project_utils.middleware import query_report
+
+
+class QueryReportView(APIView):
+    """Query and latency totals per view of the process serving the request"""
+
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(query_report.as_dict())
+
+    def delete(self, request, *args, **kwargs):
+        query_report.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
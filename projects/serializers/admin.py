@@ -3,7 +3,7 @@ from projects.models import Project
 from rest_framework.exceptions import ValidationError
 from django.contrib.auth import get_user_model
 from projects.models import Home, BluePrint, BluePrintImage
-from django.db.models import Q
+from django.db.models import Q, F
 from users.models import Client
 
 User = get_user_model()
@@ -160,79 +160,41 @@ class HomeSerializer(serializers.ModelSerializer):
         read_only_fields = ["project"]
 
     def create(self, validated_data):
-        if isinstance(validated_data, list):
-            # For bulk creation
-            enrollment_nos = [item["enrollment_no"] for item in validated_data]
-            addresses = [
-                item["address"] for item in validated_data if item.get("address")
-            ]
-            existing_homes = Home.objects.filter(
-                Q(enrollment_no__in=enrollment_nos) | Q(address__in=addresses)
+        home, created = Home.objects.filter(
+            enrollment_no=validated_data.get("enrollment_no")
+        ).update_or_create(defaults=validated_data)
+
+        if created:
+            """Handle no_of_homes of project upon creation"""
+            Project.objects.filter(pk=home.project_id).update(
+                no_of_homes=F("no_of_homes") + 1
             )
-            existing_homes_dict = {home.enrollment_no: home for home in existing_homes}
-
-            new_homes = []
-            updated_homes = []
-            for item in validated_data:
-                enrollment_no = item["enrollment_no"]
-                if enrollment_no in existing_homes_dict:
-                    home = existing_homes_dict[enrollment_no]
-                    for key, value in item.items():
-                        setattr(home, key, value)
-                    updated_homes.append(home)
-                else:
-                    new_homes.append(Home(**item))
-
-            if new_homes:
-                Home.objects.bulk_create(new_homes)
-
-            if updated_homes:
-                Home.objects.bulk_update(
-                    updated_homes,
-                    fields=[
-                        f.name
-                        for f in Home._meta.fields
-                        if f.name not in ["id", "project"]
-                    ],
+        owner_email = validated_data.get("owner_email")
+        owner_name = validated_data.get("owner_name", "")
+        owner_no = validated_data.get("owner_no")
+        owner_created = False
+        if owner_email:
+            owner_email = owner_email.lower()
+            try:
+                user = User.objects.get(username=owner_email)
+            except User.DoesNotExist:
+                owner_created = True
+                user = User.objects.create(
+                    username=owner_email,
+                    email=owner_email,
+                    first_name=owner_name,
+                    phone_no=owner_no,
+                    user_type="client",
                 )
 
-            return new_homes + updated_homes
-
-        else:
-            home, created = Home.objects.filter(
-                enrollment_no=validated_data.get("enrollment_no")
-            ).update_or_create(defaults=validated_data)
-
-            if created:
-                """Handle no_of_homes of project upon creation"""
-                home.project.no_of_homes += 1
-                home.project.save()
-            owner_email = validated_data.get("owner_email")
-            owner_name = validated_data.get("owner_name", "")
-            owner_no = validated_data.get("owner_no")
-            owner_created = False
-            if owner_email:
-                owner_email = owner_email.lower()
-                try:
-                    user = User.objects.get(username=owner_email)
-                except User.DoesNotExist:
-                    owner_created = True
-                    user = User.objects.create(
-                        username=owner_email,
-                        email=owner_email,
-                        first_name=owner_name,
-                        phone_no=owner_no,
-                        user_type="client",
-                    )
-
-                user.set_unusable_password()
-                user.save()
-                if owner_created:
-                    client_profile = Client.objects.create(user=user)
-
-                home.client = user
-                home.save()
-            return home
+            user.set_unusable_password()
+            user.save()
+            if owner_created:
+                client_profile = Client.objects.create(user=user)
+
+            home.client = user
+            home.save()
+        return home
 
     def update(self, instance, validated_data):
         owner_email = validated_data.get("owner_email")
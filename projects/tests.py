@@ -1,3 +1,160 @@
-from django.test import TestCase
+import csv
+import gzip
+from io import StringIO
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from users.models import User, Client
+from projects.models import Project, Home
 
-# Create your tests here.
+
+class ProjectHomesCSVTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create(
+            email="admin@example.com", user_type="admin", is_staff=True
+        )
+        cls.project = Project.objects.create(name="Project")
+        Home.objects.bulk_create(
+            Home(
+                project=cls.project,
+                lot_no=f"01-{number:03d}",
+                enrollment_no=f"C-{number}",
+                owner_name=f"Owner {number}",
+            )
+            for number in range(1200)
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin_user)
+        self.url = reverse("generate_project_homes_csv", args=[self.project.id])
+
+    def read_rows(self, content):
+        return list(csv.reader(StringIO(content.decode())))
+
+    def test_homes_are_streamed_in_chunks(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            response["Content-Disposition"],
+            f'attachment; filename="project_{self.project.id}_homes.csv"',
+        )
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+
+        rows = self.read_rows(b"".join(chunks))
+        self.assertEqual(rows[0][0], "Lot No.")
+        self.assertEqual(len(rows), 1201)
+        self.assertIn(
+            ["01-000", "", "", "", "", "", "C-0", "", "", "Owner 0", "", ""], rows
+        )
+
+    def test_gzip_variant(self):
+        plain = b"".join(self.client.get(self.url).streaming_content)
+        response = self.client.get(self.url, {"compression": "gzip"})
+
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertTrue(response["Content-Disposition"].endswith('.csv.gz"'))
+        compressed = b"".join(response.streaming_content)
+        self.assertLess(len(compressed), len(plain))
+        self.assertEqual(gzip.decompress(compressed), plain)
+
+
+class HomeImportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create(
+            email="admin@example.com", user_type="admin", is_staff=True
+        )
+        cls.project = Project.objects.create(name="Project")
+        cls.owner = User.objects.create(email="known@example.com", user_type="client")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin_user)
+        self.url = reverse("home-import", args=[self.project.id])
+
+    def upload(self, content, name="homes.csv"):
+        upload = SimpleUploadedFile(name, content.encode())
+        return self.client.post(self.url, {"file": upload}, format="multipart")
+
+    def test_csv_import(self):
+        Home.objects.create(project=self.project, enrollment_no="E-1", lot_no="1")
+        other_project = Project.objects.create(name="Other")
+        Home.objects.create(project=other_project, enrollment_no="E-9")
+
+        response = self.upload(
+            "Lot No.,Enrolment No.,Warranty Start Date,Home Owner,Home Owner Email\n"
+            "2,E-1,2024-01-31,,\n"
+            "3,E-2,,Ann,New@Example.com\n"
+            "4,E-3,not a date,,\n"
+            "5,E-2,,,\n"
+            "6,E-9,,,\n"
+            "7,,,,\n"
+            "8,E-4,,Known,known@example.com\n"
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["created"], 2)
+        self.assertEqual(response.data["updated"], 1)
+        self.assertEqual(response.data["owners_created"], 1)
+        self.assertEqual(
+            [error["row"] for error in response.data["errors"]], [3, 4, 6, 5]
+        )
+        self.assertIn("warranty_start_date", response.data["errors"][0]["errors"])
+
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.no_of_homes, 2)
+        home = Home.objects.get(enrollment_no="E-1")
+        self.assertEqual(home.lot_no, "2")
+        self.assertEqual(str(home.warranty_start_date), "2024-01-31")
+        owner = Home.objects.get(enrollment_no="E-2").client
+        self.assertEqual(owner.email, "new@example.com")
+        self.assertEqual(owner.user_type, "client")
+        self.assertFalse(owner.has_usable_password())
+        self.assertTrue(hasattr(owner, "client"))
+        self.assertEqual(Home.objects.get(enrollment_no="E-4").client, self.owner)
+        self.assertEqual(Home.objects.get(enrollment_no="E-9").project, other_project)
+
+    def test_missing_columns_are_kept(self):
+        Home.objects.create(
+            project=self.project, enrollment_no="E-1", lot_no="1", client=self.owner
+        )
+
+        response = self.client.post(
+            reverse("home-list", args=[self.project.id]),
+            [{"enrollment_no": "E-1", "street_no": "12"}],
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        home = Home.objects.get(enrollment_no="E-1")
+        self.assertEqual((home.lot_no, home.street_no), ("1", "12"))
+        self.assertEqual(home.client, self.owner)
+
+    def test_queries_per_chunk(self):
+        rows = "".join(
+            f"E-{number},owner-{number}@example.com\n" for number in range(250)
+        )
+        with override_settings(HOME_IMPORT_CHUNK_SIZE=100):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.upload("enrollment_no,owner_email\n" + rows)
+
+        self.assertEqual(response.data["created"], 250)
+        self.assertEqual(response.data["owners_created"], 250)
+        self.assertEqual(Client.objects.count(), 250)
+        # a few statements per chunk, SQLite splits the inserts further
+        self.assertLess(len(queries), 50)
+
+    def test_unreadable_file(self):
+        response = self.upload("lot_no\n1\n")
+        self.assertEqual(response.status_code, 400)
+
+        response = self.upload("{}", name="homes.json")
+        self.assertEqual(response.status_code, 400)
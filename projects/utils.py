@@ -0,0 +1,251 @@
+import csv
+import io
+import json
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from projects.models import Home, Project
+from rest_framework import serializers
+from users.models import Client
+
+User = get_user_model()
+
+# CSV header, Home field, shared by the homes export and the import
+HOME_CSV_COLUMNS = [
+    ("Lot No.", "lot_no"),
+    ("Unit/Street No.", "street_no"),
+    ("Address", "address"),
+    ("Province", "province"),
+    ("City", "city"),
+    ("Postal Code", "postal_code"),
+    ("Enrolment No.", "enrollment_no"),
+    ("Home Type", "home_type"),
+    ("Warranty Start Date", "warranty_start_date"),
+    ("Home Owner", "owner_name"),
+    ("Home Owner Email", "owner_email"),
+    ("Home Owner Number", "owner_no"),
+]
+HOME_IMPORT_FIELDS = [field for _, field in HOME_CSV_COLUMNS]
+# the import accepts either the export headers or the field names
+HOME_IMPORT_HEADERS = {
+    **{field: field for field in HOME_IMPORT_FIELDS},
+    **{header: field for header, field in HOME_CSV_COLUMNS},
+}
+
+
+def read_home_rows(upload):
+    """Rows of an uploaded CSV or JSON file, the CSV is read line by line"""
+    if upload.name.lower().endswith(".json"):
+        try:
+            rows = json.load(upload)
+        except ValueError:
+            raise serializers.ValidationError("The file is not valid JSON")
+        if not isinstance(rows, list):
+            raise serializers.ValidationError(
+                "The JSON file should contain a list of homes"
+            )
+        return rows
+
+    # utf-8-sig drops the byte order mark spreadsheets put before the header
+    reader = csv.DictReader(io.TextIOWrapper(upload, encoding="utf-8-sig"))
+    try:
+        headers = reader.fieldnames or []
+    except (UnicodeDecodeError, csv.Error):
+        raise serializers.ValidationError("The file is not a valid CSV file")
+    if "enrollment_no" not in [HOME_IMPORT_HEADERS.get(h) for h in headers]:
+        raise serializers.ValidationError("The file has no enrolment number column")
+    return read_csv_rows(reader)
+
+
+def read_csv_rows(reader):
+    try:
+        yield from reader
+    except (UnicodeDecodeError, csv.Error):
+        raise serializers.ValidationError(
+            f"The file is not a valid CSV file after line {reader.line_num}"
+        )
+
+
+def clean_home_row(row):
+    """Home field values of one row, raises ValidationError with the bad fields"""
+    if not isinstance(row, dict):
+        raise ValidationError({"non_field_errors": ["Expected an object"]})
+
+    values = {}
+    errors = {}
+    for key, value in row.items():
+        field_name = HOME_IMPORT_HEADERS.get(key)
+        if field_name is None:
+            continue
+        field = Home._meta.get_field(field_name)
+        if isinstance(value, str):
+            value = value.strip()
+        # empty CSV cells are missing values
+        if value == "" and field.null:
+            value = None
+        try:
+            values[field_name] = field.clean(value, None)
+        except ValidationError as error:
+            errors[field_name] = error.messages
+    if "enrollment_no" not in values and "enrollment_no" not in errors:
+        errors["enrollment_no"] = ["Enrollment number cannot be empty"]
+    if errors:
+        raise ValidationError(errors)
+
+    if values.get("owner_email"):
+        values["owner_email"] = values["owner_email"].lower()
+    return values
+
+
+class HomeImporter:
+    """
+    Upserts the homes of a project in chunks. Every chunk costs a fixed
+    number of queries: one to find the existing homes, up to three to
+    provision the owners and one INSERT ... ON CONFLICT (enrollment_no) per
+    set of columns. Invalid rows are skipped and reported.
+    """
+
+    def __init__(self, project, chunk_size=None):
+        self.project = project
+        self.chunk_size = chunk_size or settings.HOME_IMPORT_CHUNK_SIZE
+        self.created = 0
+        self.updated = 0
+        self.owners_created = 0
+        self.errors = []
+        self.seen = set()
+
+    def run(self, rows):
+        """rows is any iterable of dicts, returns the import report"""
+        with transaction.atomic():
+            chunk = []
+            # rows are numbered from 1, the header of a CSV file is not counted
+            for number, row in enumerate(rows, start=1):
+                try:
+                    values = clean_home_row(row)
+                except ValidationError as error:
+                    self.add_error(number, error.message_dict)
+                    continue
+                if values["enrollment_no"] in self.seen:
+                    self.add_error(
+                        number,
+                        {"enrollment_no": ["Duplicate enrollment number in the file"]},
+                    )
+                    continue
+                self.seen.add(values["enrollment_no"])
+                chunk.append((number, values))
+                if len(chunk) >= self.chunk_size:
+                    self.import_chunk(chunk)
+                    chunk = []
+            if chunk:
+                self.import_chunk(chunk)
+
+            if self.created:
+                Project.objects.filter(pk=self.project.pk).update(
+                    no_of_homes=F("no_of_homes") + self.created
+                )
+
+        return {
+            "created": self.created,
+            "updated": self.updated,
+            "owners_created": self.owners_created,
+            "errors": self.errors,
+        }
+
+    def add_error(self, number, errors):
+        self.errors.append({"row": number, "errors": errors})
+
+    def import_chunk(self, chunk):
+        existing = {
+            enrollment_no: (project_id, client_id)
+            for enrollment_no, project_id, client_id in Home.objects.filter(
+                enrollment_no__in=[values["enrollment_no"] for _, values in chunk]
+            ).values_list("enrollment_no", "project_id", "client_id")
+        }
+
+        homes = []
+        for number, values in chunk:
+            project_id, client_id = existing.get(values["enrollment_no"], (None, None))
+            if project_id is not None and project_id != self.project.pk:
+                self.add_error(
+                    number,
+                    {"enrollment_no": ["A home of another project has this number"]},
+                )
+                continue
+            home = Home(project=self.project, client_id=client_id, **values)
+            home.import_fields = tuple(
+                field for field in HOME_IMPORT_FIELDS if field in values
+            )
+            homes.append(home)
+            if project_id is None:
+                self.created += 1
+            else:
+                self.updated += 1
+
+        owners = self.provision_owners(homes)
+        for home in homes:
+            if home.owner_email:
+                home.client_id = owners[home.owner_email]
+
+        # one upsert per set of columns so missing columns are left untouched
+        homes_by_fields = {}
+        for home in homes:
+            homes_by_fields.setdefault(home.import_fields, []).append(home)
+        for fields, field_homes in homes_by_fields.items():
+            update_fields = [field for field in fields if field != "enrollment_no"] + [
+                "client",
+                "updated_at",
+            ]
+            Home.objects.bulk_create(
+                field_homes,
+                batch_size=self.chunk_size,
+                update_conflicts=True,
+                unique_fields=["enrollment_no"],
+                update_fields=update_fields,
+            )
+
+    def provision_owners(self, homes):
+        """Ids of the owner users by email, creating Client users for new emails"""
+        owner_homes = {home.owner_email: home for home in homes if home.owner_email}
+        if not owner_homes:
+            return {}
+
+        owners = dict(
+            User.objects.filter(email__in=owner_homes).values_list("email", "id")
+        )
+        # unusable passwords are random, one per chunk spares the generation
+        password = make_password(None)
+        new_users = [
+            User(
+                username=email,
+                email=email,
+                first_name=home.owner_name or "",
+                phone_no=home.owner_no,
+                user_type="client",
+                password=password,
+            )
+            for email, home in owner_homes.items()
+            if email not in owners
+        ]
+        if not new_users:
+            return owners
+
+        # a user added by a concurrent request is kept and looked up again
+        User.objects.bulk_create(
+            new_users, batch_size=self.chunk_size, ignore_conflicts=True
+        )
+        created = dict(
+            User.objects.filter(
+                email__in=[user.email for user in new_users], client__isnull=True
+            ).values_list("email", "id")
+        )
+        Client.objects.bulk_create(
+            [Client(user_id=user_id) for user_id in created.values()],
+            batch_size=self.chunk_size,
+            ignore_conflicts=True,
+        )
+        self.owners_created += len(created)
+        owners.update(created)
+        return owners
@@ -9,7 +9,7 @@ from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
-from django.db.models import Count, Prefetch
+from django.db.models import Count, Prefetch, F
 from users.models import BuilderEmployee, Builder
 from users.permissions import IsAdminOrReadOnlyForBuilder
 from inspections.models import HomeInspection
@@ -17,11 +17,16 @@ from inspections.models import Deficiency
 from users.permissions import IsBuilder
 from users.permissions import IsEmployee
 from django.contrib.auth import get_user_model
-import csv
-from django.http import HttpResponse
+from project_utils.streaming import (
+    ITERATOR_CHUNK_SIZE,
+    csv_lines,
+    streaming_export_response,
+)
 from django_filters.rest_framework import DjangoFilterBackend
 from projects.filters import HomeFilter
-
+from projects.utils import HOME_CSV_COLUMNS, HomeImporter, read_home_rows
+from rest_framework.decorators import action
+from users.utils import get_tenant
 
 User = get_user_model()
 
@@ -86,10 +91,7 @@ class HomeViewSet(viewsets.ModelViewSet):
 
         elif user.user_type == "builder" or user.user_type == "employee":
             """allow builders to get homes for their own projects"""
-
-            if user.user_type == "employee":
-                user = user.employee.builder.user
-
+            user = get_tenant(self.request).builder_user
             project = get_object_or_404(Project, id=project_id, builder=user)
 
         queryset = Home.objects.filter(project=project).order_by("-updated_at")
@@ -120,28 +122,42 @@ class HomeViewSet(viewsets.ModelViewSet):
 
         if is_many:
             # For bulk creation
-            serializer = self.get_serializer(data=request.data, many=True)
-            serializer.is_valid(raise_exception=True)
-            self.perform_create(serializer)
-            headers = self.get_success_headers(serializer.data)
-            return Response(
-                serializer.data, status=status.HTTP_201_CREATED, headers=headers
-            )
+            return self.import_homes(request.data)
 
         else:
             # For single creation
             return super().create(request, *args, **kwargs)
 
+    @action(detail=False, methods=["post"], url_path="import", url_name="import")
+    def import_file(self, request, *args, **kwargs):
+        """
+        Upserts the homes of an uploaded CSV or JSON file, the CSV columns
+        are the ones of the homes export
+        """
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response(
+                {"file": ["No file was submitted."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return self.import_homes(read_home_rows(upload))
+
+    def import_homes(self, rows):
+        """Responds with the created and updated counts and the rejected rows"""
+        project = get_object_or_404(Project, id=self.kwargs.get("project_id"))
+        report = HomeImporter(project).run(rows)
+        return Response(report, status=status.HTTP_201_CREATED)
+
     def destroy(self, request, *args, **kwargs):
         """Reduce no_of_homes count in project when a home is deleted"""
 
         instance = self.get_object()
-        project = instance.project
+        project_id = instance.project_id
         response = super().destroy(request, *args, **kwargs)
         if response.status_code == status.HTTP_204_NO_CONTENT:
-            if project.no_of_homes > 0:
-                project.no_of_homes -= 1
-                project.save()
+            Project.objects.filter(pk=project_id, no_of_homes__gt=0).update(
+                no_of_homes=F("no_of_homes") - 1
+            )
         return response
 
 
@@ -247,12 +263,8 @@ class HomeDashboard(APIView):
 
         set_data = False
 
-        user = None
-        if request.user.user_type == "builder":
-            user = request.user
-        elif request.user.user_type == "employee":
-            user = request.user.employee.builder.user
-        elif request.user.user_type == "admin":
+        user = get_tenant(request).builder_user
+        if request.user.user_type == "admin":
             builder_id = request.GET.get("builder")
 
             if not builder_id:
@@ -269,19 +281,9 @@ class HomeDashboard(APIView):
                 .filter(project__builder=user)
                 .count()
             )
-            home_inspections = HomeInspection.objects.select_related(
-                "inspection"
-            ).filter(inspection__builder=user)
+            home_inspections = HomeInspection.objects.filter(builder=user)
             total_inspections = home_inspections.count()
-
-            # Counting deficiencies of selected home inspections to find total deficiencies
-            # This is better than retrieving total deficiencies from Deficiency db
-
-            def_count = 0
-            for inspection in home_inspections:
-                def_count += inspection.deficiencies.count()
-
-            total_def = def_count
+            total_def = Deficiency.objects.filter(builder=user).count()
 
         response_data = {
             "total_homes": total_homes,
@@ -296,47 +298,15 @@ class GenerateProjectHomesCSV(APIView):
     permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
 
     def get(self, request, project_id):
-        homes = Home.objects.filter(project_id=project_id)
-
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = (
-            f'attachment; filename="project_{project_id}_homes.csv"'
+        # tuples read through a server side cursor instead of model instances
+        homes = (
+            Home.objects.filter(project_id=project_id)
+            .values_list(*[field for _, field in HOME_CSV_COLUMNS])
+            .iterator(chunk_size=ITERATOR_CHUNK_SIZE)
         )
-
-        writer = csv.writer(response)
-        writer.writerow(
-            [
-                "Lot No.",
-                "Unit/Street No.",
-                "Address",
-                "Province",
-                "City",
-                "Postal Code",
-                "Enrolment No.",
-                "Home Type",
-                "Warranty Start Date",
-                "Home Owner",
-                "Home Owner Email",
-                "Home Owner Number",
-            ]
+        return streaming_export_response(
+            request,
+            csv_lines([header for header, _ in HOME_CSV_COLUMNS], homes),
+            f"project_{project_id}_homes.csv",
+            "text/csv",
         )
-
-        for home in homes:
-            writer.writerow(
-                [
-                    home.lot_no,
-                    home.street_no,
-                    home.address,
-                    home.province,
-                    home.city,
-                    home.postal_code,
-                    home.enrollment_no,
-                    home.home_type,
-                    home.warranty_start_date,
-                    home.owner_name,
-                    home.owner_email,
-                    home.owner_no,
-                ]
-            )
-
-        return response
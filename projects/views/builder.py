@@ -7,6 +7,7 @@ from projects.models import Project
 from projects.serializers.builder import BuilderProjectsListSerializer
 from projects.serializers.builder import BuilderProjectsRetrieveSerializer
 from rest_framework.viewsets import GenericViewSet
+from users.utils import get_tenant
 
 
 class BuilderProjectListRetrieveView(
@@ -20,12 +21,7 @@ class BuilderProjectListRetrieveView(
     )
 
     def get_queryset(self):
-        user = None
-        if self.request.user.user_type == "builder":
-            user = self.request.user
-        elif self.request.user.user_type == "employee":
-            user = self.request.user.employee.builder.user
-
+        user = get_tenant(self.request).builder_user
         return super().get_queryset().filter(builder=user)
 
     def get_serializer_class(self):
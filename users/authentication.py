@@ -0,0 +1,165 @@
+"""
+JWT authentication that keeps a snapshot of the user and of its builder,
+employee or trade profile in the cache instead of loading them on every
+request. Snapshots are keyed by a per user version that users.signals bumps
+whenever the user or one of its profiles is saved or deleted. The version
+only reaches the other processes through a shared cache, and reading it from
+DatabaseCache costs more queries than loading the user. With either of those
+caches the user is loaded from the database every time.
+"""
+
+import uuid
+from django.conf import settings
+from django.core.cache import cache, caches, DEFAULT_CACHE_ALIAS
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from users.models import User, Builder, BuilderEmployee, Trade
+
+# the password hash is not cached, it is loaded on first access
+USER_FIELDS = [
+    field.attname for field in User._meta.concrete_fields if field.attname != "password"
+]
+BUILDER_FIELDS = ["id", "user_id"]
+EMPLOYEE_FIELDS = ["id", "user_id", "builder_id", "role"]
+TRADE_FIELDS = ["id", "user_id", "services"]
+
+
+def cache_saves_queries(backend=None):
+    """
+    False for a cache that lives in each process, as LocMemCache does, and for
+    DatabaseCache, whose reads are queries themselves
+    """
+    return not isinstance(
+        backend or caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DatabaseCache)
+    )
+
+
+def version_key(user_id):
+    return f"auth-user-version:{user_id}"
+
+
+def get_user_version(user_id):
+    version = cache.get(version_key(user_id))
+    if version is None:
+        version = uuid.uuid4().hex
+        # keep the version of a concurrent request that stored one first
+        if not cache.add(version_key(user_id), version, None):
+            version = cache.get(version_key(user_id), version)
+    return version
+
+
+def bump_user_version(user_id):
+    """Makes the cached snapshot of a user stale"""
+    cache.set(version_key(user_id), uuid.uuid4().hex, None)
+
+
+def get_related(instance, name):
+    try:
+        return getattr(instance, name)
+    except ObjectDoesNotExist:
+        return None
+
+
+def get_values(instance, fields):
+    return [getattr(instance, field) for field in fields]
+
+
+def load_user_snapshot(user_id):
+    """Reads the user and its profiles with a single query"""
+    user = (
+        User.objects.select_related("builder", "employee__builder__user", "trade")
+        .filter(pk=user_id)
+        .first()
+    )
+    if user is None:
+        return None
+
+    snapshot = {"user": get_values(user, USER_FIELDS)}
+    builder = get_related(user, "builder")
+    if builder is not None:
+        snapshot["builder"] = get_values(builder, BUILDER_FIELDS)
+    employee = get_related(user, "employee")
+    if employee is not None:
+        snapshot["employee"] = get_values(employee, EMPLOYEE_FIELDS)
+        snapshot["employee_builder"] = get_values(employee.builder, BUILDER_FIELDS)
+        snapshot["employee_builder_user"] = get_values(
+            employee.builder.user, USER_FIELDS
+        )
+    trade = get_related(user, "trade")
+    if trade is not None:
+        snapshot["trade"] = get_values(trade, TRADE_FIELDS)
+    return snapshot
+
+
+def from_snapshot(model, fields, values):
+    """Instance of the cached values, see refresh_snapshot"""
+    instance = model.from_db(DEFAULT_DB_ALIAS, fields, values)
+    instance._snapshot_values = dict(zip(fields, values))
+    return instance
+
+
+def refresh_snapshot(instance):
+    """
+    Reloads the fields of a snapshot instance that were not changed since it
+    was built, so saving it does not write back stale cached values
+    """
+    snapshot_values = instance.__dict__.pop("_snapshot_values", None)
+    if snapshot_values is None:
+        return
+    unchanged = [
+        field
+        for field, value in snapshot_values.items()
+        if field != instance._meta.pk.attname and getattr(instance, field) == value
+    ]
+    if unchanged:
+        instance.refresh_from_db(fields=unchanged)
+
+
+def build_user(snapshot):
+    """User with its profiles set, as if loaded with select_related"""
+    user = from_snapshot(User, USER_FIELDS, snapshot["user"])
+    if "builder" in snapshot:
+        user.builder = from_snapshot(Builder, BUILDER_FIELDS, snapshot["builder"])
+    if "employee" in snapshot:
+        builder = from_snapshot(Builder, BUILDER_FIELDS, snapshot["employee_builder"])
+        builder.user = from_snapshot(
+            User, USER_FIELDS, snapshot["employee_builder_user"]
+        )
+        employee = from_snapshot(BuilderEmployee, EMPLOYEE_FIELDS, snapshot["employee"])
+        employee.builder = builder
+        user.employee = employee
+    if "trade" in snapshot:
+        user.trade = from_snapshot(Trade, TRADE_FIELDS, snapshot["trade"])
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN or not cache_saves_queries():
+            # the password hash is needed, which is never cached, or reading
+            # the snapshot would cost as many queries as loading the user
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        key = f"auth-user:{user_id}:{get_user_version(user_id)}"
+        snapshot = cache.get(key)
+        if snapshot is None:
+            snapshot = load_user_snapshot(user_id)
+            if snapshot is None:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            cache.set(key, snapshot, settings.AUTH_USER_CACHE_TIMEOUT)
+
+        user = build_user(snapshot)
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
@@ -1,6 +1,7 @@
 from django_filters import rest_framework as filters
 from django.db.models import Count, Q
 from users.models import User
+from users.utils import get_tenant
 
 
 class TradeFilter(filters.FilterSet):
@@ -41,9 +42,7 @@ class TradeFilter(filters.FilterSet):
             )
         else:  # incomplete_items
             # Get the builder user for filtering incomplete items
-            user = self.request.user
-            if user.user_type == "employee":
-                user = user.employee.builder.user
+            user = get_tenant(self.request).builder_user
 
             # Annotate with incomplete items count
             incomplete_statuses = ["incomplete", "pending_approval"]
@@ -52,7 +51,7 @@ class TradeFilter(filters.FilterSet):
                     "deficiencies",
                     filter=Q(
                         deficiencies__status__in=incomplete_statuses,
-                        deficiencies__home_inspection__inspection__builder=user,
+                        deficiencies__builder=user,
                     ),
                 )
             ).order_by(f"{'-' if sort_order == 'desc' else ''}incomplete_count")
@@ -1,86 +1,326 @@
 from django.core.management.base import BaseCommand
-from django.db.models import Count
+from django.db import DatabaseError, connection
+from django.db.models import Count, F, Func
+from django.utils import timezone
 from users.models import User
 from projects.models import Project, Home, BluePrint
-from inspections.models import Inspection, HomeInspection, Deficiency, DefImage
+from inspections.models import (
+    Inspection,
+    HomeInspection,
+    Deficiency,
+    DefImage,
+    DeficiencyUpdateLog,
+    DeficiencyNotification,
+)
+from inspections.management.commands.reconcile_counters import (
+    Command as ReconcileCountersCommand,
+)
 from datetime import datetime
+import glob
+import json
 import os
 
+# model, lookup of the builder user owning its rows
+TENANT_MODELS = [
+    (Project, "builder"),
+    (Home, "project__builder"),
+    (BluePrint, "home__project__builder"),
+    (Inspection, "builder"),
+    (HomeInspection, "builder"),
+    (Deficiency, "builder"),
+    (DefImage, "deficiency__builder"),
+    (DeficiencyUpdateLog, "deficiency__builder"),
+    (DeficiencyNotification, "deficiency__builder"),
+]
+
+# counter field, related lookup that is counted
+COUNTERS = ReconcileCountersCommand.COUNTERS + [
+    (HomeInspection, "total_items", "deficiencies"),
+]
+
+# rows whose owner or assignee was removed
+ORPHANS = {
+    "projects_without_builder": Project.objects.filter(builder__isnull=True),
+    "deficiencies_without_trade": Deficiency.objects.filter(trade__isnull=True),
+}
+
+
+class Abs(Func):
+    function = "ABS"
+
 
 class Command(BaseCommand):
-    help = "Generates a text file containing database statistics"
+    help = (
+        "Generates a database statistics report with per builder row counts, "
+        "table sizes, growth since the previous report and counter drift"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format",
+            action="append",
+            choices=["text", "json", "prometheus"],
+            help="Report formats to write, all of them by default. The JSON "
+            "report is always kept as the growth is computed from it.",
+        )
+        parser.add_argument("--output-dir", default="db_stats")
 
     def handle(self, *args, **options):
-        # Get the current timestamp for the filename
+        formats = set(options["format"] or ["text", "json", "prometheus"])
+        stats_dir = options["output_dir"]
+        os.makedirs(stats_dir, exist_ok=True)
+
+        stats = self.gather_stats(self.load_previous(stats_dir))
+
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"db_stats_{timestamp}.txt"
-
-        # Create the stats directory if it doesn't exist
-        stats_dir = "db_stats"
-        if not os.path.exists(stats_dir):
-            os.makedirs(stats_dir)
-
-        filepath = os.path.join(stats_dir, filename)
-
-        with open(filepath, "w") as f:
-            f.write("Database Statistics Report\n")
-            f.write("=" * 50 + "\n\n")
-
-            # Users statistics
-            f.write("Users Statistics:\n")
-            f.write("-" * 20 + "\n")
-            total_users = User.objects.count()
-            f.write(f"Total Users: {total_users}\n\n")
-
-            # Projects statistics
-            f.write("Projects Statistics:\n")
-            f.write("-" * 20 + "\n")
-            total_projects = Project.objects.count()
-            f.write(f"Total Projects: {total_projects}\n\n")
-
-            # Homes statistics
-            f.write("Homes Statistics:\n")
-            f.write("-" * 20 + "\n")
-            total_homes = Home.objects.count()
-            f.write(f"Total Homes: {total_homes}\n\n")
-
-            # BluePrints statistics
-            f.write("BluePrints Statistics:\n")
-            f.write("-" * 20 + "\n")
-            total_blueprints = BluePrint.objects.count()
-            f.write(f"Total BluePrints: {total_blueprints}\n\n")
-
-            # Inspections statistics
-            f.write("Inspections Statistics:\n")
-            f.write("-" * 20 + "\n")
-            total_inspections = Inspection.objects.count()
-            f.write(f"Total Inspections: {total_inspections}\n\n")
-
-            # Home Inspections statistics
-            f.write("Home Inspections Statistics:\n")
-            f.write("-" * 20 + "\n")
-            total_home_inspections = HomeInspection.objects.count()
-            f.write(f"Total Home Inspections: {total_home_inspections}\n\n")
-
-            # Deficiencies statistics
-            f.write("Deficiencies Statistics:\n")
-            f.write("-" * 20 + "\n")
-            total_deficiencies = Deficiency.objects.count()
-            f.write(f"Total Deficiencies: {total_deficiencies}\n\n")
-
-            # Deficiency Images statistics
-            f.write("Deficiency Images Statistics:\n")
-            f.write("-" * 20 + "\n")
-            total_def_images = DefImage.objects.count()
-            f.write(f"Total Deficiency Images: {total_def_images}\n\n")
-
-            # Add timestamp
-            f.write(
-                f'\nReport generated on: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\n'
-            )
+        filepath = os.path.join(stats_dir, f"db_stats_{timestamp}")
+        with open(f"{filepath}.json", "w") as f:
+            json.dump(stats, f, indent=4)
+        written = [f"{filepath}.json"]
+        if "text" in formats:
+            with open(f"{filepath}.txt", "w") as f:
+                f.write(self.format_text(stats))
+            written.append(f"{filepath}.txt")
+        if "prometheus" in formats:
+            with open(f"{filepath}.prom", "w") as f:
+                f.write(self.format_prometheus(stats))
+            written.append(f"{filepath}.prom")
 
         self.stdout.write(
             self.style.SUCCESS(
-                f"Successfully generated database statistics in {filepath}"
+                f"Successfully generated database statistics in {', '.join(written)}"
             )
         )
+
+    def load_previous(self, stats_dir):
+        reports = sorted(glob.glob(os.path.join(stats_dir, "db_stats_*.json")))
+        if not reports:
+            return None
+        with open(reports[-1]) as f:
+            return json.load(f)
+
+    def gather_stats(self, previous):
+        builders = dict(
+            User.objects.filter(user_type="builder").values_list("id", "email")
+        )
+        sizes = self.get_table_sizes()
+        previous_tables = previous["tables"] if previous else {}
+
+        tables = {}
+        users_by_type = dict(
+            User.objects.values_list("user_type").annotate(rows=Count("id")).order_by()
+        )
+        tables[User._meta.label] = {
+            "table": User._meta.db_table,
+            "rows": sum(users_by_type.values()),
+        }
+        # one grouped query per model instead of a full table COUNT(*)
+        for model, builder_lookup in TENANT_MODELS:
+            by_builder = {}
+            for builder_id, rows in (
+                model.objects.values_list(builder_lookup)
+                .annotate(rows=Count("id"))
+                .order_by()
+            ):
+                builder = builders.get(builder_id, "none") if builder_id else "none"
+                by_builder[builder] = by_builder.get(builder, 0) + rows
+            tables[model._meta.label] = {
+                "table": model._meta.db_table,
+                "rows": sum(by_builder.values()),
+                "by_builder": by_builder,
+            }
+
+        for label, table in tables.items():
+            table.update(
+                sizes.get(table["table"], {"table_bytes": None, "index_bytes": None})
+            )
+            previous_table = previous_tables.get(label)
+            table["growth"] = (
+                table["rows"] - previous_table["rows"] if previous_table else None
+            )
+
+        return {
+            "generated_at": timezone.now().isoformat(),
+            "previous_generated_at": previous["generated_at"] if previous else None,
+            "vendor": connection.vendor,
+            "users_by_type": users_by_type,
+            "tables": tables,
+            "database_bytes": self.get_database_size(),
+            "counter_drift": self.get_counter_drift(),
+            "orphans": {name: queryset.count() for name, queryset in ORPHANS.items()},
+        }
+
+    def get_counter_drift(self):
+        drift = {}
+        for model, field, lookup in COUNTERS:
+            # only the drifted rows are returned, so this stays a small query
+            differences = list(
+                model.objects.annotate(actual=Count(lookup))
+                .exclude(**{field: F("actual")})
+                .annotate(difference=Abs(F(field) - F("actual")))
+                .values_list("difference", flat=True)
+            )
+            drift[f"{model._meta.label}.{field}"] = {
+                "rows": len(differences),
+                "difference": sum(differences),
+            }
+        return drift
+
+    def get_database_size(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SELECT pg_database_size(current_database())")
+                return cursor.fetchone()[0]
+            if connection.vendor == "sqlite":
+                cursor.execute(
+                    "SELECT page_count * page_size "
+                    "FROM pragma_page_count(), pragma_page_size()"
+                )
+                return cursor.fetchone()[0]
+        return None
+
+    def get_table_sizes(self):
+        """Bytes used by every table and its indexes, empty if unsupported"""
+        tables = [User._meta.db_table] + [
+            model._meta.db_table for model, _ in TENANT_MODELS
+        ]
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(
+                    "SELECT relname, pg_table_size(oid), pg_indexes_size(oid) "
+                    "FROM pg_class WHERE relkind = 'r' AND relname = ANY(%s) "
+                    "AND pg_table_is_visible(oid)",
+                    [tables],
+                )
+                return {
+                    name: {"table_bytes": table_bytes, "index_bytes": index_bytes}
+                    for name, table_bytes, index_bytes in cursor.fetchall()
+                }
+            if connection.vendor == "sqlite":
+                # dbstat is only available when SQLite is compiled with it
+                try:
+                    cursor.execute(
+                        "SELECT m.tbl_name, m.type, SUM(s.pgsize) FROM dbstat s "
+                        "JOIN sqlite_master m ON m.name = s.name "
+                        "GROUP BY m.tbl_name, m.type"
+                    )
+                except DatabaseError:
+                    return {}
+                sizes = {}
+                for name, kind, size in cursor.fetchall():
+                    table = sizes.setdefault(name, {"table_bytes": 0, "index_bytes": 0})
+                    table["index_bytes" if kind == "index" else "table_bytes"] += size
+                return sizes
+        return {}
+
+    def format_text(self, stats):
+        lines = ["Database Statistics Report", "=" * 50, ""]
+        for label, table in stats["tables"].items():
+            lines.append(f"{label} Statistics:")
+            lines.append("-" * 20)
+            lines.append(f"Total Rows: {table['rows']}")
+            if table["growth"] is not None:
+                lines.append(f"Growth Since Previous Report: {table['growth']:+d}")
+            if table["table_bytes"] is not None:
+                lines.append(f"Table Size: {table['table_bytes']} bytes")
+                lines.append(f"Index Size: {table['index_bytes']} bytes")
+            for builder, rows in sorted(
+                table.get("by_builder", {}).items(), key=lambda item: -item[1]
+            ):
+                lines.append(f"  {builder}: {rows}")
+            lines.append("")
+
+        if stats["database_bytes"] is not None:
+            lines.append(f"Database Size: {stats['database_bytes']} bytes")
+            lines.append("")
+
+        lines.append("Users By Type:")
+        lines.append("-" * 20)
+        for user_type, rows in stats["users_by_type"].items():
+            lines.append(f"  {user_type}: {rows}")
+        lines.append("")
+
+        lines.append("Counter Drift:")
+        lines.append("-" * 20)
+        for counter, drift in stats["counter_drift"].items():
+            lines.append(
+                f"  {counter}: {drift['rows']} rows off by {drift['difference']}"
+            )
+        lines.append("")
+
+        lines.append("Orphans:")
+        lines.append("-" * 20)
+        for name, rows in stats["orphans"].items():
+            lines.append(f"  {name}: {rows}")
+
+        lines.append(f"\nReport generated on: {stats['generated_at']}")
+        return "\n".join(lines) + "\n"
+
+    def format_prometheus(self, stats):
+        metrics = {
+            "inspection_db_rows": ("gauge", "Rows per table and builder", []),
+            "inspection_db_rows_growth": (
+                "gauge",
+                "Rows added per table since the previous report",
+                [],
+            ),
+            "inspection_db_database_bytes": ("gauge", "Database size in bytes", []),
+            "inspection_db_table_bytes": ("gauge", "Table size in bytes", []),
+            "inspection_db_index_bytes": ("gauge", "Index size in bytes", []),
+            "inspection_db_counter_drift_rows": (
+                "gauge",
+                "Rows whose denormalized counter differs from the actual count",
+                [],
+            ),
+            "inspection_db_orphan_rows": (
+                "gauge",
+                "Rows whose owner or assignee was removed",
+                [],
+            ),
+        }
+
+        for table in stats["tables"].values():
+            labels = {"table": table["table"]}
+            by_builder = table.get("by_builder")
+            if by_builder is None:
+                metrics["inspection_db_rows"][2].append((labels, table["rows"]))
+            for builder, rows in (by_builder or {}).items():
+                metrics["inspection_db_rows"][2].append(
+                    ({**labels, "builder": builder}, rows)
+                )
+            for name, key in (
+                ("inspection_db_rows_growth", "growth"),
+                ("inspection_db_table_bytes", "table_bytes"),
+                ("inspection_db_index_bytes", "index_bytes"),
+            ):
+                if table[key] is not None:
+                    metrics[name][2].append((labels, table[key]))
+        if stats["database_bytes"] is not None:
+            metrics["inspection_db_database_bytes"][2].append(
+                ({}, stats["database_bytes"])
+            )
+        for counter, drift in stats["counter_drift"].items():
+            metrics["inspection_db_counter_drift_rows"][2].append(
+                ({"counter": counter}, drift["rows"])
+            )
+        for name, rows in stats["orphans"].items():
+            metrics["inspection_db_orphan_rows"][2].append(({"kind": name}, rows))
+
+        lines = []
+        for name, (metric_type, description, samples) in metrics.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                label_text = ",".join(
+                    f'{key}="{self.escape_label(value)}"'
+                    for key, value in labels.items()
+                )
+                lines.append(
+                    f"{name}{{{label_text}}} {value}"
+                    if label_text
+                    else f"{name} {value}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def escape_label(self, value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
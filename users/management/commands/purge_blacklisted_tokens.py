@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from users.models import BlacklistedToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes expired blacklisted tokens, and expired outstanding refresh "
+        "tokens with their blacklist entries, in batches"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        for model in (BlacklistedToken, OutstandingToken):
+            deleted = self.purge(
+                model.objects.filter(expires_at__lte=now), options["batch_size"]
+            )
+            self.stdout.write(f"{model._meta.label}: {deleted} expired rows deleted")
+        self.stdout.write(self.style.SUCCESS("Expired tokens purged"))
+
+    def purge(self, queryset, batch_size):
+        """Short deletes that do not hold locks on the whole table"""
+        deleted = 0
+        while True:
+            ids = list(queryset.values_list("pk", flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            queryset.model.objects.filter(pk__in=ids).delete()
+            deleted += len(ids)
@@ -0,0 +1,374 @@
+import random
+import time
+import uuid
+from datetime import timedelta
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from users.models import User, Builder, BuilderEmployee, Trade
+from projects.models import Project, Home
+from inspections.models import (
+    Inspection,
+    HomeInspection,
+    Deficiency,
+    DefImage,
+    DeficiencyUpdateLog,
+    DeficiencyNotification,
+)
+
+PROVINCES = {
+    "Ontario": ["Toronto", "Ottawa", "Mississauga", "Hamilton"],
+    "Alberta": ["Calgary", "Edmonton"],
+    "British Columbia": ["Vancouver", "Surrey"],
+}
+STREETS = ["Main St", "King St", "Queen St", "Maple Ave", "Oak Dr", "Pine Cres"]
+LOCATIONS = ["Kitchen", "Basement", "Garage", "Master Bedroom", "Bathroom", "Roof"]
+DEFECTS = ["Crack in", "Paint touch up on", "Missing trim on", "Leak under", "Loose"]
+INSPECTIONS = ["PDI", "30 Day", "Year End", "Second Year"]
+SERVICES = ["Drywall", "Plumbing", "Electrical", "Flooring", "Painting", "HVAC"]
+# complete, incomplete and pending approval share of the deficiencies
+STATUS_WEIGHTS = (("complete", 6), ("incomplete", 3), ("pending_approval", 1))
+
+
+class Command(BaseCommand):
+    help = "Generates a large deterministic dataset for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--builders", type=int, default=2)
+        parser.add_argument("--employees-per-builder", type=int, default=3)
+        parser.add_argument("--trades", type=int, default=20)
+        parser.add_argument(
+            "--builders-per-trade",
+            type=int,
+            default=2,
+            help="Max builders every trade works for",
+        )
+        parser.add_argument("--projects-per-builder", type=int, default=5)
+        parser.add_argument("--homes-per-project", type=int, default=50)
+        parser.add_argument("--inspections-per-builder", type=int, default=3)
+        parser.add_argument("--inspections-per-home", type=int, default=2)
+        parser.add_argument(
+            "--deficiencies-per-inspection",
+            type=int,
+            default=10,
+            help="Average deficiencies of a home inspection",
+        )
+        parser.add_argument("--images-per-deficiency", type=int, default=2)
+        parser.add_argument("--logs-per-deficiency", type=int, default=1)
+        parser.add_argument("--notifications-per-deficiency", type=int, default=2)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--prefix",
+            default="load",
+            help="Prefix of emails and enrollment numbers, change it to seed again",
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.random = random.Random(options["seed"])
+        # ids also depend on the prefix so the same seed can be loaded again
+        self.ids = random.Random(f"{options['prefix']}-{options['seed']}")
+        self.batch_size = options["batch_size"]
+        self.prefix = options["prefix"]
+        self.now = timezone.now()
+        self.counts = {}
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            builders = self.create_builders()
+            self.create_trades(builders)
+            home_inspections = self.create_homes_and_inspections(builders)
+        self.create_deficiencies(home_inspections)
+
+        for model_name, count in self.counts.items():
+            self.stdout.write(f"{model_name}: {count}")
+        self.stdout.write(
+            self.style.SUCCESS(f"Seeded in {time.perf_counter() - started:.1f} seconds")
+        )
+
+    def uuid(self):
+        return uuid.UUID(int=self.ids.getrandbits(128), version=4)
+
+    def bulk_create(self, model, objects):
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+        name = model._meta.object_name
+        self.counts[name] = self.counts.get(name, 0) + len(objects)
+        return objects
+
+    def new_user(self, user_type, email, first_name, last_name):
+        return User(
+            id=self.uuid(),
+            email=email,
+            username=email,
+            password=self.password,
+            user_type=user_type,
+            first_name=first_name,
+            last_name=last_name,
+            first_login=False,
+        )
+
+    def create_builders(self):
+        # hashing is slow, so every seeded user shares one password hash
+        self.password = make_password(f"{self.prefix}-password")
+        users = []
+        builders = []
+        employees = []
+        for index in range(self.options["builders"]):
+            user = self.new_user(
+                "builder",
+                f"{self.prefix}-builder-{index}@example.com",
+                "Builder",
+                str(index),
+            )
+            builder = Builder(id=self.uuid(), user=user)
+            builder.employee_users = [
+                self.new_user(
+                    "employee",
+                    f"{self.prefix}-employee-{index}-{number}@example.com",
+                    "Employee",
+                    f"{index}-{number}",
+                )
+                for number in range(self.options["employees_per_builder"])
+            ]
+            users.append(user)
+            users.extend(builder.employee_users)
+            builders.append(builder)
+            employees.extend(
+                BuilderEmployee(id=self.uuid(), user=employee_user, builder=builder)
+                for employee_user in builder.employee_users
+            )
+
+        self.bulk_create(User, users)
+        self.bulk_create(Builder, builders)
+        self.bulk_create(BuilderEmployee, employees)
+        return builders
+
+    def create_trades(self, builders):
+        users = []
+        trades = []
+        links = []
+        for builder in builders:
+            builder.trade_users = []
+        for index in range(self.options["trades"]):
+            user = self.new_user(
+                "trade",
+                f"{self.prefix}-trade-{index}@example.com",
+                self.random.choice(SERVICES),
+                str(index),
+            )
+            trade = Trade(id=self.uuid(), user=user, services=user.first_name)
+            count = self.random.randint(
+                1, min(self.options["builders_per_trade"], len(builders))
+            )
+            for builder in self.random.sample(builders, count):
+                builder.trade_users.append(user)
+                links.append(Trade.builder.through(trade=trade, builder=builder))
+            users.append(user)
+            trades.append(trade)
+
+        self.bulk_create(User, users)
+        self.bulk_create(Trade, trades)
+        self.bulk_create(Trade.builder.through, links)
+        return trades
+
+    def lot_no(self, number):
+        # mostly "block-lot" like "01-001" with some plain and unpadded ones
+        block, lot = divmod(number, 100)
+        style = self.random.random()
+        if style < 0.8:
+            return f"{block + 1:02d}-{lot + 1:03d}"
+        if style < 0.9:
+            return f"{block + 1}-{lot + 1}"
+        return str(number + 1)
+
+    def create_homes_and_inspections(self, builders):
+        projects = []
+        homes = []
+        inspections = []
+        home_inspections = []
+        for builder_index, builder in enumerate(builders):
+            builder_user = builder.user
+            builder_inspections = [
+                Inspection(
+                    id=self.uuid(),
+                    name=INSPECTIONS[number % len(INSPECTIONS)],
+                    warranty_type="Tarion",
+                    builder=builder_user,
+                )
+                for number in range(self.options["inspections_per_builder"])
+            ]
+            inspections.extend(builder_inspections)
+
+            for project_index in range(self.options["projects_per_builder"]):
+                province = self.random.choice(list(PROVINCES))
+                city = self.random.choice(PROVINCES[province])
+                project = Project(
+                    id=self.uuid(),
+                    name=f"{city} Project {builder_index}-{project_index}",
+                    province=province,
+                    city=city,
+                    builder=builder_user,
+                    no_of_homes=self.options["homes_per_project"],
+                )
+                projects.append(project)
+
+                for home_index in range(self.options["homes_per_project"]):
+                    home = Home(
+                        id=self.uuid(),
+                        project=project,
+                        lot_no=self.lot_no(home_index),
+                        street_no=str(self.random.randint(1, 999)),
+                        address=self.random.choice(STREETS),
+                        city=city,
+                        province=province,
+                        enrollment_no=(
+                            f"{self.prefix}-{builder_index}-{project_index}-{home_index}"
+                        ),
+                        warranty_start_date=(
+                            self.now - timedelta(days=self.random.randint(0, 1000))
+                        ).date(),
+                        owner_name=f"Owner {home_index}",
+                        owner_email=f"{self.prefix}-owner-{home_index}@example.com",
+                    )
+                    homes.append(home)
+
+                    count = min(
+                        self.options["inspections_per_home"], len(builder_inspections)
+                    )
+                    for inspection in self.random.sample(builder_inspections, count):
+                        home_inspection = self.plan_home_inspection(home, inspection)
+                        home_inspection.seed_builder = builder
+                        home_inspections.append(home_inspection)
+
+        self.bulk_create(Project, projects)
+        self.bulk_create(Home, homes)
+        self.bulk_create(Inspection, inspections)
+        self.bulk_create(HomeInspection, home_inspections)
+        return home_inspections
+
+    def plan_home_inspection(self, home, inspection):
+        """
+        Deficiency statuses are decided upfront so the counters are saved
+        with the home inspection instead of being updated afterwards
+        """
+        average = self.options["deficiencies_per_inspection"]
+        statuses = self.random.choices(
+            [status for status, _ in STATUS_WEIGHTS],
+            weights=[weight for _, weight in STATUS_WEIGHTS],
+            k=self.random.randint(0, average * 2),
+        )
+        completed_items = statuses.count("complete")
+        inspection.no_of_def += len(statuses)
+        home_inspection = HomeInspection(
+            inspection=inspection,
+            home=home,
+            builder_id=inspection.builder_id,
+            inspector=f"Inspector {self.random.randint(1, 20)}",
+            is_reviewed=self.random.random() < 0.5,
+            due_date=(self.now + timedelta(days=self.random.randint(-30, 90))).date(),
+            total_items=len(statuses),
+            completed_items=completed_items,
+            pending_items=len(statuses) - completed_items,
+        )
+        home_inspection.statuses = statuses
+        return home_inspection
+
+    def create_deficiencies(self, home_inspections):
+        """
+        Deficiencies and their rows are saved one batch at a time to bound
+        memory. Foreign keys are set by id as the related setters are slow.
+        """
+        deficiencies = []
+        for home_inspection in home_inspections:
+            builder = home_inspection.seed_builder
+            trade_ids = [user.id for user in builder.trade_users]
+            for status in home_inspection.statuses:
+                age = self.random.randint(0, 90)
+                deficiencies.append(
+                    Deficiency(
+                        home_inspection_id=home_inspection.id,
+                        builder_id=home_inspection.builder_id,
+                        location=self.random.choice(LOCATIONS),
+                        trade_id=self.random.choice(trade_ids) if trade_ids else None,
+                        description=(
+                            f"{self.random.choice(DEFECTS)} "
+                            f"{self.random.choice(LOCATIONS).lower()}"
+                        ),
+                        status=status,
+                        # completed between their creation and now
+                        completion_date=(
+                            (
+                                self.now - timedelta(days=self.random.randint(0, age))
+                            ).date()
+                            if status == "complete"
+                            else None
+                        ),
+                    )
+                )
+                deficiencies[-1].seed_builder = builder
+                deficiencies[-1].seed_created_at = self.now - timedelta(days=age)
+                if len(deficiencies) >= self.batch_size:
+                    self.create_deficiency_batch(deficiencies)
+                    deficiencies = []
+            # release the plan once its deficiencies are built
+            home_inspection.statuses = None
+        if deficiencies:
+            self.create_deficiency_batch(deficiencies)
+
+    def create_deficiency_batch(self, deficiencies):
+        with transaction.atomic():
+            self.bulk_create(Deficiency, deficiencies)
+            # created_at is auto_now_add, which bulk_create sets to now
+            for deficiency in deficiencies:
+                deficiency.created_at = deficiency.seed_created_at
+            Deficiency.objects.bulk_update(
+                deficiencies, ["created_at"], batch_size=self.batch_size
+            )
+
+            images = []
+            logs = []
+            notifications = []
+            for deficiency in deficiencies:
+                builder = deficiency.seed_builder
+                actor_name = builder.user.get_full_name()
+                description = f"Status Changed: incomplete to {deficiency.status}"
+                images.extend(
+                    DefImage(
+                        deficiency_id=deficiency.id,
+                        image=f"https://example.com/{self.prefix}/{deficiency.id}-{number}.jpg",
+                    )
+                    for number in range(self.options["images_per_deficiency"])
+                )
+                logs.extend(
+                    DeficiencyUpdateLog(
+                        deficiency_id=deficiency.id,
+                        actor_name=actor_name,
+                        description=description,
+                    )
+                    for _ in range(self.options["logs_per_deficiency"])
+                )
+                recipient_ids = [builder.user.id] + [
+                    user.id for user in builder.employee_users
+                ]
+                if deficiency.trade_id:
+                    recipient_ids.append(deficiency.trade_id)
+                count = min(
+                    self.options["notifications_per_deficiency"], len(recipient_ids)
+                )
+                notifications.extend(
+                    DeficiencyNotification(
+                        deficiency_id=deficiency.id,
+                        user_id=user_id,
+                        actor_name=actor_name,
+                        description=description,
+                        read=self.random.random() < 0.7,
+                    )
+                    for user_id in self.random.sample(recipient_ids, count)
+                )
+
+            self.bulk_create(DefImage, images)
+            self.bulk_create(DeficiencyUpdateLog, logs)
+            self.bulk_create(DeficiencyNotification, notifications)
+        self.stdout.write(f"Deficiencies: {self.counts['Deficiency']}")
@@ -0,0 +1,59 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:30
+
+import hashlib
+from datetime import datetime, timezone
+import jwt
+from django.conf import settings
+from django.db import migrations, models
+
+
+def hash_tokens(apps, schema_editor):
+    BlacklistedToken = apps.get_model("users", "BlacklistedToken")
+    for blacklisted in BlacklistedToken.objects.iterator():
+        blacklisted.token_hash = hashlib.sha256(blacklisted.token.encode()).hexdigest()
+        try:
+            payload = jwt.decode(blacklisted.token, options={"verify_signature": False})
+            blacklisted.expires_at = datetime.fromtimestamp(
+                payload["exp"], tz=timezone.utc
+            )
+        except (jwt.InvalidTokenError, KeyError):
+            blacklisted.expires_at = (
+                blacklisted.blacklisted_at
+                + settings.SIMPLE_JWT["ACCESS_TOKEN_LIFETIME"]
+            )
+        blacklisted.save(update_fields=["token_hash", "expires_at"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0014_remove_trade_builder_trade_builder"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blacklistedtoken",
+            name="token_hash",
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name="blacklistedtoken",
+            name="expires_at",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(hash_tokens, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="blacklistedtoken",
+            name="token",
+        ),
+        migrations.AlterField(
+            model_name="blacklistedtoken",
+            name="token_hash",
+            field=models.CharField(max_length=64, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="blacklistedtoken",
+            name="expires_at",
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:44
+
+import users.models
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    # the table of settings.CACHES when it uses DatabaseCache, kept if it exists
+    call_command("createcachetable", database=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0015_blacklistedtoken_token_hash"),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name="user",
+            managers=[
+                ("objects", users.models.UserManager()),
+            ],
+        ),
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
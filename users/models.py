@@ -1,9 +1,26 @@
 from django.db import models
+from django.contrib.auth import models as auth_models
 from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
 import uuid
 
 
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # sends no post_save, so the cached user snapshots are made stale here
+        from users.signals import invalidate_user_snapshot
+
+        user_ids = list(self.values_list("pk", flat=True))
+        rows = super().update(**kwargs)
+        for user_id in user_ids:
+            invalidate_user_snapshot(user_id)
+        return rows
+
+
+class UserManager(auth_models.UserManager.from_queryset(UserQuerySet)):
+    pass
+
+
 class User(AbstractUser):
     USER_TYPES = (
         ("admin", "Admin"),
@@ -26,6 +43,8 @@ class User(AbstractUser):
     postal_code = models.CharField(max_length=32, null=True, blank=True)
     phone_no = models.CharField(max_length=64, null=True, blank=True)
 
+    objects = UserManager()
+
     USERNAME_FIELD = "email"
     EMAIL_FIELD = "email"
     REQUIRED_FIELDS = ["username"]
@@ -92,8 +111,11 @@ class Client(models.Model):
 
 
 class BlacklistedToken(models.Model):
-    token = models.CharField(max_length=500, unique=True)
+    """Used token, stored as its SHA-256 digest until it expires"""
+
+    token_hash = models.CharField(max_length=64, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
     blacklisted_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Blacklisted token {self.token[:10]}..."
+        return f"Blacklisted token {self.token_hash[:10]}..."
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from projects.models import Home
+from users.utils import get_tenant
 
 User = get_user_model()
 
@@ -24,15 +25,11 @@ class BuilderTradeListSerializer(serializers.ModelSerializer):
         return obj.trade.services
 
     def get_incomplete_items(self, obj):
-        user = self.context["request"].user
-
         # retrieving the actual builder user in case of employee
-        if user.user_type == "employee":
-            user = user.employee.builder.user
-
+        user = get_tenant(self.context["request"]).builder_user
         incomplete_statuses = ["incomplete", "pending_approval"]
         return obj.deficiencies.filter(
-            status__in=incomplete_statuses, home_inspection__inspection__builder=user
+            status__in=incomplete_statuses, builder=user
         ).count()
 
 
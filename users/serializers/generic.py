@@ -3,14 +3,16 @@ from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
 from inspection_backend.settings import EMAIL_HOST_USER
 from inspection_backend.settings import RESET_PASSOWRD_LINK
 from users.models import Builder
 from users.models import Trade
 from users.models import Client
 from users.models import BuilderEmployee
-from users.models import BlacklistedToken
 from users.utils import (
+    blacklist_token,
+    is_token_blacklisted,
     send_reset_email,
     create_employee_for_builder,
     set_password_for_employee,
@@ -201,7 +203,7 @@ class AdminCreateUserSerializer(serializers.ModelSerializer):
 
 
 def validate_token_not_blacklisted(value):
-    if BlacklistedToken.objects.filter(token=value).exists():
+    if is_token_blacklisted(value):
         raise serializers.ValidationError(
             "This token has already been used and is no longer valid."
         )
@@ -286,6 +288,7 @@ class SetPasswordSerializer(serializers.Serializer):
         try:
             # Decode the token
             token = AccessToken(value)
+            self.expires_at = datetime_from_epoch(token["exp"])
             user_id = token["user_id"]
             self.user = User.objects.get(id=user_id)
         except Exception as e:
@@ -302,7 +305,7 @@ class SetPasswordSerializer(serializers.Serializer):
             # change password for the same employee instance as well
             set_password_for_employee(user, self.validated_data["password"])
         # Blacklist the token
-        BlacklistedToken.objects.create(token=self.validated_data["token"])
+        blacklist_token(self.validated_data["token"], self.expires_at)
 
 
 class ForgetPasswordSerializer(serializers.Serializer):
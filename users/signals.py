@@ -0,0 +1,45 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from users.authentication import bump_user_version, refresh_snapshot
+from users.models import User, Builder, BuilderEmployee, Trade
+
+
+def invalidate_user_snapshot(user_id):
+    """
+    Bumped right away for the current transaction and again on commit, so a
+    snapshot read by another request before the commit is not kept
+    """
+    bump_user_version(user_id)
+    transaction.on_commit(lambda: bump_user_version(user_id))
+
+
+@receiver(pre_save, sender=User)
+@receiver(pre_save, sender=Builder)
+@receiver(pre_save, sender=BuilderEmployee)
+@receiver(pre_save, sender=Trade)
+def refresh_cached_instance(sender, instance, **kwargs):
+    # request.user may be built from a cached snapshot
+    refresh_snapshot(instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    invalidate_user_snapshot(instance.pk)
+    if instance.user_type == "builder":
+        # snapshots of the employees include their builder user
+        for employee_user_id in BuilderEmployee.objects.filter(
+            builder__user=instance.pk
+        ).values_list("user_id", flat=True):
+            invalidate_user_snapshot(employee_user_id)
+
+
+@receiver(post_save, sender=Builder)
+@receiver(post_delete, sender=Builder)
+@receiver(post_save, sender=BuilderEmployee)
+@receiver(post_delete, sender=BuilderEmployee)
+@receiver(post_save, sender=Trade)
+@receiver(post_delete, sender=Trade)
+def invalidate_profile_user(sender, instance, **kwargs):
+    invalidate_user_snapshot(instance.user_id)
@@ -1,3 +1,463 @@
-from django.test import TestCase
+import glob
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock
+from django.core import mail
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+from users.authentication import CachedJWTAuthentication
+from users.models import User, Builder, BuilderEmployee, Trade, BlacklistedToken
+from users.utils import (
+    BloomFilter,
+    TokenBlacklistFilter,
+    blacklist_token,
+    get_tenant,
+    hash_token,
+    is_token_blacklisted,
+    token_blacklist_filter,
+)
+from projects.models import Home, Project
+from jobs.models import OutboxEmail
+from inspections.models import (
+    Inspection,
+    HomeInspection,
+    Deficiency,
+    DefImage,
+    DeficiencyNotification,
+)
 
-# Create your tests here.
+
+class SeedLoadDataTest(TestCase):
+    def seed(self, **options):
+        call_command(
+            "seed_load_data",
+            builders=2,
+            employees_per_builder=2,
+            trades=4,
+            projects_per_builder=2,
+            homes_per_project=5,
+            inspections_per_home=2,
+            deficiencies_per_inspection=3,
+            batch_size=7,
+            stdout=StringIO(),
+            **options,
+        )
+
+    def test_volumes_and_counters(self):
+        self.seed()
+
+        self.assertEqual(User.objects.filter(user_type="builder").count(), 2)
+        self.assertEqual(User.objects.filter(user_type="employee").count(), 4)
+        self.assertEqual(
+            Trade.objects.annotate(n=Count("builder")).filter(n=0).count(), 0
+        )
+        self.assertEqual(Home.objects.count(), 20)
+        self.assertEqual(HomeInspection.objects.count(), 40)
+        self.assertEqual(DefImage.objects.count(), Deficiency.objects.count() * 2)
+        self.assertTrue(DeficiencyNotification.objects.exists())
+        self.assertTrue(Home.objects.filter(lot_no="01-001").exists())
+        self.assertFalse(
+            Deficiency.objects.exclude(
+                builder=F("home_inspection__inspection__builder")
+            ).exists()
+        )
+        # completed deficiencies were created before their completion
+        self.assertFalse(
+            Deficiency.objects.filter(
+                completion_date__lt=TruncDate("created_at")
+            ).exists()
+        )
+        self.assertTrue(
+            Deficiency.objects.filter(
+                created_at__lt=timezone.now() - timedelta(days=1)
+            ).exists()
+        )
+
+        output = StringIO()
+        call_command("reconcile_counters", stdout=output)
+        self.assertIn("All counters are consistent", output.getvalue())
+        self.assertFalse(
+            HomeInspection.objects.annotate(actual=Count("deficiencies"))
+            .exclude(total_items=F("actual"))
+            .exists()
+        )
+        self.assertEqual(
+            sum(Inspection.objects.values_list("no_of_def", flat=True)),
+            Deficiency.objects.count(),
+        )
+
+    def test_same_seed_gives_the_same_data(self):
+        self.seed(prefix="first")
+        first = list(
+            Deficiency.objects.order_by("id").values_list("description", "status")
+        )
+        Deficiency.objects.all().delete()
+        self.seed(prefix="second")
+        second = list(
+            Deficiency.objects.order_by("id").values_list("description", "status")
+        )
+        self.assertEqual(first, second)
+
+
+class GenerateDbStatsTest(TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+
+    def generate(self):
+        call_command("generate_db_stats", output_dir=self.output_dir, stdout=StringIO())
+        reports = sorted(glob.glob(os.path.join(self.output_dir, "*.json")))
+        with open(reports[-1]) as f:
+            return json.load(f), reports[-1][: -len(".json")]
+
+    def test_report_per_builder_growth_and_drift(self):
+        builder = User.objects.create(email="builder@example.com", user_type="builder")
+        project = Project.objects.create(name="Project", builder=builder)
+        Home.objects.create(project=project, enrollment_no="E-1")
+        first, _ = self.generate()
+        self.assertIsNone(first["tables"]["projects.Home"]["growth"])
+
+        Home.objects.create(project=project, enrollment_no="E-2")
+        Project.objects.filter(pk=project.pk).update(no_of_homes=5)
+        # the previous report is found by its name, which has a second resolution
+        with mock.patch(
+            "users.management.commands.generate_db_stats.datetime"
+        ) as mocked_datetime:
+            mocked_datetime.now.return_value = datetime(2100, 1, 1)
+            stats, path = self.generate()
+
+        homes = stats["tables"]["projects.Home"]
+        self.assertEqual(homes["rows"], 2)
+        self.assertEqual(homes["by_builder"], {"builder@example.com": 2})
+        self.assertEqual(homes["growth"], 1)
+        self.assertEqual(
+            stats["counter_drift"]["projects.Project.no_of_homes"],
+            {"rows": 1, "difference": 3},
+        )
+
+        with open(f"{path}.prom") as f:
+            prometheus = f.read()
+        self.assertIn(
+            'inspection_db_rows{table="projects_home",builder="builder@example.com"} 2',
+            prometheus,
+        )
+        self.assertIn(
+            'inspection_db_counter_drift_rows{counter="projects.Project.no_of_homes"} 1',
+            prometheus,
+        )
+        with open(f"{path}.txt") as f:
+            self.assertIn("Growth Since Previous Report: +1", f.read())
+
+
+# a cache the processes of one host share, without the queries of DatabaseCache
+SHARED_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(tempfile.gettempdir(), "users-tests-cache"),
+    }
+}
+LOCAL_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+DATABASE_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "django_cache",
+    }
+}
+
+
+class TenantTestData:
+    @classmethod
+    def setUpTestData(cls):
+        cls.builder_user = User.objects.create(
+            email="builder@example.com", user_type="builder"
+        )
+        builder = Builder.objects.create(user=cls.builder_user)
+        cls.employee_user = User.objects.create(
+            email="employee@example.com", user_type="employee"
+        )
+        BuilderEmployee.objects.create(user=cls.employee_user, builder=builder)
+        trade_user = User.objects.create(email="trade@example.com", user_type="trade")
+        Trade.objects.create(user=trade_user).builder.add(builder)
+
+    def get_request(self, user):
+        request = RequestFactory().get("/")
+        request.user = User.objects.get(pk=user.pk)
+        return request
+
+
+class TenantTest(TenantTestData, TestCase):
+    def test_builder_needs_no_query(self):
+        request = self.get_request(self.builder_user)
+        with self.assertNumQueries(0):
+            tenant = get_tenant(request)
+        self.assertEqual(tenant.role, "builder")
+        self.assertEqual(tenant.builder_user, self.builder_user)
+
+    def test_employee_is_resolved_once_with_one_query(self):
+        request = self.get_request(self.employee_user)
+        with self.assertNumQueries(1):
+            tenant = get_tenant(request)
+            self.assertEqual(tenant.builder, self.builder_user.builder)
+            self.assertIs(get_tenant(request), tenant)
+        self.assertEqual(tenant.role, "employee")
+        self.assertEqual(tenant.builder_user, self.builder_user)
+
+    def test_other_users_have_no_builder(self):
+        tenant = get_tenant(self.get_request(User.objects.get(user_type="trade")))
+        self.assertIsNone(tenant.builder_user)
+        self.assertIsNone(tenant.builder)
+
+    def test_view_filter_and_serializer_share_the_tenant(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(pk=self.employee_user.pk))
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(
+                reverse("builder-trade-list"), {"sort_by": "incomplete_items"}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 1)
+        employee_queries = [
+            query for query in queries if BuilderEmployee._meta.db_table in query["sql"]
+        ]
+        self.assertEqual(len(employee_queries), 1)
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class CachedJWTAuthenticationTest(TenantTestData, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.authentication = CachedJWTAuthentication()
+
+    def authenticate(self, user):
+        return self.authentication.get_user(AccessToken.for_user(user))
+
+    def test_snapshot_is_reused_until_the_user_is_saved(self):
+        with self.assertNumQueries(1):
+            self.authenticate(self.builder_user)
+        with self.assertNumQueries(0):
+            user = self.authenticate(self.builder_user)
+            self.assertEqual(user, self.builder_user)
+            self.assertEqual(user.builder, self.builder_user.builder)
+            self.assertEqual(user.email, "builder@example.com")
+
+        self.builder_user.first_name = "Bob"
+        self.builder_user.save()
+        with self.assertNumQueries(1):
+            user = self.authenticate(self.builder_user)
+        self.assertEqual(user.first_name, "Bob")
+
+    def test_employee_snapshot_includes_the_builder(self):
+        self.authenticate(self.employee_user)
+        request = self.get_request(self.employee_user)
+        with self.assertNumQueries(0):
+            request.user = self.authenticate(self.employee_user)
+            tenant = get_tenant(request)
+            self.assertEqual(tenant.builder_user.email, "builder@example.com")
+            self.assertEqual(tenant.builder, self.builder_user.builder)
+
+        # a changed builder user is seen by its employees
+        self.builder_user.first_name = "Bob"
+        self.builder_user.save()
+        user = self.authenticate(self.employee_user)
+        self.assertEqual(user.employee.builder.user.first_name, "Bob")
+
+    def test_saving_the_snapshot_user_keeps_the_password(self):
+        self.employee_user.set_password("secret")
+        self.employee_user.save()
+
+        user = self.authenticate(self.employee_user)
+        user.first_name = "Eve"
+        user.save()
+
+        user = User.objects.get(pk=self.employee_user.pk)
+        self.assertEqual(user.first_name, "Eve")
+        self.assertTrue(user.check_password("secret"))
+
+    def test_saving_the_snapshot_user_reloads_other_fields(self):
+        user = self.authenticate(self.employee_user)
+        User.objects.filter(pk=self.employee_user.pk).update(last_name="Smith")
+        user.first_name = "Eve"
+        user.save()
+
+        user = User.objects.get(pk=self.employee_user.pk)
+        self.assertEqual(user.first_name, "Eve")
+        self.assertEqual(user.last_name, "Smith")
+
+    def test_queryset_update_makes_the_snapshot_stale(self):
+        self.authenticate(self.builder_user)
+        User.objects.filter(pk=self.builder_user.pk).update(is_active=False)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(self.builder_user)
+
+    @override_settings(CACHES=LOCAL_CACHES)
+    def test_cache_of_each_process_is_not_used(self):
+        self.authenticate(self.builder_user)
+        # another process could not make the snapshot stale
+        with self.assertNumQueries(1):
+            user = self.authenticate(self.builder_user)
+        self.assertEqual(user, self.builder_user)
+
+    @override_settings(CACHES=DATABASE_CACHES)
+    def test_database_cache_is_not_used(self):
+        self.authenticate(self.builder_user)
+        # the user query alone, no read of the cache table
+        with self.assertNumQueries(1):
+            user = self.authenticate(self.builder_user)
+        self.assertEqual(user, self.builder_user)
+
+    def test_inactive_user_is_rejected(self):
+        self.authenticate(self.builder_user)
+        self.builder_user.is_active = False
+        self.builder_user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(self.builder_user)
+
+    def test_request_needs_no_auth_query(self):
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.employee_user)}"
+        )
+        url = reverse("builder-trade-list")
+        self.assertEqual(client.get(url).status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # only the trade list itself is queried, not the user or the employee
+        for query in queries:
+            self.assertNotIn('WHERE "users_user"."id" =', query["sql"])
+            self.assertNotIn(BuilderEmployee._meta.db_table, query["sql"])
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class TokenBlacklistTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        token_blacklist_filter.reset()
+        self.user = User.objects.create(email="trade@example.com", user_type="trade")
+
+    def test_set_password_token_can_only_be_used_once(self):
+        token = str(AccessToken.for_user(self.user))
+        data = {"token": token, "password": "secret-password"}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("set-user-password"), data)
+        self.assertEqual(response.status_code, 200)
+
+        blacklisted = BlacklistedToken.objects.get()
+        self.assertEqual(blacklisted.token_hash, hash_token(token))
+        self.assertGreater(blacklisted.expires_at, timezone.now())
+
+        response = self.client.post(reverse("set-user-password"), data)
+        self.assertEqual(response.status_code, 400)
+
+    def test_tokens_not_blacklisted_skip_the_database(self):
+        blacklist_token("used", timezone.now() + timedelta(hours=1))
+        self.assertTrue(is_token_blacklisted("used"))
+        with self.assertNumQueries(0):
+            self.assertFalse(is_token_blacklisted("unused"))
+
+    def test_filter_reloads_when_another_process_blacklists(self):
+        self.assertFalse(is_token_blacklisted("used"))
+        # blacklisted by another process, which announces it through the cache
+        BlacklistedToken.objects.create(
+            token_hash=hash_token("used"),
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        cache.set(TokenBlacklistFilter.GENERATION_KEY, "other")
+        self.assertTrue(is_token_blacklisted("used"))
+
+    def test_second_process_sees_the_blacklisted_token(self):
+        location = SHARED_CACHES["default"]["LOCATION"]
+        first = TokenBlacklistFilter(FileBasedCache(location, {}))
+        second = TokenBlacklistFilter(FileBasedCache(location, {}))
+        self.assertFalse(second.might_contain(hash_token("used")))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BlacklistedToken.objects.create(
+                token_hash=hash_token("used"),
+                expires_at=timezone.now() + timedelta(hours=1),
+            )
+            first.add(hash_token("used"))
+        self.assertTrue(second.might_contain(hash_token("used")))
+
+    def test_filter_is_not_used_without_a_shared_cache(self):
+        first = TokenBlacklistFilter(LocMemCache("first", {}))
+        second = TokenBlacklistFilter(LocMemCache("second", {}))
+        self.assertTrue(second.might_contain(hash_token("unused")))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            blacklist_token("used", timezone.now() + timedelta(hours=1))
+            first.add(hash_token("used"))
+        self.assertTrue(second.might_contain(hash_token("used")))
+        with override_settings(CACHES=LOCAL_CACHES):
+            self.assertTrue(is_token_blacklisted("used"))
+            self.assertFalse(is_token_blacklisted("unused"))
+
+    @override_settings(CACHES=DATABASE_CACHES)
+    def test_filter_is_not_used_with_the_database_cache(self):
+        blacklist_token("used", timezone.now() + timedelta(hours=1))
+        # the token lookup alone, no read of the generation from the cache table
+        with self.assertNumQueries(1):
+            self.assertFalse(is_token_blacklisted("unused"))
+        self.assertTrue(is_token_blacklisted("used"))
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom_filter = BloomFilter(1000)
+        digests = [hash_token(str(number)) for number in range(1000)]
+        for digest in digests:
+            bloom_filter.add(digest)
+        self.assertTrue(all(digest in bloom_filter for digest in digests))
+        false_positives = sum(
+            hash_token(f"other-{number}") in bloom_filter for number in range(1000)
+        )
+        self.assertLess(false_positives, 50)
+
+    def test_purge_deletes_expired_tokens(self):
+        now = timezone.now()
+        blacklist_token("expired", now - timedelta(minutes=1))
+        blacklist_token("valid", now + timedelta(minutes=1))
+
+        output = StringIO()
+        call_command("purge_blacklisted_tokens", batch_size=1, stdout=output)
+
+        self.assertEqual(
+            list(BlacklistedToken.objects.values_list("token_hash", flat=True)),
+            [hash_token("valid")],
+        )
+        self.assertIn(
+            "users.BlacklistedToken: 1 expired rows deleted", output.getvalue()
+        )
+
+
+class ForgetPasswordEmailTest(TestCase):
+    def test_reset_email_is_queued(self):
+        user = User.objects.create(email="builder@example.com", user_type="builder")
+
+        with override_settings(JOB_RUN_EAGERLY=True, EMAIL_OUTBOX_RATE_LIMIT=0):
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                response = APIClient().post(
+                    reverse("forget-password"), {"email": user.email}
+                )
+                self.assertEqual(response.status_code, 200)
+                # the request only saved the email
+                self.assertEqual(mail.outbox, [])
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [user.email])
+        self.assertEqual(OutboxEmail.objects.get().status, "sent")
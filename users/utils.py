@@ -1,10 +1,18 @@
-from inspection_backend.settings import EMAIL_HOST_USER
+import hashlib
+import math
+import threading
+import time
+import uuid
 from inspection_backend.settings import RESET_PASSOWRD_LINK
-from django.core.mail import send_mail
 from django.contrib.auth import get_user_model
-from users.models import BuilderEmployee
+from django.conf import settings
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.db import transaction
+from django.utils import timezone
+from users.authentication import cache_saves_queries
+from users.models import BuilderEmployee, BlacklistedToken
 from django.template.loader import render_to_string
-from django.core.mail import EmailMultiAlternatives
+from jobs.outbox import queue_email
 from inspection_backend.settings import FRONTEND_URL
 
 User = get_user_model()
@@ -16,12 +24,10 @@ def send_reset_email(email, token, builder=None, trade=None, is_trade=False):
     """
     if not is_trade:
         link = f"{RESET_PASSOWRD_LINK}?token={token}"
-        send_mail(
+        queue_email(
             "Reset your password",
-            f"Click the link to set your password: {link}",
-            f"Builder Eye <{EMAIL_HOST_USER}>",
             [email],
-            fail_silently=False,
+            body=f"Click the link to set your password: {link}",
         )
     else:
         if not trade:
@@ -41,14 +47,7 @@ def send_reset_email(email, token, builder=None, trade=None, is_trade=False):
             },
         )
 
-        msg = EmailMultiAlternatives(
-            subject,
-            "",
-            f"Builder Eye <{EMAIL_HOST_USER}>",
-            [trade.user.email],
-        )
-        msg.attach_alternative(message, "text/html")
-        msg.send()
+        queue_email(subject, [trade.user.email], html_body=message)
 
 
 def send_trade_welcome_email(trade, builder):
@@ -65,14 +64,7 @@ def send_trade_welcome_email(trade, builder):
         },
     )
 
-    msg = EmailMultiAlternatives(
-        subject,
-        "",
-        f"Builder Eye <{EMAIL_HOST_USER}>",
-        [trade.user.email],
-    )
-    msg.attach_alternative(message, "text/html")
-    msg.send()
+    queue_email(subject, [trade.user.email], html_body=message)
 
 
 def create_employee_for_builder(instance):
@@ -105,3 +97,168 @@ def set_password_for_employee(instance, password):
         employee.save()
     except User.DoesNotExist:
         return
+
+
+class Tenant:
+    """
+    Builder whose data the user of a request works on. Employees work on
+    their builder's data, builders on their own and other users on none.
+    """
+
+    def __init__(self, user, builder_user=None):
+        self.user = user
+        self.role = user.user_type
+        self.builder_user = builder_user
+
+    @property
+    def builder(self):
+        """Builder profile, already loaded for employees"""
+        if self.builder_user is None:
+            return None
+        return self.builder_user.builder
+
+
+def get_tenant(request):
+    """
+    Resolves the tenant of the request user once per request. The views,
+    filters and serializers of a request share it through the request.
+    """
+    http_request = getattr(request, "_request", request)
+    if getattr(http_request, "tenant", None) is None:
+        http_request.tenant = resolve_tenant(request.user)
+    return http_request.tenant
+
+
+def resolve_tenant(user):
+    if user.user_type == "builder":
+        return Tenant(user, builder_user=user)
+    if user.user_type == "employee":
+        if User.employee.is_cached(user):
+            # already set by users.authentication.CachedJWTAuthentication
+            employee = user.employee
+        else:
+            # a single query for the employee, their builder and its user
+            employee = (
+                BuilderEmployee.objects.select_related("builder__user")
+                .filter(user=user)
+                .first()
+            )
+        if employee is not None:
+            user.employee = employee
+            return Tenant(user, builder_user=employee.builder.user)
+    return Tenant(user)
+
+
+class BloomFilter:
+    """
+    Set of SHA-256 hex digests that may answer "maybe" for a digest it does
+    not hold but never answers "no" for one it holds. The bit positions are
+    taken from the digest itself, which is already uniformly distributed.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = min(8, max(1, round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, digest):
+        value = int(digest, 16)
+        for _ in range(self.hash_count):
+            yield value % self.size
+            value >>= 32
+
+    def add(self, digest):
+        for position in self.positions(digest):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, digest):
+        return all(
+            self.bits[position // 8] & (1 << (position % 8))
+            for position in self.positions(digest)
+        )
+
+
+class TokenBlacklistFilter:
+    """
+    In process filter of the blacklisted token digests, so tokens that are
+    not blacklisted are accepted without a query. It is rebuilt from the
+    database when TOKEN_BLACKLIST_FILTER_MAX_AGE has passed or when another
+    process blacklisted a token, which is announced through the cache. A
+    cache that is not shared could not announce it and reading DatabaseCache
+    is a query itself, so with either every token is looked up in the
+    database.
+    """
+
+    GENERATION_KEY = "token-blacklist-generation"
+
+    def __init__(self, cache=None):
+        self._lock = threading.Lock()
+        self._filter = None
+        self._generation = None
+        self._loaded_at = 0
+        self._cache = cache
+
+    @property
+    def cache(self):
+        return self._cache or caches[DEFAULT_CACHE_ALIAS]
+
+    def load(self, generation):
+        bloom_filter = BloomFilter(settings.TOKEN_BLACKLIST_FILTER_CAPACITY)
+        for token_hash in BlacklistedToken.objects.filter(
+            expires_at__gt=timezone.now()
+        ).values_list("token_hash", flat=True):
+            bloom_filter.add(token_hash)
+        self._filter = bloom_filter
+        self._generation = generation
+        self._loaded_at = time.monotonic()
+
+    def might_contain(self, token_hash):
+        if not cache_saves_queries(self.cache):
+            return True
+        generation = self.cache.get(self.GENERATION_KEY)
+        with self._lock:
+            if (
+                self._filter is None
+                or generation != self._generation
+                or time.monotonic() - self._loaded_at
+                > settings.TOKEN_BLACKLIST_FILTER_MAX_AGE
+            ):
+                self.load(generation)
+            return token_hash in self._filter
+
+    def add(self, token_hash):
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(token_hash)
+        # other processes reload their filter once the token is committed
+        cache = self.cache
+        transaction.on_commit(
+            lambda: cache.set(self.GENERATION_KEY, uuid.uuid4().hex, None)
+        )
+
+    def reset(self):
+        with self._lock:
+            self._filter = None
+
+
+token_blacklist_filter = TokenBlacklistFilter()
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def is_token_blacklisted(token):
+    token_hash = hash_token(token)
+    if not token_blacklist_filter.might_contain(token_hash):
+        return False
+    return BlacklistedToken.objects.filter(token_hash=token_hash).exists()
+
+
+def blacklist_token(token, expires_at):
+    """Blacklists a token until it expires, see purge_blacklisted_tokens"""
+    token_hash = hash_token(token)
+    BlacklistedToken.objects.get_or_create(
+        token_hash=token_hash, defaults={"expires_at": expires_at}
+    )
+    token_blacklist_filter.add(token_hash)
@@ -8,11 +8,11 @@ from django.contrib.auth import get_user_model
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework import status
-from django.core.mail import send_mail
-from inspection_backend.settings import EMAIL_HOST_USER
+from jobs.outbox import queue_email
 from inspection_backend.settings import RESET_PASSOWRD_LINK
 from users.models import User
 from users.filters import TradeFilter
+from users.utils import get_tenant
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import OrderingFilter
 
@@ -29,14 +29,8 @@ class BuilderTradeListView(
     filterset_class = TradeFilter
 
     def get_queryset(self):
-        builder = None
-
-        if self.request.user.user_type == "builder":
-            builder = self.request.user.builder
-        elif self.request.user.user_type == "employee":
-            builder = self.request.user.employee.builder
-
-        return super().get_queryset().filter(trade__builder=builder)
+        builder = get_tenant(self.request).builder_user
+        return super().get_queryset().filter(trade__builder__user=builder)
 
 
 class OwnerInviteView(APIView):
@@ -51,22 +45,14 @@ class OwnerInviteView(APIView):
             if owner:
                 if owner.client.is_invited:
                     text = "You've been invited by the builder to view inspections. You can use your created credentials to login into your account"
-                    send_mail(
-                        "Inspection Invitation",
-                        text,
-                        f"Builder Eye <{EMAIL_HOST_USER}>",
-                        [owner.email],
-                        fail_silently=False,
-                    )
+                    queue_email("Inspection Invitation", [owner.email], body=text)
                 else:
                     token = AccessToken.for_user(owner)
                     link = f"{RESET_PASSOWRD_LINK}?token={token}"
-                    send_mail(
+                    queue_email(
                         "Reset your password",
-                        f"Click the link to set your password: {link}",
-                        f"Builder Eye <{EMAIL_HOST_USER}>",
                         [owner.email],
-                        fail_silently=False,
+                        body=f"Click the link to set your password: {link}",
                     )
                     owner.client.is_invited = True
                     owner.client.save()